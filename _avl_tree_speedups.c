@@ -0,0 +1,633 @@
+/*
+ * Compiled versions of the node primitives of avl_tree: the descent from the root to a
+ * key, the rebalancing of a path after an insert or a delete, and the in-order traversals.
+ *
+ * avl_tree imports this module when it has been built, and falls back on its own
+ * pure-Python primitives, which behave exactly the same, otherwise. Build it in place with
+ *
+ *     python setup.py build_ext --inplace
+ *
+ * The nodes are the _AVLNode objects of avl_tree, which keep their fields in __slots__.
+ * setup() reads the offsets of those slots once, so that the primitives below read and
+ * write the fields directly instead of going through attribute lookups. Subclasses of
+ * _AVLNode keep the same offsets for the inherited slots.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <structmember.h>
+
+static PyTypeObject *node_type = NULL;
+static PyObject *empty_node = NULL;
+static PyObject *root_name = NULL;
+static Py_ssize_t entry_offset, key_offset, left_offset, right_offset, height_offset,
+    size_offset;
+
+#define SLOT(node, offset) (*(PyObject **)((char *)(node) + (offset)))
+
+/* Returns a borrowed reference to a field of node, or NULL with an exception set. */
+static PyObject *
+get_field(PyObject *node, Py_ssize_t offset)
+{
+    PyObject *value;
+
+    if (node_type == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "_avl_tree_speedups.setup() was not called");
+        return NULL;
+    }
+    if (!PyObject_TypeCheck(node, node_type)) {
+        PyErr_Format(PyExc_TypeError, "expected a tree node, not %.200s",
+                     Py_TYPE(node)->tp_name);
+        return NULL;
+    }
+    value = SLOT(node, offset);
+    if (value == NULL) {
+        PyErr_SetString(PyExc_AttributeError, "tree node field is not set");
+    }
+    return value;
+}
+
+/* Replaces a field of node, stealing the reference to value. */
+static void
+set_field(PyObject *node, Py_ssize_t offset, PyObject *value)
+{
+    Py_XSETREF(SLOT(node, offset), value);
+}
+
+/* Returns the height or the size of node, zero for the empty node, -1 on error. */
+static Py_ssize_t
+get_number(PyObject *node, Py_ssize_t offset)
+{
+    PyObject *value;
+
+    if (node == empty_node) {
+        return 0;
+    }
+    value = get_field(node, offset);
+    if (value == NULL) {
+        return -1;
+    }
+    return PyLong_AsSsize_t(value);
+}
+
+static int
+set_number(PyObject *node, Py_ssize_t offset, Py_ssize_t number)
+{
+    PyObject *value = PyLong_FromSsize_t(number);
+
+    if (value == NULL) {
+        return -1;
+    }
+    set_field(node, offset, value);
+    return 0;
+}
+
+/* Same as _AVLNode._update_height. */
+static int
+update_height(PyObject *node)
+{
+    PyObject *left = get_field(node, left_offset);
+    PyObject *right = get_field(node, right_offset);
+    Py_ssize_t left_height, right_height, left_size, right_size;
+
+    if (left == NULL || right == NULL) {
+        return -1;
+    }
+    left_height = get_number(left, height_offset);
+    right_height = get_number(right, height_offset);
+    left_size = get_number(left, size_offset);
+    right_size = get_number(right, size_offset);
+    if (PyErr_Occurred()) {
+        return -1;
+    }
+    if (set_number(node, height_offset,
+                   1 + (left_height > right_height ? left_height : right_height)) < 0) {
+        return -1;
+    }
+    return set_number(node, size_offset, 1 + left_size + right_size);
+}
+
+/* Returns the balance factor of node. Check PyErr_Occurred for errors. */
+static Py_ssize_t
+balance_factor(PyObject *node)
+{
+    PyObject *left, *right;
+
+    if (node == empty_node) {
+        return 0;
+    }
+    left = get_field(node, left_offset);
+    right = get_field(node, right_offset);
+    if (left == NULL || right == NULL) {
+        return 0;
+    }
+    return get_number(left, height_offset) - get_number(right, height_offset);
+}
+
+/* Sets a TypeError unless the function got the expected number of arguments. */
+static int
+check_arguments(const char *name, Py_ssize_t nargs, Py_ssize_t expected)
+{
+    if (nargs != expected) {
+        PyErr_Format(PyExc_TypeError, "%s() takes %zd arguments (%zd given)", name,
+                     expected, nargs);
+        return 0;
+    }
+    return 1;
+}
+
+/* Rotates the subtree rooted at node, towards the left if to_left, else towards the right.
+ * Returns a new reference to the new root of the subtree, or NULL on error. */
+static PyObject *
+rotate(PyObject *node, int to_left)
+{
+    Py_ssize_t outer = to_left ? right_offset : left_offset;
+    Py_ssize_t inner = to_left ? left_offset : right_offset;
+    PyObject *child = get_field(node, outer);
+    PyObject *grandchild;
+
+    if (child == NULL) {
+        return NULL;
+    }
+    grandchild = get_field(child, inner);
+    if (grandchild == NULL) {
+        return NULL;
+    }
+    Py_INCREF(child);
+    Py_INCREF(grandchild);
+    set_field(node, outer, grandchild);
+    Py_INCREF(node);
+    set_field(child, inner, node);
+
+    if (update_height(node) < 0 || update_height(child) < 0) {
+        Py_DECREF(child);
+        return NULL;
+    }
+    return child;
+}
+
+/* Same as _AVLNode._balance_tree_if_unbalanced, returns a new reference. */
+static PyObject *
+balance(PyObject *node)
+{
+    Py_ssize_t factor = balance_factor(node);
+    int to_left = factor == -2;
+    Py_ssize_t heavy_offset = to_left ? right_offset : left_offset;
+    PyObject *heavy, *rotated;
+
+    if (PyErr_Occurred()) {
+        return NULL;
+    }
+    if (factor != 2 && factor != -2) {
+        Py_INCREF(node);
+        return node;
+    }
+
+    heavy = get_field(node, heavy_offset);
+    if (heavy == NULL) {
+        return NULL;
+    }
+    factor = balance_factor(heavy);
+    if (PyErr_Occurred()) {
+        return NULL;
+    }
+    if (factor == (to_left ? 1 : -1)) {
+        /* Double rotation: the heavy child first turns the other way. */
+        rotated = rotate(heavy, !to_left);
+        if (rotated == NULL) {
+            return NULL;
+        }
+        set_field(node, heavy_offset, rotated);
+    }
+    return rotate(node, to_left);
+}
+
+/* Same as AVLTree._replace_child for node trees. */
+static int
+replace_child(PyObject *tree, PyObject *path, PyObject *child, PyObject *new_child)
+{
+    Py_ssize_t length = PyList_GET_SIZE(path);
+    PyObject *parent, *left;
+
+    if (length == 0) {
+        return PyObject_SetAttr(tree, root_name, new_child);
+    }
+    parent = PyList_GET_ITEM(path, length - 1);
+    left = get_field(parent, left_offset);
+    if (left == NULL) {
+        return -1;
+    }
+    Py_INCREF(new_child);
+    set_field(parent, left == child ? left_offset : right_offset, new_child);
+    return 0;
+}
+
+PyDoc_STRVAR(setup_doc,
+"setup(node_type, empty_node)\n\
+\n\
+Reads the slot offsets of node_type, the _AVLNode class, and keeps empty_node.");
+
+static PyObject *
+speedups_setup(PyObject *module, PyObject *args)
+{
+    static const char *names[] = {"entry", "key", "left", "right", "height", "size"};
+    Py_ssize_t *offsets[] = {&entry_offset, &key_offset, &left_offset, &right_offset,
+                             &height_offset, &size_offset};
+    PyTypeObject *type;
+    PyObject *empty, *descriptor;
+    size_t index;
+    int is_slot;
+
+    if (!PyArg_ParseTuple(args, "O!O:setup", &PyType_Type, &type, &empty)) {
+        return NULL;
+    }
+    for (index = 0; index < sizeof(names) / sizeof(names[0]); index++) {
+        /* On the class, a slot is a member descriptor telling where the field lives. */
+        descriptor = PyObject_GetAttrString((PyObject *)type, names[index]);
+        if (descriptor == NULL) {
+            return NULL;
+        }
+        is_slot = Py_TYPE(descriptor) == &PyMemberDescr_Type
+                  && ((PyMemberDescrObject *)descriptor)->d_member->type == T_OBJECT_EX;
+        if (is_slot) {
+            *offsets[index] = ((PyMemberDescrObject *)descriptor)->d_member->offset;
+        }
+        Py_DECREF(descriptor);
+        if (!is_slot) {
+            PyErr_Format(PyExc_TypeError, "%.200s has no slot named %s", type->tp_name,
+                         names[index]);
+            return NULL;
+        }
+    }
+
+    Py_INCREF(type);
+    Py_XSETREF(node_type, type);
+    Py_INCREF(empty);
+    Py_XSETREF(empty_node, empty);
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(find_doc,
+"find(root, key)\n\
+\n\
+Returns the last node on the way down to key whose key is not greater than key, None if\n\
+there is none. It holds key if any node does.");
+
+static PyObject *
+speedups_find(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *node, *key, *node_key, *next;
+    PyObject *candidate = Py_None;
+    int smaller;
+
+    if (!check_arguments("find", nargs, 2)) {
+        return NULL;
+    }
+    node = args[0];
+    key = args[1];
+    Py_INCREF(node);
+    Py_INCREF(candidate);
+
+    while (node != empty_node) {
+        node_key = get_field(node, key_offset);
+        if (node_key == NULL) {
+            goto error;
+        }
+        /* The comparison may run any code, which must not free the node under our feet. */
+        Py_INCREF(node_key);
+        smaller = PyObject_RichCompareBool(key, node_key, Py_LT);
+        Py_DECREF(node_key);
+        if (smaller < 0) {
+            goto error;
+        }
+        if (!smaller) {
+            Py_INCREF(node);
+            Py_SETREF(candidate, node);
+        }
+        next = get_field(node, smaller ? left_offset : right_offset);
+        if (next == NULL) {
+            goto error;
+        }
+        Py_INCREF(next);
+        Py_SETREF(node, next);
+    }
+    Py_DECREF(node);
+    return candidate;
+
+error:
+    Py_DECREF(node);
+    Py_DECREF(candidate);
+    return NULL;
+}
+
+PyDoc_STRVAR(descend_doc,
+"descend(root, key)\n\
+\n\
+Returns (path, depth, smaller): the nodes on the way down to key, the index in path of the\n\
+last node whose key is not greater than key, -1 if there is none, and whether key is\n\
+smaller than the key of the last node of path.");
+
+static PyObject *
+speedups_descend(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *node, *key, *node_key, *next, *path;
+    Py_ssize_t depth = -1;
+    int smaller = 0;
+
+    if (!check_arguments("descend", nargs, 2)) {
+        return NULL;
+    }
+    node = args[0];
+    key = args[1];
+    path = PyList_New(0);
+    if (path == NULL) {
+        return NULL;
+    }
+
+    while (node != empty_node) {
+        /* path keeps the node alive during the comparison. */
+        if (PyList_Append(path, node) < 0) {
+            goto error;
+        }
+        node_key = get_field(node, key_offset);
+        if (node_key == NULL) {
+            goto error;
+        }
+        Py_INCREF(node_key);
+        smaller = PyObject_RichCompareBool(key, node_key, Py_LT);
+        Py_DECREF(node_key);
+        if (smaller < 0) {
+            goto error;
+        }
+        if (!smaller) {
+            depth = PyList_GET_SIZE(path) - 1;
+        }
+        next = get_field(node, smaller ? left_offset : right_offset);
+        if (next == NULL) {
+            goto error;
+        }
+        node = next;
+    }
+    return Py_BuildValue("(NnO)", path, depth, smaller ? Py_True : Py_False);
+
+error:
+    Py_DECREF(path);
+    return NULL;
+}
+
+PyDoc_STRVAR(rebalance_doc,
+"rebalance(tree, path, size_change)\n\
+\n\
+Rebalances the nodes in path bottom-up after one of them gained or lost a child, same as\n\
+AVLTree._rebalance. path is left empty.");
+
+static PyObject *
+speedups_rebalance(PyObject *module, PyObject *const *args, Py_ssize_t nargs)
+{
+    PyObject *tree, *path, *node, *balanced, *ancestor;
+    Py_ssize_t size_change, height, index, size;
+
+    if (!check_arguments("rebalance", nargs, 3)) {
+        return NULL;
+    }
+    tree = args[0];
+    path = args[1];
+    if (!PyList_Check(path)) {
+        PyErr_SetString(PyExc_TypeError, "path must be a list");
+        return NULL;
+    }
+    size_change = PyLong_AsSsize_t(args[2]);
+    if (size_change == -1 && PyErr_Occurred()) {
+        return NULL;
+    }
+
+    while (PyList_GET_SIZE(path) > 0) {
+        index = PyList_GET_SIZE(path) - 1;
+        node = PyList_GET_ITEM(path, index);
+        Py_INCREF(node);
+        if (PyList_SetSlice(path, index, index + 1, NULL) < 0) {
+            Py_DECREF(node);
+            return NULL;
+        }
+
+        height = get_number(node, height_offset);
+        if (PyErr_Occurred() || update_height(node) < 0) {
+            Py_DECREF(node);
+            return NULL;
+        }
+        balanced = balance(node);
+        if (balanced == NULL) {
+            Py_DECREF(node);
+            return NULL;
+        }
+        if (balanced != node && replace_child(tree, path, node, balanced) < 0) {
+            Py_DECREF(node);
+            Py_DECREF(balanced);
+            return NULL;
+        }
+        Py_DECREF(node);
+
+        if (get_number(balanced, height_offset) == height) {
+            Py_DECREF(balanced);
+            /* Only the sizes of the ancestors change from there on. */
+            for (index = 0; index < PyList_GET_SIZE(path); index++) {
+                ancestor = PyList_GET_ITEM(path, index);
+                size = get_number(ancestor, size_offset);
+                if (PyErr_Occurred() || set_number(ancestor, size_offset,
+                                                   size + size_change) < 0) {
+                    return NULL;
+                }
+            }
+            Py_RETURN_NONE;
+        }
+        Py_DECREF(balanced);
+        if (PyErr_Occurred()) {
+            return NULL;
+        }
+    }
+    Py_RETURN_NONE;
+}
+
+/* Iterator over the entries of a subtree in order, or in reverse order. */
+typedef struct {
+    PyObject_HEAD
+    PyObject *stack;
+    PyObject *node;
+    Py_ssize_t first_offset;
+    Py_ssize_t second_offset;
+} TraversalObject;
+
+static PyTypeObject Traversal_Type;
+
+static PyObject *
+traversal_new(PyObject *root, int reverse)
+{
+    TraversalObject *traversal = PyObject_GC_New(TraversalObject, &Traversal_Type);
+
+    if (traversal == NULL) {
+        return NULL;
+    }
+    traversal->stack = PyList_New(0);
+    if (traversal->stack == NULL) {
+        traversal->node = NULL;
+        Py_DECREF(traversal);
+        return NULL;
+    }
+    Py_INCREF(root);
+    traversal->node = root;
+    traversal->first_offset = reverse ? right_offset : left_offset;
+    traversal->second_offset = reverse ? left_offset : right_offset;
+    PyObject_GC_Track(traversal);
+    return (PyObject *)traversal;
+}
+
+static PyObject *
+traversal_next(TraversalObject *traversal)
+{
+    PyObject *node = traversal->node;
+    PyObject *next, *entry;
+    Py_ssize_t last;
+
+    if (node == NULL) {
+        return NULL;
+    }
+    while (node != empty_node) {
+        if (PyList_Append(traversal->stack, node) < 0) {
+            return NULL;
+        }
+        next = get_field(node, traversal->first_offset);
+        if (next == NULL) {
+            return NULL;
+        }
+        Py_INCREF(next);
+        Py_SETREF(traversal->node, next);
+        node = next;
+    }
+
+    last = PyList_GET_SIZE(traversal->stack) - 1;
+    if (last < 0) {
+        Py_CLEAR(traversal->node);
+        return NULL;
+    }
+    node = PyList_GET_ITEM(traversal->stack, last);
+    entry = get_field(node, entry_offset);
+    next = get_field(node, traversal->second_offset);
+    if (entry == NULL || next == NULL) {
+        return NULL;
+    }
+    Py_INCREF(entry);
+    Py_INCREF(next);
+    Py_SETREF(traversal->node, next);
+    if (PyList_SetSlice(traversal->stack, last, last + 1, NULL) < 0) {
+        Py_DECREF(entry);
+        return NULL;
+    }
+    return entry;
+}
+
+static int
+traversal_traverse(TraversalObject *traversal, visitproc visit, void *arg)
+{
+    Py_VISIT(traversal->stack);
+    Py_VISIT(traversal->node);
+    return 0;
+}
+
+static int
+traversal_clear(TraversalObject *traversal)
+{
+    Py_CLEAR(traversal->stack);
+    Py_CLEAR(traversal->node);
+    return 0;
+}
+
+static void
+traversal_dealloc(TraversalObject *traversal)
+{
+    PyObject_GC_UnTrack(traversal);
+    traversal_clear(traversal);
+    PyObject_GC_Del(traversal);
+}
+
+static PyTypeObject Traversal_Type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "_avl_tree_speedups.Traversal",
+    .tp_basicsize = sizeof(TraversalObject),
+    .tp_dealloc = (destructor)traversal_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,
+    .tp_traverse = (traverseproc)traversal_traverse,
+    .tp_clear = (inquiry)traversal_clear,
+    .tp_iter = PyObject_SelfIter,
+    .tp_iternext = (iternextfunc)traversal_next,
+};
+
+PyDoc_STRVAR(inorder_doc,
+"inorder(root)\n\
+\n\
+Returns an iterator over the entries of the subtree root in increasing order.");
+
+static PyObject *
+speedups_inorder(PyObject *module, PyObject *root)
+{
+    return traversal_new(root, 0);
+}
+
+PyDoc_STRVAR(reversed_doc,
+"reversed(root)\n\
+\n\
+Returns an iterator over the entries of the subtree root in decreasing order.");
+
+static PyObject *
+speedups_reversed(PyObject *module, PyObject *root)
+{
+    return traversal_new(root, 1);
+}
+
+#if PY_VERSION_HEX < 0x03070000
+/* METH_FASTCALL is only part of the stable API from Python 3.7: before that, the same
+ * functions get their arguments from the tuple of a METH_VARARGS wrapper. */
+#define VARARGS_WRAPPER(function) \
+    static PyObject * \
+    function##_varargs(PyObject *module, PyObject *args) \
+    { \
+        return function(module, &PyTuple_GET_ITEM(args, 0), PyTuple_GET_SIZE(args)); \
+    }
+
+VARARGS_WRAPPER(speedups_find)
+VARARGS_WRAPPER(speedups_descend)
+VARARGS_WRAPPER(speedups_rebalance)
+
+#define FASTCALL_METHOD(function) (PyCFunction)function##_varargs, METH_VARARGS
+#else
+#define FASTCALL_METHOD(function) (PyCFunction)(void (*)(void))function, METH_FASTCALL
+#endif
+
+static PyMethodDef speedups_methods[] = {
+    {"setup", speedups_setup, METH_VARARGS, setup_doc},
+    {"find", FASTCALL_METHOD(speedups_find), find_doc},
+    {"descend", FASTCALL_METHOD(speedups_descend), descend_doc},
+    {"rebalance", FASTCALL_METHOD(speedups_rebalance), rebalance_doc},
+    {"inorder", speedups_inorder, METH_O, inorder_doc},
+    {"reversed", speedups_reversed, METH_O, reversed_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef speedups_module = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "_avl_tree_speedups",
+    .m_doc = "Compiled node primitives for avl_tree.",
+    .m_size = -1,
+    .m_methods = speedups_methods,
+};
+
+PyMODINIT_FUNC
+PyInit__avl_tree_speedups(void)
+{
+    if (PyType_Ready(&Traversal_Type) < 0) {
+        return NULL;
+    }
+    root_name = PyUnicode_InternFromString("root");
+    if (root_name == NULL) {
+        return NULL;
+    }
+    return PyModule_Create(&speedups_module);
+}
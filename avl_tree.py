@@ -21,9 +21,53 @@ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 from abc import ABCMeta, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import UnsupportedOperation
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from sys import byteorder
+from collections.abc import MutableMapping, KeysView, ValuesView, ItemsView, Sequence
 from copy import deepcopy
-from typing import Iterable, Any, Union, TypeVar, Generator
+from functools import partial
+from itertools import islice, repeat
+from operator import attrgetter, getitem
+from os import environ
+from threading import Lock
+from typing import (Iterable, Any, Union, TypeVar, Generator, List, Tuple, Callable, Optional,
+                    Dict, NamedTuple)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# Compiled node primitives, see setup.py. Set AVL_TREE_PURE_PYTHON to run without them.
+_speedups = None
+if not environ.get('AVL_TREE_PURE_PYTHON'):
+    try:
+        import _avl_tree_speedups as _speedups
+    except ImportError:  # pragma: no cover
+        pass
+
+# Below this number of entries, set operations ignore workers: starting processes and
+# pickling the entries would cost more than the operation itself.
+_PARALLEL_THRESHOLD = 100000
+
+# Binary format of AVLTree.dump: a header made of a magic string, the format version, the
+# type code of the entries, flags and the number of entries, followed by the sorted entries.
+# The flags tell whether the tree counted duplicates, in which case an entry may be repeated,
+# and whether it had a key function, by which the entries are then sorted. int64 ('q') and
+# float64 ('d') entries are stored as is. bytes ('b') and str ('s', as UTF-8) entries are
+# stored as count + 1 uint64 offsets, followed by the concatenated entries, entry i spanning
+# offsets[i] to offsets[i + 1]. Every number is little-endian.
+_DUMP_MAGIC = b'AVLT'
+_DUMP_VERSION = 1
+_DUMP_HEADER = Struct('<4sBcBxQ')
+_DUMP_COUNTED = 1
+_DUMP_KEYED = 2
 
 
 class Comparable(metaclass=ABCMeta):
@@ -40,30 +84,81 @@ class Comparable(metaclass=ABCMeta):
 Entry = TypeVar('Entry', bound=Comparable)
 
 
+class Monoid(NamedTuple):
+    """
+    An associative operation along with its identity, which trees created with
+    AVLTree(..., monoid=...) maintain over every subtree, see AVLTree.aggregate.
+
+    combine : a function of two arguments, such that combine(combine(a, b), c) equals
+        combine(a, combine(b, c)). It need not be commutative: values are always combined
+        in the order of their entries.
+    identity : the value combine leaves unchanged, the aggregate of an empty range.
+    value : a function of one argument, default None
+        The value an entry stands for, e.g. its weight. By default the entry itself.
+
+    Monoid(operator.add, 0) sums the entries, Monoid(max, float('-inf')) keeps the greatest.
+    """
+
+    combine: Callable[[Any, Any], Any]
+    identity: Any
+    value: Optional[Callable[[Entry], Any]] = None
+
+
 class _EmptyAVLNode:
     """Internal object, represents an empty tree node using Null Object Pattern."""
 
+    __slots__ = ('height', 'size')
+
     def __init__(self):
         self.height = 0
+        self.size = 0
 
-    def insert(self, entry: Entry):
-        """Inserting a entry in a EmptyNode means returning a concrete node back."""
-        return _AVLNode(entry)
+    def __reduce__(self) -> str:
+        """Copies and pickles of the EmptyNode refer to the EMPTY_NODE singleton, which the
+        traversals rely on to tell it apart from nodes by identity."""
+        return 'EMPTY_NODE'
 
-    def delete(self, entry: Entry):
-        """Cannot delete a entry from a EmptyNode"""
-        raise KeyError(entry)
+    def clear(self) -> '_EmptyAVLNode':
+        """Clearing a EmptyNode leaves it as it is."""
+        return self
 
     @property
     def balance_factor(self):
         """The balance factor of a empty node is always 0."""
         return 0
 
-    def pred(self, pred: Union['_AVLNode', '_EmptyAVLNode'], entry: Entry):
-        raise KeyError(f'Predecessor of {entry} not found.')
+    def split(self, key: Any) -> Tuple['_EmptyAVLNode', '_EmptyAVLNode']:
+        """Splitting a EmptyNode gives two EmptyNodes."""
+        return self, self
+
+    def partition(self, key: Any) -> Tuple['_EmptyAVLNode', None, '_EmptyAVLNode']:
+        """Partitioning a EmptyNode gives two EmptyNodes and no node holding key."""
+        return self, None, self
+
+    def concat(self, other: Union['_AVLNode',
+                                  '_EmptyAVLNode']) -> Union['_AVLNode', '_EmptyAVLNode']:
+        """Concatenating other to a EmptyNode gives other."""
+        return other
+
+    def union(self, other):
+        """The union of a EmptyNode and other is other."""
+        return other
+
+    def intersection(self, other):
+        """The intersection of a EmptyNode and other is empty."""
+        return self
 
-    def succ(self, pred, entry):
-        raise KeyError(f'Successor of {entry} not found.')
+    def difference(self, other):
+        """Removing other from a EmptyNode leaves it empty."""
+        return self
+
+    def symmetric_difference(self, other):
+        """The symmetric difference of a EmptyNode and other is other."""
+        return other
+
+    def clone(self) -> '_EmptyAVLNode':
+        """A EmptyNode is never modified, so it is its own clone."""
+        return self
 
     def __bool__(self):
         """Empty node is always Falsy. """
@@ -84,40 +179,16 @@ EMPTY_NODE = _EmptyAVLNode()
 class _AVLNode:
     """Internal object, represents a tree node."""
 
-    def __init__(self, entry: Entry = None):
-        """Creates a new node."""
+    __slots__ = ('entry', 'key', 'left', 'right', 'height', 'size')
+
+    def __init__(self, entry: Entry = None, key: Any = None):
+        """Creates a new node, its key is the entry itself unless a key is given."""
         self.entry: Entry = entry
+        self.key: Any = entry if key is None else key
         self.left: '_AVLNode' = EMPTY_NODE
         self.right: '_AVLNode' = EMPTY_NODE
         self.height: int = 1
-
-    def insert(self, entry: Entry):
-        """Inserts a entry to the subtree."""
-        if entry > self.entry:
-            self.right = self.right.insert(entry)
-        elif entry < self.entry:
-            self.left = self.left.insert(entry)
-
-        return self._balanced_tree()
-
-    def delete(self, entry: Entry) -> Union['_AVLNode', _EmptyAVLNode]:
-        """Deletes a entry from subtree and return it balanced."""
-        if entry > self.entry:
-            self.right = self.right.delete(entry)
-        elif entry < self.entry:
-            self.left = self.left.delete(entry)
-        else:
-            if self.is_leaf():
-                return EMPTY_NODE
-
-            if self.left:
-                new_entry = self.left.max()
-                self.entry = new_entry
-                self.left = self.left.delete(new_entry)
-            else:
-                return self.right
-
-        return self._balanced_tree()
+        self.size: int = 1
 
     def clear(self) -> _EmptyAVLNode:
         """Clears the whole subtree"""
@@ -128,6 +199,11 @@ class _AVLNode:
 
         return EMPTY_NODE
 
+    def take_entry(self, node: '_AVLNode') -> None:
+        """Moves the entry of node, along with anything attached to it, into this node."""
+        self.entry = node.entry
+        self.key = node.key
+
     def is_leaf(self) -> bool:
         """Checks if the node is a leaf node, i. e, if its siblings are empty."""
         return not (bool(self.left) or bool(self.right))
@@ -163,20 +239,36 @@ class _AVLNode:
 
     def __len__(self) -> int:
         """Return the number of elements in this subtree."""
-        return 1 + len(self.left) + len(self.right)
+        return self.size
 
     def __eq__(self, other) -> bool:
         """Checks if two nodes are equal."""
         return self.entry == other.entry and self.left == other.left and self.right == other.right
 
+    @classmethod
+    def build(cls, entries: List[Entry], keys: List[Any], start: int,
+              stop: int) -> Union['_AVLNode', _EmptyAVLNode]:
+        """Builds a perfectly balanced subtree out of the sorted entries[start:stop] in O(n)."""
+        if start >= stop:
+            return EMPTY_NODE
+
+        middle = (start + stop - 1) // 2
+        node = cls(entries[middle], keys[middle])
+        node.left = cls.build(entries, keys, start, middle)
+        node.right = cls.build(entries, keys, middle + 1, stop)
+        node._update_height()
+
+        return node
+
     def _balanced_tree(self) -> '_AVLNode':
         """Returns balanced tree after balance operation."""
         self._update_height()
         return self._balance_tree_if_unbalanced()
 
     def _update_height(self) -> None:
-        """Updated the height if tree has been rebalanced."""
+        """Updated the height and the subtree size if tree has been rebalanced."""
         self.height = 1 + max(self.left.height, self.right.height)
+        self.size = 1 + self.left.size + self.right.size
 
     def _balance_tree_if_unbalanced(self) -> '_AVLNode':
         """Performs the appropriate rotation if the the subtree is unbalanced."""
@@ -223,31 +315,376 @@ class _AVLNode:
         self.right = self.right._rotate_right()
         return self._rotate_left()
 
-    def pred(self, pred: Union['_AVLNode', _EmptyAVLNode], entry) -> Entry:
-        if entry > self.entry:
-            return self.right.pred(self, entry)
-        elif entry < self.entry:
-            return self.left.pred(pred, entry)
+    def copy(self) -> '_AVLNode':
+        """Returns a new node with the same entry and children."""
+        return self.with_children(self.left, self.right)
+
+    def with_children(self, left: Union['_AVLNode', _EmptyAVLNode],
+                      right: Union['_AVLNode', _EmptyAVLNode]) -> '_AVLNode':
+        """Returns a new node with the same entry and the given children."""
+        node = self.__class__.__new__(self.__class__)
+        node.take_entry(self)
+        node.left = left
+        node.right = right
+        node._update_height()
+        return node
+
+    def balanced_with_children(self, left: Union['_AVLNode', _EmptyAVLNode],
+                               right: Union['_AVLNode', _EmptyAVLNode]) -> '_AVLNode':
+        """Returns a new balanced subtree made of left, the entry of this node and right.
+
+        The heights of left and right may differ by two at most. Nodes are never modified:
+        the ones moved by a rotation are copied first, so left and right can be shared."""
+        node = self.with_children(left, right)
+        balance_factor = node.balance_factor
+        if balance_factor == 2:
+            node.left = node.left.copy()
+            if node.left.balance_factor == -1:
+                node.left.right = node.left.right.copy()
+        elif balance_factor == -2:
+            node.right = node.right.copy()
+            if node.right.balance_factor == 1:
+                node.right.left = node.right.left.copy()
         else:
-            if self.left:
-                return self.left.max()
-            if pred:
-                return pred.entry
+            return node
+        return node._balance_tree_if_unbalanced()
 
-            raise KeyError(f'Predecessor of {entry} not found.')
+    def join(self, left: Union['_AVLNode', _EmptyAVLNode],
+             right: Union['_AVLNode', _EmptyAVLNode]) -> '_AVLNode':
+        """Returns a balanced tree made of left, the entry of this node and right.
+
+        Every key of left must be smaller than the key of this node, and every key of right
+        greater. Walks down the spine of the taller tree until the heights match, so it takes
+        O(|left.height - right.height| + 1). Neither this node nor the subtrees are modified.
+        """
+        if left.height > right.height + 1:
+            return left.balanced_with_children(left.left, self.join(left.right, right))
+        if right.height > left.height + 1:
+            return right.balanced_with_children(self.join(left, right.left), right.right)
+        return self.with_children(left, right)
+
+    def split(self, key: Any) -> Tuple[Union['_AVLNode', _EmptyAVLNode],
+                                       Union['_AVLNode', _EmptyAVLNode]]:
+        """Returns the subtrees with the keys smaller than key and with the others, in O(log n).
+
+        The subtree itself is not modified."""
+        if self.key < key:
+            left, right = self.right.split(key)
+            return self.join(self.left, left), right
+
+        left, right = self.left.split(key)
+        return left, self.join(right, self.right)
+
+    def split_last(self) -> Tuple[Union['_AVLNode', _EmptyAVLNode], '_AVLNode']:
+        """Returns the subtree without its greatest entry, and the node holding that entry."""
+        if not self.right:
+            return self.left, self
+
+        rest, last = self.right.split_last()
+        return self.join(self.left, rest), last
+
+    def partition(self, key: Any) -> Tuple[Union['_AVLNode', _EmptyAVLNode], Optional['_AVLNode'],
+                                           Union['_AVLNode', _EmptyAVLNode]]:
+        """Returns the subtrees with the keys smaller and greater than key, and the node holding
+        key, or None if there is no such node. The subtree itself is not modified."""
+        if key < self.key:
+            left, found, right = self.left.partition(key)
+            return left, found, self.join(right, self.right)
+        if self.key < key:
+            left, found, right = self.right.partition(key)
+            return self.join(self.left, left), found, right
+        return self.left, self, self.right
+
+    def concat(self, other: Union['_AVLNode', _EmptyAVLNode]) -> '_AVLNode':
+        """Returns a balanced tree with the entries of this subtree followed by the ones of other.
+        """
+        rest, last = self.split_last()
+        return last.join(rest, other)
+
+    def union(self, other: Union['_AVLNode', _EmptyAVLNode]) -> '_AVLNode':
+        """Returns a tree with the entries of both subtrees, keeping ours on equal keys.
+
+        Like the other set operations, this splits other around the key of this node, solves
+        the left and right halves independently and joins the results. That takes
+        O(m log(n / m + 1)) for subtrees of sizes m <= n, and neither subtree is modified.
+        """
+        if not other:
+            return self
+        left, _, right = other.partition(self.key)
+        return self.join(self.left.union(left), self.right.union(right))
+
+    def intersection(self, other: Union['_AVLNode', _EmptyAVLNode]) -> Union['_AVLNode',
+                                                                             _EmptyAVLNode]:
+        """Returns a tree with our entries whose keys are in other."""
+        if not other:
+            return other
+        left, found, right = other.partition(self.key)
+        left, right = self.left.intersection(left), self.right.intersection(right)
+        return self.join(left, right) if found else left.concat(right)
 
-    def succ(self, succ: Union['_AVLNode', _EmptyAVLNode], entry) -> Entry:
-        if entry > self.entry:
-            return self.right.succ(succ, entry)
-        elif entry < self.entry:
-            return self.left.succ(self, entry)
+    def difference(self, other: Union['_AVLNode', _EmptyAVLNode]) -> Union['_AVLNode',
+                                                                           _EmptyAVLNode]:
+        """Returns a tree with our entries whose keys are not in other."""
+        if not other:
+            return self
+        left, _, right = self.partition(other.key)
+        return left.difference(other.left).concat(right.difference(other.right))
+
+    def symmetric_difference(self, other: Union['_AVLNode', _EmptyAVLNode]) -> Union[
+            '_AVLNode', _EmptyAVLNode]:
+        """Returns a tree with the entries whose keys are in exactly one of the subtrees."""
+        if not other:
+            return self
+        left, found, right = other.partition(self.key)
+        left = self.left.symmetric_difference(left)
+        right = self.right.symmetric_difference(right)
+        return left.concat(right) if found else self.join(left, right)
+
+    def clone(self) -> '_AVLNode':
+        """Returns a copy of the whole subtree, sharing no node with it."""
+        return self.with_children(self.left.clone(), self.right.clone())
+
+
+# The node primitives behind the hot paths of AVLTree: descents, rebalancing and in-order
+# traversals. When the _avl_tree_speedups extension is built, its compiled versions of the
+# very same functions replace these ones at import time. Empty children are told apart by
+# identity, which is much cheaper than calling __bool__ on every node.
+
+def _find(root: Union[_AVLNode, _EmptyAVLNode], key: Any) -> Optional[_AVLNode]:
+    """Returns the last node on the way down to key whose key is not greater than key, None
+    if there is none. It holds key if any node does."""
+    candidate = None
+    while root is not EMPTY_NODE:
+        if key < root.key:
+            root = root.left
         else:
-            if self.right:
-                return self.right.min()
-            if succ:
-                return succ.entry
+            candidate = root
+            root = root.right
+    return candidate
+
+
+def _descend(root: Union[_AVLNode, _EmptyAVLNode], key: Any) -> Tuple[List[_AVLNode], int, bool]:
+    """Returns the nodes on the way down to key, the index in that path of the last node
+    whose key is not greater than key, -1 if there is none, and whether key is smaller than
+    the key of the last node of the path.
+
+    A single comparison per level: equality is left to the caller, which only has to check
+    it against the node at that index."""
+    path = []
+    depth = -1
+    smaller = False
+
+    while root is not EMPTY_NODE:
+        path.append(root)
+        smaller = key < root.key
+        if smaller:
+            root = root.left
+        else:
+            depth = len(path) - 1
+            root = root.right
+    return path, depth, smaller
+
+
+def _rebalance_path(tree: 'AVLTree', path: List[_AVLNode], size_change: int) -> None:
+    """Rebalances the nodes in path bottom-up, see AVLTree._rebalance."""
+    while path:
+        node = path.pop()
+        height = node.height
+        node._update_height()
+        balanced = node._balance_tree_if_unbalanced()
+        if balanced is not node:
+            tree._replace_child(path, node, balanced)
+
+        if balanced.height == height:
+            for ancestor in path:
+                ancestor.size += size_change
+            return
 
-            raise KeyError(f'Successor of {entry} not found.')
+
+def _inorder_entries(root: Union[_AVLNode, _EmptyAVLNode]) -> Generator[Entry, None, None]:
+    """Iterates over the entries of the subtree root in increasing order."""
+    stack = []
+    push, pop = stack.append, stack.pop
+
+    while True:
+        while root is not EMPTY_NODE:
+            push(root)
+            root = root.left
+        if not stack:
+            return
+        root = pop()
+        yield root.entry
+        root = root.right
+
+
+def _reversed_entries(root: Union[_AVLNode, _EmptyAVLNode]) -> Generator[Entry, None, None]:
+    """Iterates over the entries of the subtree root in decreasing order."""
+    stack = []
+    push, pop = stack.append, stack.pop
+
+    while True:
+        while root is not EMPTY_NODE:
+            push(root)
+            root = root.right
+        if not stack:
+            return
+        root = pop()
+        yield root.entry
+        root = root.left
+
+
+if _speedups is not None:
+    _speedups.setup(_AVLNode, EMPTY_NODE)
+    _find, _descend, _rebalance_path = (  # noqa: F811
+        _speedups.find, _speedups.descend, _speedups.rebalance)
+    _inorder_entries, _reversed_entries = _speedups.inorder, _speedups.reversed  # noqa: F811
+
+
+def _key_of(key: Optional[Callable[[Entry], Any]], entry: Entry) -> Any:
+    """Returns the key of entry under the key function key, the entry itself if there is none."""
+    return entry if key is None else key(entry)
+
+
+# Functions giving the left child, the right child, the key, the entry and the subtree size of
+# a node, see AVLTree._accessors. attrgetter runs them without a Python frame, which matters
+# as they are called at every step.
+_NODE_ACCESSORS = (attrgetter('left'), attrgetter('right'), attrgetter('key'),
+                   attrgetter('entry'), attrgetter('size'))
+
+
+class _AVLCursor:
+    """
+    Internal object, a position in an AVLTree, created by AVLTree.seek.
+
+    The cursor keeps the path from the root down to its node. Moving to a neighbour walks
+    that path up or down, which takes O(1) amortized over a scan and O(log n) at worst.
+    Past the last entry or before the first one, the cursor is on no entry and its path is
+    empty; moving back from there brings it onto the last or the first entry again. In a
+    tree counting duplicates, the cursor steps through each occurrence of an entry in turn,
+    like the traversals do, and _occurrence tells which one it is on.
+
+    Changes made to the tree other than through remove invalidate the cursor.
+    """
+
+    __slots__ = ('_tree', '_path', '_after_end', '_occurrence', '_left', '_right', '_node_key',
+                 '_node_entry')
+
+    def __init__(self, tree: 'AVLTree', key: Any, side: str):
+        self._tree = tree
+        self._seek(key, side)
+
+    def _seek(self, key: Any, side: str) -> None:
+        """Moves the cursor onto the entry on the given side of key."""
+        if side not in ('ge', 'gt', 'le', 'lt'):
+            raise ValueError(f"side must be 'ge', 'gt', 'le' or 'lt', not {side!r}")
+
+        path = []
+        node, self._left, self._right, self._node_key, self._node_entry, _ = \
+            self._tree._accessors()
+        depth = -1
+        # Nodes matching side are the candidates, the last one met is the closest to key.
+        while node:
+            path.append(node)
+            node_key = self._node_key(node)
+            if side == 'ge' and not node_key < key or side == 'gt' and key < node_key:
+                depth = len(path)
+                node = self._left(node)
+            elif side == 'le' and not key < node_key or side == 'lt' and node_key < key:
+                depth = len(path)
+                node = self._right(node)
+            elif side in ('ge', 'gt'):
+                node = self._right(node)
+            else:
+                node = self._left(node)
+
+        del path[max(depth, 0):]
+        self._path = path
+        self._after_end = side in ('ge', 'gt')
+        # The first occurrence of the entry on the greater side, the last one otherwise.
+        self._occurrence = 0 if self._after_end or not path else self._count(path[-1]) - 1
+
+    @staticmethod
+    def _count(node: Any) -> int:
+        """Returns the number of occurrences of the entry of node."""
+        return 1
+
+    @property
+    def entry(self) -> Entry:
+        """C.entry -> the entry under the cursor, raise KeyError if it is on no entry."""
+        if not self._path:
+            raise KeyError('The cursor is not on an entry.')
+        return self._node_entry(self._path[-1])
+
+    def __bool__(self) -> bool:
+        """Returns True if the cursor is on an entry."""
+        return bool(self._path)
+
+    def next(self) -> bool:
+        """C.next() -> moves to the next entry, returns False if there is none."""
+        if self._path and self._occurrence + 1 < self._count(self._path[-1]):
+            self._occurrence += 1
+            return True
+        self._occurrence = 0
+        return self._step(self._right, self._left, after_end=True)
+
+    def prev(self) -> bool:
+        """C.prev() -> moves to the previous entry, returns False if there is none."""
+        if self._occurrence > 0:
+            self._occurrence -= 1
+            return True
+        moved = self._step(self._left, self._right, after_end=False)
+        if moved:
+            self._occurrence = self._count(self._path[-1]) - 1
+        return moved
+
+    def _step(self, forward: Callable, backward: Callable, after_end: bool) -> bool:
+        """Moves to the neighbour in the forward direction, left or right."""
+        path = self._path
+        if not path:
+            if self._after_end == after_end:
+                return False
+            # Back from beyond the end: the first or the last entry, depending on the way.
+            node = self._tree._accessors()[0]
+        else:
+            node = forward(path[-1])
+            if not node:
+                # Climb while coming back from the forward side of the parent.
+                key = self._node_key(path.pop())
+                while path and (self._node_key(path[-1]) < key) == after_end:
+                    path.pop()
+                if not path:
+                    self._after_end = after_end
+                return bool(path)
+
+        while node:
+            path.append(node)
+            node = backward(node)
+        return bool(path)
+
+    def remove(self) -> Entry:
+        """C.remove() -> removes the entry under the cursor from the tree and returns it.
+
+        The cursor moves onto the next entry, which is the next occurrence of the same entry
+        if the tree counts duplicates and there is one left. Takes O(log n).
+        Raise KeyError if the cursor is on no entry."""
+        entry = self.entry
+        key = self._node_key(self._path[-1])
+        occurrence = self._occurrence
+        self._tree.delete(entry)
+        self._seek(key, 'ge')
+        if self._path and not key < self._node_key(self._path[-1]):
+            # One occurrence less: the one after the removed one now has its position.
+            count = self._count(self._path[-1])
+            self._occurrence = min(occurrence, count - 1)
+            if occurrence == count:
+                self.next()
+        return entry
+
+    def __iter__(self) -> Generator[Entry, None, None]:
+        """Iterates over the entries from the cursor onwards, moving it along."""
+        while self._path:
+            yield self.entry
+            self.next()
 
 
 class AVLTree:
@@ -272,21 +709,625 @@ class AVLTree:
     AVLTree() -> new empty tree.
     AVLTree(tree) -> new tree initialized from a tree
     AVLTree(seq) -> new tree initialized from seq [(entry1), (entry2), ... (entryN)]
+    AVLTree.from_sorted(seq) -> new tree initialized from the sorted seq in O(n)
+
+    When seq is already sorted, the constructor builds the tree in O(n) as well.
+
+    storage : 'node' | 'pool', default 'node'
+        Use 'pool' to keep the tree structure in flat integer arrays instead of one
+        object per entry, which takes a fraction of the memory.
+    key : a function of one argument, default None
+        Entries are ordered by key(entry) instead of by the entries themselves. The key is
+        computed once per entry when it is added and kept alongside it. Methods taking an
+        entry, like search or irange, apply key to it before looking it up.
+    duplicates : 'ignore' | 'count', default 'ignore'
+        By default, inserting an entry equal to one already in the tree does nothing. Use
+        'count' to turn the tree into a multiset: each node keeps the first entry inserted
+        for its key along with the number of times it was inserted. len, rank, select,
+        traversals and ranges repeat the entry that many times, and delete removes a single
+        occurrence. Only the node storage supports it, and set operations are not supported.
+    stats : bool | a function of two arguments, default False
+        Use True to count, in insert, delete and search, the key comparisons, the nodes
+        visited on the way down, each kind of rotation and the nodes allocated and freed.
+        T.stats() returns the totals. When stats is a function, it is also called after each
+        of those operations with the name of the operation and a dict of its own counts.
+        Trees created without it do not pay anything for it. Only the node storage supports
+        it, without counting duplicates.
+    dtype : None | 'int64' | 'float64', default None
+        Use 'int64' or 'float64' for trees of numbers: the entries are kept in a typed array
+        of 8-byte numbers, next to the node pool of storage='pool'. The constructor and
+        insert_many take NumPy arrays as well, and traverse and irange return NumPy arrays,
+        built without creating a Python object per entry, or an array.array without NumPy.
+        key, duplicates='count' and stats are not supported.
+    monoid : Monoid, default None
+        Every node keeps the aggregate of the values of the entries in its subtree, which
+        T.aggregate(lo, hi) combines to answer range sums, maxima and the like in O(log n).
+        The aggregates are kept up to date along with the heights, so each insert and delete
+        recomputes them on its whole path. Only the node storage supports it, without
+        counting duplicates, stats or dtype.
 
     """
 
-    def __init__(self, args: Iterable[Any] = None):
+    _node_class = _AVLNode
+    _cursor_class = _AVLCursor
+    _duplicates = 'ignore'
+    # The descents of insert, delete and search, which a subclass can wrap.
+    _descend = staticmethod(_descend)
+    _find = staticmethod(_find)
+    # Set operations leave their result sharing nodes with their inputs. Trees holding such
+    # nodes copy them the first time they change, as insert and delete modify nodes in place.
+    _shared = False
+
+    def __new__(cls, args: Iterable[Any] = None, storage: str = 'node',
+                key: Callable[[Entry], Any] = None, duplicates: str = 'ignore',
+                stats: Union[bool, Callable[[str, Dict[str, int]], Any]] = False,
+                dtype: str = None, monoid: Monoid = None):
+        """Creates a tree backed by the requested storage."""
+        if storage not in ('node', 'pool'):
+            raise ValueError(f"storage must be 'node' or 'pool', not {storage!r}")
+        if duplicates not in ('ignore', 'count'):
+            raise ValueError(f"duplicates must be 'ignore' or 'count', not {duplicates!r}")
+        if monoid is not None:
+            if storage != 'node' or duplicates != 'ignore' or stats or dtype is not None:
+                raise ValueError("monoid is only supported with storage='node' and "
+                                 "duplicates='ignore', without stats or dtype")
+            if not issubclass(cls, _AugmentedAVLTree):
+                cls = _AugmentedAVLTree
+        if dtype is not None:
+            if dtype not in _TYPED_TREES:
+                raise ValueError(f"dtype must be 'int64' or 'float64', not {dtype!r}")
+            if key is not None or duplicates != 'ignore' or stats:
+                raise ValueError("dtype is not supported with key, duplicates='count' or stats")
+            if not issubclass(cls, _TypedAVLTree):
+                cls = _TYPED_TREES[dtype]
+        if stats:
+            if storage != 'node' or duplicates != 'ignore':
+                raise ValueError("stats is only supported with storage='node' and "
+                                 "duplicates='ignore'")
+            if not issubclass(cls, _InstrumentedAVLTree):
+                cls = _InstrumentedAVLTree
+        if duplicates == 'count':
+            if storage != 'node':
+                raise ValueError("duplicates='count' is only supported with storage='node'")
+            if not issubclass(cls, _MultisetAVLTree):
+                cls = _MultisetAVLTree
+        if storage == 'pool' and not issubclass(cls, _PooledAVLTree):
+            cls = _PooledAVLTree
+        return super().__new__(cls)
+
+    def __init__(self, args: Iterable[Any] = None, storage: str = 'node',
+                 key: Callable[[Entry], Any] = None, duplicates: str = 'ignore',
+                 stats: Union[bool, Callable[[str, Dict[str, int]], Any]] = False,
+                 dtype: str = None, monoid: Monoid = None):
         """Initialize an AVL Tree. """
-        self.root: _AVLNode = None
+        self._key = key
+        self.root: _AVLNode = EMPTY_NODE
         self._init_tree(args)
 
+    @classmethod
+    def from_sorted(cls, iterable: Iterable[Any], assume_unique: bool = False,
+                    **options) -> 'AVLTree':
+        """AVLTree.from_sorted(seq) -> new balanced tree built from the sorted seq in O(n).
+
+        Equal neighbours are kept only once, unless assume_unique is True, in which case seq is
+        trusted to be strictly increasing and is not checked at all.
+        Raises ValueError if seq is not sorted.
+        The other keyword arguments are passed to the constructor.
+        """
+        tree = cls(**options)
+        entries = list(iterable)
+        keys = tree._keys_of(entries)
+        if not assume_unique:
+            entries, keys = tree._unique_sorted(entries, keys)
+        tree._build(entries, keys)
+        return tree
+
+    def _keys_of(self, entries: List[Entry]) -> List[Any]:
+        """Returns the keys of entries."""
+        return entries if self._key is None else list(map(self._key, entries))
+
+    @staticmethod
+    def _unique_sorted(entries: List[Entry],
+                       keys: List[Any]) -> Tuple[List[Entry], List[Any]]:
+        """Returns the entries and keys without duplicated keys, raise ValueError if unsorted."""
+        unique_entries, unique_keys = [], []
+        for entry, key in zip(entries, keys):
+            if unique_keys:
+                last = unique_keys[-1]
+                if key < last:
+                    raise ValueError(f'Entries are not sorted: {entry} comes after '
+                                     f'{unique_entries[-1]}.')
+                if not last < key:
+                    continue
+            unique_entries.append(entry)
+            unique_keys.append(key)
+        return unique_entries, unique_keys
+
+    def dump(self, fp) -> None:
+        """T.dump(fp) -- writes the entries of T to the binary file fp, in order.
+
+        Entries must all be int, fitting in 64 bits, or all float, bytes or str. They are
+        stored in a compact binary format that AVLTree.load reads back. Several trees can be
+        dumped one after the other in the same file.
+        Raise TypeError for other entries, larger int included.
+        """
+        _dump_entries(fp, list(self), self._dump_flags())
+
+    def _dump_flags(self) -> int:
+        """Returns the flags describing the tree in a dump, see _DUMP_HEADER."""
+        return ((_DUMP_COUNTED if self._duplicates == 'count' else 0)
+                | (_DUMP_KEYED if self._key is not None else 0))
+
+    @classmethod
+    def load(cls, fp, **options) -> 'AVLTree':
+        """AVLTree.load(fp) -> new tree with the entries written by T.dump(fp).
+
+        When fp is a real file, it is memory-mapped instead of read. The entries come out
+        sorted, so the tree is built in O(n) without any rebalancing. fp is left right after
+        the tree, ready for the next one.
+        The keyword arguments are passed to the constructor, and key must be the key function
+        of the dumped tree. Raise ValueError if fp does not hold a dumped tree, if it was
+        dumped with or without a key or counting duplicates and the new tree is not, or if
+        the entries are not sorted.
+        """
+        entries, flags = _load_entries(fp)
+        tree = cls(**options)
+        if flags != tree._dump_flags():
+            raise ValueError(f'Cannot load a tree dumped {_describe_dump_flags(flags)} into '
+                             f'a tree {_describe_dump_flags(tree._dump_flags())}.')
+        tree._build(*tree._unique_sorted(entries, tree._keys_of(entries)))
+        return tree
+
+    def freeze(self, layout: str = 'eytzinger') -> 'FrozenAVLIndex':
+        """T.freeze(layout='eytzinger') -> immutable search index over the entries of T.
+
+        layout : 'eytzinger' | 'sorted', default 'eytzinger'
+            The order in which the keys are laid out in a flat array, see FrozenAVLIndex.
+
+        The index is a snapshot: later changes to T do not show in it. Takes O(n).
+        """
+        return FrozenAVLIndex(*self._sorted_items(), key=self._key, layout=layout)
+
     def insert(self, entry: Entry) -> None:
         """T.insert(entry) -- insert elem"""
-        self.root = self.root.insert(entry)
+        self._insert(entry)
+
+    def _insert(self, entry: Entry) -> Tuple[_AVLNode, bool]:
+        """Inserts entry unless it is already there.
+
+        Returns the node holding entry and whether it has just been created."""
+        if self._shared:
+            self._unshare()
+        key = _key_of(self._key, entry)
+        path, depth, smaller = self._descend(self.root, key)
+
+        if depth >= 0 and not path[depth].key < key:
+            return path[depth], False
+
+        node = self._new_node(entry, key)
+        if not path:
+            self.root = node
+        elif smaller:
+            path[-1].left = node
+        else:
+            path[-1].right = node
+
+        self._rebalance(path, 1)
+        return node, True
+
+    def _new_node(self, entry: Entry, key: Any) -> _AVLNode:
+        """Returns a new node holding entry."""
+        return self._node_class(entry, key)
 
     def delete(self, entry: Entry) -> None:
         """T.remove(entry) remove item <entry> from tree."""
-        self.root = self.root.delete(entry)
+        if self._shared:
+            self._unshare()
+        key = _key_of(self._key, entry)
+        path, depth, _ = self._descend(self.root, key)
+
+        if depth < 0 or path[depth].key < key:
+            raise KeyError(entry)
+
+        root = path[depth]
+        del path[depth:]
+
+        if root.left:
+            # The entry is replaced by its predecessor, which is unlinked instead.
+            path.append(root)
+            removed = root.left
+            while removed.right:
+                path.append(removed)
+                removed = removed.right
+            root.take_entry(removed)
+            self._replace_child(path, removed, removed.left)
+        else:
+            self._replace_child(path, root, root.right)
+
+        self._rebalance(path, -1)
+
+    def insert_many(self, entries: Iterable[Entry]) -> None:
+        """T.insert_many(seq) -- insert every entry of seq.
+
+        The batch is sorted and built into a balanced subtree, which is merged with T by
+        splitting and joining in O(m log(n / m + 1)), keeping the subtrees of T it does not
+        reach. A batch of a size comparable to T is merged with the sorted entries of T
+        instead, and the tree rebuilt in O(n + m).
+        """
+        entries = list(entries)
+        if not self._merges_batch(len(entries)):
+            for entry in entries:
+                self.insert(entry)
+            return
+
+        self._apply_batch('union', *self._sorted_batch(entries))
+
+    def delete_many(self, entries: Iterable[Entry]) -> None:
+        """T.delete_many(seq) -- remove every entry of seq that is in T, ignore the others.
+
+        Batches are merged with T like in insert_many."""
+        entries = list(entries)
+        if not self._merges_batch(len(entries)):
+            for entry in entries:
+                try:
+                    self.delete(entry)
+                except KeyError:
+                    pass
+            return
+
+        self._apply_batch('difference', *self._sorted_batch(entries))
+
+    def contains_many(self, entries: Iterable[Entry]) -> Union[List[bool], 'np.ndarray']:
+        """T.contains_many(seq) -> list telling, for each entry of seq, if it is in T.
+
+        The entries are looked up in key order, and each lookup resumes from where the
+        previous one stopped instead of descending from the root again. When seq is a NumPy
+        array, the result is a NumPy array of booleans.
+        """
+        batch = list(entries)
+        keys = self._keys_of(batch)
+        if all(not key < previous for previous, key in zip(keys, keys[1:])):
+            found = list(self._contains_sorted(keys))
+        else:
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            found = [False] * len(keys)
+            for index, present in zip(order, self._contains_sorted([keys[i] for i in order])):
+                found[index] = present
+
+        if np is not None and isinstance(entries, np.ndarray):
+            return np.array(found, dtype=bool)
+        return found
+
+    def _contains_sorted(self, keys: List[Any]) -> Generator[bool, None, None]:
+        """Tells, for each key of the sorted keys, if it is in T.
+
+        The stack holds the nodes not visited yet by an in-order traversal stopped at the last
+        key, so the next key is searched from there on."""
+        root, left, right, node_key, _, _ = self._accessors()
+        stack = []
+
+        for key in keys:
+            while stack and node_key(stack[-1]) < key:
+                root = stack.pop()
+                if not stack or not node_key(stack[-1]) < key:
+                    root = right(root)
+                    break
+            while root:
+                if node_key(root) < key:
+                    root = right(root)
+                else:
+                    stack.append(root)
+                    root = left(root)
+            yield bool(stack) and not key < node_key(stack[-1])
+
+    def _merges_batch(self, batch_size: int) -> bool:
+        """Tells if a batch is merged with T instead of applied one entry at a time."""
+        return batch_size > 1
+
+    def _apply_batch(self, operation: str, entries: List[Entry], keys: List[Any]) -> None:
+        """Replaces the entries of T with the result of the set operation between T and the
+        entries sorted by unique keys, see _combine."""
+        small, large = sorted((len(self), len(keys)))
+        if 4 * small >= large:
+            merge = getattr(self, f'_{operation}_sorted')
+            self._build(*merge(*self._sorted_items(), entries, keys))
+        else:
+            self._join_batch(operation, entries, keys)
+
+    def _join_batch(self, operation: str, entries: List[Entry], keys: List[Any]) -> None:
+        """Applies the set operation to T by splitting and joining its nodes with a subtree
+        built from the entries. Nodes are never modified, so T may still share some."""
+        self.root = getattr(self.root, operation)(self._from_items(entries, keys).root)
+
+    def _sorted_batch(self, entries: List[Entry]) -> Tuple[List[Entry], List[Any]]:
+        """Returns the entries and their keys sorted by key, keeping the first of equal keys."""
+        keys = self._keys_of(entries)
+        if any(key < previous for previous, key in zip(keys, keys[1:])):
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            entries = [entries[i] for i in order]
+            keys = [keys[i] for i in order]
+        return self._unique_sorted(entries, keys)
+
+    def _sorted_items(self) -> Tuple[List[Entry], List[Any]]:
+        """Returns the entries of T and their keys, in order.
+
+        Without a key function, both are the very same list."""
+        if self._key is None:
+            entries = list(self)
+            return entries, entries
+
+        entries, keys = [], []
+        stack = []
+        root = self.root
+
+        while stack or root:
+            if root:
+                stack.append(root)
+                root = root.left
+            else:
+                root = stack.pop()
+                entries.append(root.entry)
+                keys.append(root.key)
+                root = root.right
+
+        return entries, keys
+
+    @staticmethod
+    def _union_sorted(entries: List[Entry], keys: List[Any], other_entries: List[Entry],
+                      other_keys: List[Any]) -> Tuple[List[Entry], List[Any]]:
+        """Merges two lists of entries sorted by unique keys, the first one wins on equal keys."""
+        union_entries, union_keys = [], []
+        i, j = 0, 0
+
+        while i < len(keys) and j < len(other_keys):
+            if other_keys[j] < keys[i]:
+                union_entries.append(other_entries[j])
+                union_keys.append(other_keys[j])
+                j += 1
+            else:
+                if not keys[i] < other_keys[j]:
+                    j += 1
+                union_entries.append(entries[i])
+                union_keys.append(keys[i])
+                i += 1
+
+        union_entries.extend(entries[i:] or other_entries[j:])
+        union_keys.extend(keys[i:] or other_keys[j:])
+        return union_entries, union_keys
+
+    @staticmethod
+    def _intersection_sorted(entries: List[Entry], keys: List[Any], other_entries: List[Entry],
+                             other_keys: List[Any]) -> Tuple[List[Entry], List[Any]]:
+        """Returns the entries, sorted by unique keys, whose key is in other_keys."""
+        intersection_entries, intersection_keys = [], []
+        j = 0
+
+        for entry, key in zip(entries, keys):
+            while j < len(other_keys) and other_keys[j] < key:
+                j += 1
+            if j < len(other_keys) and not key < other_keys[j]:
+                intersection_entries.append(entry)
+                intersection_keys.append(key)
+
+        return intersection_entries, intersection_keys
+
+    @staticmethod
+    def _difference_sorted(entries: List[Entry], keys: List[Any], other_entries: List[Entry],
+                           other_keys: List[Any]) -> Tuple[List[Entry], List[Any]]:
+        """Returns the entries, sorted by unique keys, whose key is not in other_keys."""
+        difference_entries, difference_keys = [], []
+        j = 0
+
+        for entry, key in zip(entries, keys):
+            while j < len(other_keys) and other_keys[j] < key:
+                j += 1
+            if j < len(other_keys) and not key < other_keys[j]:
+                continue
+            difference_entries.append(entry)
+            difference_keys.append(key)
+
+        return difference_entries, difference_keys
+
+    @staticmethod
+    def _symmetric_difference_sorted(entries: List[Entry], keys: List[Any],
+                                     other_entries: List[Entry],
+                                     other_keys: List[Any]) -> Tuple[List[Entry], List[Any]]:
+        """Merges two lists of entries sorted by unique keys, dropping the keys they share."""
+        result_entries, result_keys = [], []
+        i, j = 0, 0
+
+        while i < len(keys) and j < len(other_keys):
+            if keys[i] < other_keys[j]:
+                result_entries.append(entries[i])
+                result_keys.append(keys[i])
+                i += 1
+            elif other_keys[j] < keys[i]:
+                result_entries.append(other_entries[j])
+                result_keys.append(other_keys[j])
+                j += 1
+            else:
+                i += 1
+                j += 1
+
+        result_entries.extend(entries[i:] or other_entries[j:])
+        result_keys.extend(keys[i:] or other_keys[j:])
+        return result_entries, result_keys
+
+    def split(self, entry: Entry) -> Tuple['AVLTree', 'AVLTree']:
+        """T.split(entry) -> (L, R), L with the entries smaller than entry, R with the others.
+
+        Takes O(log n). The nodes of T are handed over to L and R, so T is left empty.
+        """
+        key = _key_of(self._key, entry)
+        left, right = self.root.split(key)
+        self.root = EMPTY_NODE
+        left, right = self._with_root(left), self._with_root(right)
+        left._shared = right._shared = self._shared
+        return left, right
+
+    @staticmethod
+    def join(left: 'AVLTree', right: 'AVLTree') -> 'AVLTree':
+        """AVLTree.join(L, R) -> new tree with the entries of L followed by the entries of R.
+
+        Every entry of L must be smaller than every entry of R, else raise ValueError.
+        Takes O(log n). The nodes of L and R are handed over to the new tree, so both are
+        left empty.
+        """
+        left._check_joinable(right)
+        return left._join(right)
+
+    def _join(self, other: 'AVLTree') -> 'AVLTree':
+        """Returns a new tree with the entries of T followed by the ones of other."""
+        if not self.root:
+            root = other.root
+        else:
+            rest, last = self.root.split_last()
+            root = last.join(rest, other.root)
+
+        self.root = other.root = EMPTY_NODE
+        tree = self._with_root(root)
+        tree._shared = self._shared or other._shared
+        return tree
+
+    def _check_joinable(self, other: 'AVLTree') -> None:
+        """Raise ValueError unless every entry of T is smaller than every entry of other."""
+        if type(self) is not type(other):
+            raise ValueError('Cannot join trees with different storages.')
+        if self._key is not other._key:
+            raise ValueError('Cannot join trees with different key functions.')
+        if self and other:
+            last, first = self.max(), other.min()
+            if self._key is not None:
+                last, first = self._key(last), self._key(first)
+            if not last < first:
+                raise ValueError(f'Cannot join trees, {self.max()} is not smaller than '
+                                 f'{other.min()}.')
+
+    def _with_root(self, root: Union[_AVLNode, _EmptyAVLNode]) -> 'AVLTree':
+        """Returns a new tree like T, holding the subtree root."""
+        tree = self.__class__(key=self._key)
+        tree.root = root
+        return tree
+
+    def union(self, other: Iterable[Entry], workers: int = None) -> 'AVLTree':
+        """T.union(other) -> new tree with the entries in T, in other or in both.
+        Same as T | other. Where T and other have equal entries, the one of T is kept.
+
+        workers : the number of processes to spread the work on, default None.
+            The entries are cut into that many key ranges, each one handled by its own
+            process. This is only done on large inputs, and the entries must be picklable.
+
+        Without workers, the result is built by splitting and joining the trees in
+        O(m log(n / m + 1)), m <= n being their sizes. It shares nodes with T and other until
+        one of them is changed, which then copies its nodes first, in O(n). When m is at
+        least n / 4, the sorted entries are merged in O(n) instead, which is faster. With
+        workers, each process merges the sorted entries of its range in linear time, and
+        the result is built from them.
+        """
+        return self._set_operation('union', other, workers)
+
+    def intersection(self, other: Iterable[Entry], workers: int = None) -> 'AVLTree':
+        """T.intersection(other) -> new tree with the entries both in T and in other.
+        Same as T & other. See union for workers."""
+        return self._set_operation('intersection', other, workers)
+
+    def difference(self, other: Iterable[Entry], workers: int = None) -> 'AVLTree':
+        """T.difference(other) -> new tree with the entries in T but not in other.
+        Same as T - other. See union for workers."""
+        return self._set_operation('difference', other, workers)
+
+    def symmetric_difference(self, other: Iterable[Entry], workers: int = None) -> 'AVLTree':
+        """T.symmetric_difference(other) -> new tree with the entries in T or in other but not in
+        both. Same as T ^ other. See union for workers."""
+        return self._set_operation('symmetric_difference', other, workers)
+
+    def __or__(self, other: 'AVLTree') -> 'AVLTree':
+        """T | other -> T.union(other)"""
+        if not isinstance(other, AVLTree):
+            return NotImplemented
+        return self.union(other)
+
+    def __and__(self, other: 'AVLTree') -> 'AVLTree':
+        """T & other -> T.intersection(other)"""
+        if not isinstance(other, AVLTree):
+            return NotImplemented
+        return self.intersection(other)
+
+    def __sub__(self, other: 'AVLTree') -> 'AVLTree':
+        """T - other -> T.difference(other)"""
+        if not isinstance(other, AVLTree):
+            return NotImplemented
+        return self.difference(other)
+
+    def __xor__(self, other: 'AVLTree') -> 'AVLTree':
+        """T ^ other -> T.symmetric_difference(other)"""
+        if not isinstance(other, AVLTree):
+            return NotImplemented
+        return self.symmetric_difference(other)
+
+    def _set_operation(self, operation: str, other: Iterable[Entry], workers: int) -> 'AVLTree':
+        """Returns a new tree with the result of the set operation between T and other."""
+        if type(other) is not type(self) or other._key is not self._key:
+            other = self.__class__(other, key=self._key)
+
+        if workers is not None and workers > 1 and len(self) + len(other) >= _PARALLEL_THRESHOLD:
+            return self._from_items(*_parallel_set_operation(
+                operation, self._sorted_items(), other._sorted_items(), workers))
+
+        return self._combine(operation, other)
+
+    def _combine(self, operation: str, other: 'AVLTree') -> 'AVLTree':
+        """Returns a new tree with the result of the set operation between T and other.
+
+        The result shares the subtrees left untouched with T and other, so it takes
+        O(m log(n / m + 1)) instead of copying every node. Trees of comparable sizes gain
+        nothing from that, and merging their sorted entries is faster then."""
+        small, large = sorted((len(self), len(other)))
+        if 4 * small >= large:
+            merge = getattr(self, f'_{operation}_sorted')
+            return self._from_items(*merge(*self._sorted_items(), *other._sorted_items()))
+
+        tree = self._with_root(getattr(self.root, operation)(other.root))
+        tree._shared = self._shared = other._shared = True
+        return tree
+
+    def _unshare(self) -> None:
+        """Copies the nodes of T, which it may share with other trees, before changing them."""
+        self.root = self.root.clone()
+        self._shared = False
+
+    def _from_items(self, entries: List[Entry], keys: List[Any]) -> 'AVLTree':
+        """Returns a new tree like T, holding the entries sorted by unique keys."""
+        tree = self.__class__(key=self._key)
+        tree._build(entries, keys)
+        return tree
+
+    def _accessors(self) -> Tuple[Any, Callable, Callable, Callable, Callable, Callable]:
+        """Returns the root of T followed by functions giving the left child, the right child,
+        the key, the entry and the subtree size of a node. Empty nodes are false.
+
+        The queries shared by every storage walk the tree through them, so a storage only has
+        to provide its own accessors. pred, succ, the closest entry, rank and irange walk node
+        objects directly instead, as they are the hottest ones, see _PooledAVLTree."""
+        return (self.root,) + _NODE_ACCESSORS
+
+    def _replace_child(self, path: List[_AVLNode], child: _AVLNode,
+                       new_child: Union[_AVLNode, _EmptyAVLNode]) -> None:
+        """Replaces child by new_child in its parent, the last node of path, or at the root."""
+        if not path:
+            self.root = new_child
+        elif path[-1].left is child:
+            path[-1].left = new_child
+        else:
+            path[-1].right = new_child
+
+    def _rebalance(self, path: List[_AVLNode], size_change: int) -> None:
+        """Rebalances the nodes in path bottom-up after one of them gained or lost a child.
+
+        Once a subtree keeps its previous height the ancestors above it cannot become
+        unbalanced, so only their sizes are updated from there on.
+        """
+        _rebalance_path(self, path, size_change)
 
     def traverse(self, order='inorder') -> Generator[Entry, None, None]:
         """Traverse the tree based on a given strategy.
@@ -320,62 +1361,340 @@ class AVLTree:
 
     def _search(self, entry: Entry) -> _AVLNode:
         """Returns node.k if T has a entry k, else raise KeyError"""
+        key = _key_of(self._key, entry)
+        candidate = self._find(self.root, key)
+
+        if candidate is None or candidate.key < key:
+            raise KeyError(f'Entry {entry} not found.')
+        return candidate
+
+    def pred(self, entry: Entry) -> Entry:
+        """T.pred(entry) -> the entry right before entry, raise KeyError if there is none."""
+        key = _key_of(self._key, entry)
         root = self.root
+        pred = found = None
 
-        while root:
-            if entry > root.entry:
+        while root is not EMPTY_NODE:
+            if root.key < key:
+                pred = root
                 root = root.right
-            elif entry < root.entry:
-                root = root.left
             else:
-                return root
-
-        raise KeyError(f'Entry {entry} not found.')
+                found = root
+                root = root.left
 
-    def pred(self, entry: Entry) -> Entry:
-        return self.root.pred(EMPTY_NODE, entry)
+        if pred is None or found is None or key < found.key:
+            raise KeyError(f'Predecessor of {entry} not found.')
+        return pred.entry
 
     def succ(self, entry: Entry) -> Entry:
-        return self.root.succ(EMPTY_NODE, entry)
+        """T.succ(entry) -> the entry right after entry, raise KeyError if there is none."""
+        key = _key_of(self._key, entry)
+        root = self.root
+        succ = found = None
 
-    def __len__(self) -> int:
-        """T.__len__() <==> len(x). Retuns the number of elements in the tree."""
-        return len(self.root)
+        while root is not EMPTY_NODE:
+            if key < root.key:
+                succ = root
+                root = root.left
+            else:
+                found = root
+                root = root.right
 
-    def __contains__(self, entry) -> bool:
-        """k in T -> True if T has a entry k, else False"""
-        try:
-            self.search(entry)
-            return True
-        except KeyError:
-            return False
+        if succ is None or found is None or found.key < key:
+            raise KeyError(f'Successor of {entry} not found.')
+        return succ.entry
 
-    def max(self) -> Entry:
-        """T.max() -> get the maximum entry of T."""
-        return self.root.max()
+    def floor(self, entry: Entry, default: Any = None) -> Entry:
+        """T.floor(entry) -> the greatest entry not greater than entry, or default if none.
 
-    def min(self) -> Entry:
-        """T.min() -> get the minimum entry of T."""
-        return self.root.min()
+        Unlike pred and succ, floor, ceiling, lower and higher do not need entry to be in T.
+        They take a single descent from the root."""
+        closest = self._closest(_key_of(self._key, entry), 'le')
+        return default if closest is None else closest[0]
 
-    def clear(self) -> None:
-        """T.clear() -> Removes all entries of T leaving it empty."""
-        self.root = self.root.clear()
+    def ceiling(self, entry: Entry, default: Any = None) -> Entry:
+        """T.ceiling(entry) -> the smallest entry not smaller than entry, or default if none."""
+        closest = self._closest(_key_of(self._key, entry), 'ge')
+        return default if closest is None else closest[0]
 
-    def __repr__(self) -> str:
-        """T.__repr__(...) <==> repr(x).
-        Returns representation of the object that can be used to recreate the tree with the same values."""
-        return f'{self.__class__.__name__}({list(self._bfs())})'
+    def lower(self, entry: Entry, default: Any = None) -> Entry:
+        """T.lower(entry) -> the greatest entry smaller than entry, or default if none."""
+        closest = self._closest(_key_of(self._key, entry), 'lt')
+        return default if closest is None else closest[0]
 
-    def __str__(self) -> str:
-        """T.__str__(...) <==> str(x)."""
-        return repr(self)
+    def higher(self, entry: Entry, default: Any = None) -> Entry:
+        """T.higher(entry) -> the smallest entry greater than entry, or default if none."""
+        closest = self._closest(_key_of(self._key, entry), 'gt')
+        return default if closest is None else closest[0]
 
-    def __eq__(self, other) -> bool:
-        """Checks if two trees are equal. """
-        if isinstance(other, self.__class__):
-            if self.height == other.height and len(self) == len(other):
-                return self.root == other.root
+    def nearest(self, entry: Entry, default: Any = None) -> Entry:
+        """T.nearest(entry) -> the entry closest to entry, or default if T is empty.
+
+        The distance between two entries is the difference of their keys, so keys must
+        support subtraction. On a tie, the smaller entry wins."""
+        key = _key_of(self._key, entry)
+        below, above = self._closest(key, 'le'), self._closest(key, 'ge')
+        if below is None:
+            return default if above is None else above[0]
+        if above is None or key - below[1] <= above[1] - key:
+            return below[0]
+        return above[0]
+
+    def _closest(self, key: Any, side: str) -> Optional[Tuple[Entry, Any]]:
+        """Returns the entry and key closest to key on the given side, 'ge', 'gt', 'le' or
+        'lt', or None if there is no such entry."""
+        root = self.root
+        closest = None
+
+        if side in ('ge', 'gt'):
+            strict = side == 'gt'
+            while root is not EMPTY_NODE:
+                if key < root.key if strict else not root.key < key:
+                    closest = root
+                    root = root.left
+                else:
+                    root = root.right
+        else:
+            strict = side == 'lt'
+            while root is not EMPTY_NODE:
+                if root.key < key if strict else not key < root.key:
+                    closest = root
+                    root = root.right
+                else:
+                    root = root.left
+
+        return None if closest is None else (closest.entry, closest.key)
+
+    def seek(self, entry: Entry, side: str = 'ge') -> _AVLCursor:
+        """T.seek(entry, side='ge') -> cursor on the closest entry to entry on the given side.
+
+        side : 'ge' | 'gt' | 'le' | 'lt', default 'ge'
+            Use 'ge' for the smallest entry not smaller than entry, 'gt' for the smallest
+            entry greater than it, 'le' and 'lt' for the greatest entry not greater or smaller
+            than it. entry does not need to be in T.
+
+        The cursor has an entry attribute, next() and prev() to move to the neighbours in
+        O(1) amortized, and remove() to delete its entry and move to the next one. When there
+        is no such entry, the cursor is right after the last entry for 'ge' and 'gt', or
+        right before the first one for 'le' and 'lt'. If T counts duplicates, the cursor
+        stops on each occurrence in turn, starting from the first one of entry for 'ge' and
+        'gt' and from the last one for 'le' and 'lt'.
+        """
+        key = _key_of(self._key, entry)
+        return self._cursor_class(self, key, side)
+
+    def rank(self, entry: Entry) -> int:
+        """T.rank(entry) -> number of entries in T smaller than entry.
+
+        If entry is in T, that is its position in an in-order traversal."""
+        return self._bisect(entry)
+
+    def count_range(self, lo: Entry = None, hi: Entry = None,
+                    inclusive: Tuple[bool, bool] = (True, False)) -> int:
+        """T.count_range(lo, hi) -> number of entries between lo and hi.
+
+        Runs in O(log n) without visiting the entries. See irange for the meaning of the arguments.
+        """
+        lo_inclusive, hi_inclusive = inclusive
+        start = 0 if lo is None else self._bisect(lo, right=not lo_inclusive)
+        end = len(self) if hi is None else self._bisect(hi, right=hi_inclusive)
+
+        return max(0, end - start)
+
+    def _bisect(self, entry: Entry, right: bool = False) -> int:
+        """Returns the number of entries smaller than entry, or not greater than it if right."""
+        key = _key_of(self._key, entry)
+        rank = 0
+        root = self.root
+
+        while root is not EMPTY_NODE:
+            if key < root.key if right else not root.key < key:
+                root = root.left
+            else:
+                # The entries of the node and of its left subtree.
+                rank += root.size - root.right.size
+                root = root.right
+
+        return rank
+
+    def irange(self, lo: Entry = None, hi: Entry = None,
+               inclusive: Tuple[bool, bool] = (True, False),
+               reverse: bool = False) -> Generator[Entry, None, None]:
+        """T.irange(lo, hi) -> iterates lazily over the entries between lo and hi.
+
+        lo : the lower bound, None means no lower bound.
+        hi : the upper bound, None means no upper bound.
+        inclusive : a pair of booleans telling if lo and hi themselves belong to the range.
+            The default is (True, False), i.e., lo <= entry < hi.
+        reverse : if True, yields the entries from hi down to lo.
+
+        Reaching the first entry takes O(log n), each next entry takes O(1) amortized.
+        """
+        if self._key is not None:
+            lo = lo if lo is None else self._key(lo)
+            hi = hi if hi is None else self._key(hi)
+        if reverse:
+            return self._irange_reversed(lo, hi, inclusive)
+        return self._irange(lo, hi, inclusive)
+
+    def _irange(self, lo, hi, inclusive) -> Generator[Entry, None, None]:
+        """Performs an in-order traversal from key lo to key hi."""
+        lo_inclusive, hi_inclusive = inclusive
+        stack = []
+        root = self.root
+
+        while root is not EMPTY_NODE:
+            if lo is None or (not root.key < lo if lo_inclusive else lo < root.key):
+                stack.append(root)
+                root = root.left
+            else:
+                root = root.right
+
+        while stack:
+            root = stack.pop()
+            if hi is not None and (hi < root.key if hi_inclusive else not root.key < hi):
+                return
+            yield root.entry
+            root = root.right
+            while root is not EMPTY_NODE:
+                stack.append(root)
+                root = root.left
+
+    def _irange_reversed(self, lo, hi, inclusive) -> Generator[Entry, None, None]:
+        """Performs a reversed in-order traversal from key hi to key lo."""
+        lo_inclusive, hi_inclusive = inclusive
+        stack = []
+        root = self.root
+
+        while root is not EMPTY_NODE:
+            if hi is None or (not hi < root.key if hi_inclusive else root.key < hi):
+                stack.append(root)
+                root = root.right
+            else:
+                root = root.left
+
+        while stack:
+            root = stack.pop()
+            if lo is not None and (root.key < lo if lo_inclusive else not lo < root.key):
+                return
+            yield root.entry
+            root = root.left
+            while root is not EMPTY_NODE:
+                stack.append(root)
+                root = root.right
+
+    def select(self, index: int) -> Entry:
+        """T.select(index) -> the entry at position index of the in-order traversal.
+
+        Negative indexes count from the end. Raises IndexError if index is out of range."""
+        node_entry = self._accessors()[4]
+        return node_entry(self._select(self._normalize_index(index)))
+
+    def _select(self, index: int) -> _AVLNode:
+        """Returns the node holding the index-th smallest entry, 0 <= index < len(T)."""
+        root, left, right, _, _, size = self._accessors()
+
+        while True:
+            if index < size(left(root)):
+                root = left(root)
+            else:
+                # Skips the entries of the node and of its left subtree.
+                index -= size(root) - size(right(root))
+                if index < 0:
+                    return root
+                root = right(root)
+
+    def _normalize_index(self, index: int) -> int:
+        """Turns a possibly negative index into a position, raise IndexError if out of range."""
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError(f'{self.__class__.__name__} index out of range.')
+        return index
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Entry, List[Entry]]:
+        """T[i] -> the i-th smallest entry, T[i:j] -> list of entries from position i to j."""
+        if isinstance(index, slice):
+            positions = range(*index.indices(len(self)))
+            if not positions:
+                return []
+            start = min(positions)
+            span = max(positions) - start + 1
+            # A step skipping more entries than a descent visits selects each one by rank.
+            if len(positions) * len(self).bit_length() < span:
+                return [self.select(position) for position in positions]
+            entries = list(islice(self._inorder_from(start), span))
+            return entries[::positions.step]
+
+        return self.select(index)
+
+    def __len__(self) -> int:
+        """T.__len__() <==> len(x). Retuns the number of elements in the tree."""
+        return len(self.root)
+
+    def __contains__(self, entry) -> bool:
+        """k in T -> True if T has a entry k, else False"""
+        try:
+            self.search(entry)
+            return True
+        except KeyError:
+            return False
+
+    def count(self, entry: Entry) -> int:
+        """T.count(entry) -> number of times entry is in T, that is 0 or 1 unless T counts
+        duplicates."""
+        return int(entry in self)
+
+    def stats(self, reset: bool = False) -> Dict[str, int]:
+        """T.stats(reset=False) -> dict of the operation counts of T, see the stats argument.
+
+        When reset is True, the counts start over from zero afterwards.
+        Raise TypeError if T was not created with stats.
+        """
+        raise TypeError(f'{self.__class__.__name__} was not created with stats=True')
+
+    def aggregate(self, lo: Entry = None, hi: Entry = None,
+                  inclusive: Tuple[bool, bool] = (True, False)) -> Any:
+        """T.aggregate(lo, hi) -> the values of the entries between lo and hi, combined by
+        the monoid of T, see the monoid argument.
+
+        Runs in O(log n) without visiting the entries. See irange for the meaning of the arguments.
+        Raise TypeError if T was not created with a monoid.
+        """
+        raise TypeError(f'{self.__class__.__name__} was not created with a monoid')
+
+    def max(self) -> Entry:
+        """T.max() -> get the maximum entry of T."""
+        return self.root.max()
+
+    def min(self) -> Entry:
+        """T.min() -> get the minimum entry of T."""
+        return self.root.min()
+
+    def clear(self) -> None:
+        """T.clear() -> Removes all entries of T leaving it empty."""
+        if self._shared:
+            # Other trees may still hold the nodes, they are left as they are.
+            self.root = EMPTY_NODE
+            self._shared = False
+        else:
+            self.root = self.root.clear()
+
+    def __repr__(self) -> str:
+        """T.__repr__(...) <==> repr(x).
+        Returns representation of the object that can be used to recreate the tree with the same values."""
+        return f'{self.__class__.__name__}({list(self._bfs())})'
+
+    def __str__(self) -> str:
+        """T.__str__(...) <==> str(x)."""
+        return repr(self)
+
+    def __eq__(self, other) -> bool:
+        """Checks if two trees are equal, i.e., if they hold the same entries. """
+        if isinstance(other, AVLTree) and len(self) == len(other):
+            return all(entry == other_entry for entry, other_entry
+                       in zip(self, other))
         return False
 
     def __bool__(self) -> bool:
@@ -399,56 +1718,2553 @@ class AVLTree:
 
     def _init_tree(self, args) -> None:
         """Initialize the tree according to the arguments passed. """
-        self.root = EMPTY_NODE
-
         if args is not None:
-            if isinstance(args, self.__class__):
-                args = args.traverse('bfs')
+            if isinstance(args, AVLTree):
+                entries = list(args)
+                if args._key is self._key:
+                    # Sorted already, but a tree counting duplicates repeats its entries.
+                    self._build(*self._unique_sorted(entries, self._keys_of(entries)))
+                    return
+                args = entries
 
             try:
-                for entry in args:
+                entries = list(args)
+                keys = self._keys_of(entries)
+                if all(not key < previous for previous, key in zip(keys, keys[1:])):
+                    self._build(*self._unique_sorted(entries, keys))
+                    return
+
+                for entry in entries:
                     self.insert(entry)
             except (ValueError, TypeError) as e:
                 raise TypeError('AVLTree constructor called with '
                                 f'incompatible data type: {e}')
 
+    def _build(self, entries: List[Entry], keys: List[Any]) -> None:
+        """Replaces the content of the tree with the entries, sorted by their unique keys."""
+        self.root = self._node_class.build(entries, keys, 0, len(entries))
+
+    def _inorder_from(self, index: int) -> Generator[Entry, None, None]:
+        """Performs an in-order traversal starting at the index-th smallest entry."""
+        root, left, right, _, node_entry, size = self._accessors()
+        stack = []
+
+        while root:
+            left_size = size(left(root))
+            if index < left_size:
+                stack.append(root)
+                root = left(root)
+            elif index > left_size:
+                index -= left_size + 1
+                root = right(root)
+            else:
+                stack.append(root)
+                break
+
+        while stack:
+            root = stack.pop()
+            yield node_entry(root)
+            root = right(root)
+            while root:
+                stack.append(root)
+                root = left(root)
+
+    def __iter__(self) -> Generator[Entry, None, None]:
+        """T.__iter__() <==> iter(T). Iterates over the entries in increasing order."""
+        return self._inorder(self.root)
+
+    def __reversed__(self) -> Generator[Entry, None, None]:
+        """T.__reversed__() <==> reversed(T). Iterates over the entries in decreasing order."""
+        return self._reversed(self.root)
+
+    # The traversals below keep their own stack of nodes instead of recursing, so each entry
+    # goes through a single generator frame. Empty children are told apart by identity,
+    # which is much cheaper than calling __bool__ on every node.
+
     def _inorder(self, root) -> Generator[Entry, None, None]:
-        """Performs an in-order traversal. """
-        if root:
-            yield from self._inorder(root.left)
-            yield root.entry
-            yield from self._inorder(root.right)
+        """Performs an in-order traversal, see _inorder_entries. """
+        return _inorder_entries(root)
+
+    def _reversed(self, root) -> Generator[Entry, None, None]:
+        """Performs a reversed in-order traversal, from the greatest entry down."""
+        return _reversed_entries(root)
 
     def _preorder(self, root) -> Generator[Entry, None, None]:
         """Performs an pre-order traversal."""
-        if root:
-            yield root.entry
-            yield from self._preorder(root.left)
-            yield from self._preorder(root.right)
+        stack = [root]
+        push, pop = stack.append, stack.pop
+
+        while stack:
+            root = pop()
+            if root is not EMPTY_NODE:
+                yield root.entry
+                push(root.right)
+                push(root.left)
 
     def _postorder(self, root) -> Generator[Entry, None, None]:
         """Performs an post-order traversal."""
-        if root:
-            yield from self._postorder(root.left)
-            yield from self._postorder(root.right)
-            yield root.entry
+        stack = []
+        push, pop = stack.append, stack.pop
+        last = EMPTY_NODE
+
+        while True:
+            while root is not EMPTY_NODE:
+                push(root)
+                root = root.left
+            if not stack:
+                return
+            node = stack[-1]
+            if node.right is not EMPTY_NODE and node.right is not last:
+                root = node.right
+            else:
+                yield node.entry
+                last = pop()
 
     def _bfs(self) -> Generator[Entry, None, None]:
         """Performs an Breadth first traversal."""
-        root = self.root
+        q = deque([self.root])
+        append, popleft = q.append, q.popleft
 
-        if root:
-            q = deque()
-            q.append(root)
+        while q:
+            root = popleft()
+            if root is not EMPTY_NODE:
+                yield root.entry
+                append(root.left)
+                append(root.right)
 
-            while q:
-                root = q.popleft()
-                if not root:
-                    continue
 
-                yield root.entry
-                left = root.left
-                right = root.right
+class _PooledAVLTree(AVLTree):
+    """
+    AVLTree that keeps its structure in parallel integer arrays instead of node objects.
+
+    Node i holds _entries[i] and _keys[i], which is the very same list when the tree has
+    no key function. Its children, height and subtree size live in _left[i], _right[i],
+    _height[i] and _size[i]. Index 0 is the empty node, so it
+    always has height and size 0. Slots of deleted nodes are chained through _left
+    in a free list and reused by later insertions.
+
+    Created with AVLTree(..., storage='pool').
+    """
+
+    def __init__(self, args: Iterable[Any] = None, storage: str = 'pool',
+                 key: Callable[[Entry], Any] = None, duplicates: str = 'ignore',
+                 stats: bool = False, dtype: str = None, monoid: Monoid = None):
+        """Initialize an AVL Tree backed by a node pool. """
+        self._key = key
+        self._reset()
+        self._init_tree(args)
+
+    def _reset(self) -> None:
+        """Drops every node, leaving only the empty node in the pool."""
+        self._entries: List[Entry] = [None]
+        self._keys: List[Any] = self._entries if self._key is None else [None]
+        self._left = array('i', [0])
+        self._right = array('i', [0])
+        self._height = array('i', [0])
+        self._size = array('i', [0])
+        self._root = 0
+        self._free = 0
+
+    def _new_node(self, entry: Entry, key: Any) -> int:
+        """Takes a slot from the free list, or grows the pool, and stores entry in it."""
+        node = self._free
+        if node:
+            # The entry goes first: a typed array may reject it, and the slot is lost if it
+            # has already left the free list by then.
+            self._entries[node] = entry
+            self._keys[node] = key
+            self._free = self._left[node]
+            self._left[node] = 0
+            self._right[node] = 0
+            self._height[node] = 1
+            self._size[node] = 1
+        else:
+            node = len(self._entries)
+            self._entries.append(entry)
+            if self._keys is not self._entries:
+                self._keys.append(key)
+            self._left.append(0)
+            self._right.append(0)
+            self._height.append(1)
+            self._size.append(1)
+        return node
+
+    def _free_node(self, node: int) -> None:
+        """Gives the slot of a unlinked node back to the free list."""
+        self._entries[node] = None
+        self._keys[node] = None
+        self._left[node] = self._free
+        self._free = node
+
+    def insert(self, entry: Entry) -> None:
+        """T.insert(entry) -- insert elem"""
+        key = _key_of(self._key, entry)
+        keys, left, right = self._keys, self._left, self._right
+        path = []
+        root = self._root
+        candidate = 0
+        smaller = False
+
+        while root:
+            path.append(root)
+            smaller = key < keys[root]
+            if smaller:
+                root = left[root]
+            else:
+                candidate = root
+                root = right[root]
+
+        if candidate and not keys[candidate] < key:
+            return
+
+        node = self._new_node(entry, key)
+        if not path:
+            self._root = node
+        elif smaller:
+            left[path[-1]] = node
+        else:
+            right[path[-1]] = node
+
+        self._rebalance(path, 1)
+
+    def delete(self, entry: Entry) -> None:
+        """T.remove(entry) remove item <entry> from tree."""
+        key = _key_of(self._key, entry)
+        entries, keys, left, right = self._entries, self._keys, self._left, self._right
+        path = []
+        root = self._root
+        depth = -1
+
+        while root:
+            path.append(root)
+            if key < keys[root]:
+                root = left[root]
+            else:
+                depth = len(path) - 1
+                root = right[root]
+
+        if depth < 0 or keys[path[depth]] < key:
+            raise KeyError(entry)
+
+        root = path[depth]
+        del path[depth:]
+
+        if left[root]:
+            path.append(root)
+            removed = left[root]
+            while right[removed]:
+                path.append(removed)
+                removed = right[removed]
+            entries[root] = entries[removed]
+            keys[root] = keys[removed]
+            self._replace_child(path, removed, left[removed])
+        else:
+            removed = root
+            self._replace_child(path, root, right[root])
+
+        self._free_node(removed)
+        self._rebalance(path, -1)
+
+    def _accessors(self) -> Tuple[int, Callable, Callable, Callable, Callable, Callable]:
+        """Returns the root of T and the accessors to its nodes, see AVLTree._accessors.
+
+        getitem bound with partial indexes an array much faster than its own __getitem__."""
+        return (self._root, partial(getitem, self._left), partial(getitem, self._right),
+                partial(getitem, self._keys), partial(getitem, self._entries),
+                partial(getitem, self._size))
+
+    # AVLTree walks node objects directly in its hottest queries. The versions below are the
+    # same queries written against _accessors, shared by the storages without node objects.
+
+    def pred(self, entry: Entry) -> Entry:
+        """T.pred(entry) -> the entry right before entry, raise KeyError if there is none."""
+        key = _key_of(self._key, entry)
+        root, left, right, node_key, node_entry, _ = self._accessors()
+        pred = found = None
+
+        while root:
+            if node_key(root) < key:
+                pred = root
+                root = right(root)
+            else:
+                found = root
+                root = left(root)
+
+        if pred is None or found is None or key < node_key(found):
+            raise KeyError(f'Predecessor of {entry} not found.')
+        return node_entry(pred)
+
+    def succ(self, entry: Entry) -> Entry:
+        """T.succ(entry) -> the entry right after entry, raise KeyError if there is none."""
+        key = _key_of(self._key, entry)
+        root, left, right, node_key, node_entry, _ = self._accessors()
+        succ = found = None
+
+        while root:
+            if key < node_key(root):
+                succ = root
+                root = left(root)
+            else:
+                found = root
+                root = right(root)
+
+        if succ is None or found is None or node_key(found) < key:
+            raise KeyError(f'Successor of {entry} not found.')
+        return node_entry(succ)
+
+    def _closest(self, key: Any, side: str) -> Optional[Tuple[Entry, Any]]:
+        """Returns the entry and key closest to key on the given side, 'ge', 'gt', 'le' or
+        'lt', or None if there is no such entry."""
+        root, left, right, node_key, node_entry, _ = self._accessors()
+        closest = None
+
+        if side in ('ge', 'gt'):
+            strict = side == 'gt'
+            while root:
+                if key < node_key(root) if strict else not node_key(root) < key:
+                    closest = root
+                    root = left(root)
+                else:
+                    root = right(root)
+        else:
+            strict = side == 'lt'
+            while root:
+                if node_key(root) < key if strict else not key < node_key(root):
+                    closest = root
+                    root = right(root)
+                else:
+                    root = left(root)
+
+        return None if closest is None else (node_entry(closest), node_key(closest))
+
+    def _bisect(self, entry: Entry, right: bool = False) -> int:
+        """Returns the number of entries smaller than entry, or not greater than it if right."""
+        key = _key_of(self._key, entry)
+        root, left_of, right_of, node_key, _, size = self._accessors()
+        rank = 0
+
+        while root:
+            if key < node_key(root) if right else not node_key(root) < key:
+                root = left_of(root)
+            else:
+                # The entries of the node and of its left subtree.
+                rank += size(root) - size(right_of(root))
+                root = right_of(root)
+
+        return rank
+
+    def _irange(self, lo, hi, inclusive) -> Generator[Entry, None, None]:
+        """Performs an in-order traversal from key lo to key hi."""
+        root, left, right, node_key, node_entry, _ = self._accessors()
+        lo_inclusive, hi_inclusive = inclusive
+        stack = []
+
+        while root:
+            if lo is None or (not node_key(root) < lo if lo_inclusive else lo < node_key(root)):
+                stack.append(root)
+                root = left(root)
+            else:
+                root = right(root)
+
+        while stack:
+            root = stack.pop()
+            if hi is not None and (hi < node_key(root) if hi_inclusive
+                                   else not node_key(root) < hi):
+                return
+            yield node_entry(root)
+            root = right(root)
+            while root:
+                stack.append(root)
+                root = left(root)
+
+    def _irange_reversed(self, lo, hi, inclusive) -> Generator[Entry, None, None]:
+        """Performs a reversed in-order traversal from key hi to key lo."""
+        root, left, right, node_key, node_entry, _ = self._accessors()
+        lo_inclusive, hi_inclusive = inclusive
+        stack = []
+
+        while root:
+            if hi is None or (not hi < node_key(root) if hi_inclusive else node_key(root) < hi):
+                stack.append(root)
+                root = right(root)
+            else:
+                root = left(root)
+
+        while stack:
+            root = stack.pop()
+            if lo is not None and (node_key(root) < lo if lo_inclusive
+                                   else not lo < node_key(root)):
+                return
+            yield node_entry(root)
+            root = left(root)
+            while root:
+                stack.append(root)
+                root = right(root)
+
+    def _replace_child(self, path: List[int], child: int, new_child: int) -> None:
+        """Replaces child by new_child in its parent, the last node of path, or at the root."""
+        if not path:
+            self._root = new_child
+        elif self._left[path[-1]] == child:
+            self._left[path[-1]] = new_child
+        else:
+            self._right[path[-1]] = new_child
+
+    def _rebalance(self, path: List[int], size_change: int) -> None:
+        """Rebalances the nodes in path bottom-up, see AVLTree._rebalance."""
+        height, size = self._height, self._size
+
+        while path:
+            node = path.pop()
+            old_height = height[node]
+            self._update_height(node)
+            balanced = self._balance_tree_if_unbalanced(node)
+            if balanced != node:
+                self._replace_child(path, node, balanced)
+
+            if height[balanced] == old_height:
+                for ancestor in path:
+                    size[ancestor] += size_change
+                return
+
+    def _update_height(self, node: int) -> None:
+        """Updated the height and the subtree size of node."""
+        left, right, height, size = self._left[node], self._right[node], self._height, self._size
+        height[node] = 1 + max(height[left], height[right])
+        size[node] = 1 + size[left] + size[right]
+
+    def _balance_factor(self, node: int) -> int:
+        """Returns the balance factor of the node."""
+        return self._height[self._left[node]] - self._height[self._right[node]]
+
+    def _balance_tree_if_unbalanced(self, node: int) -> int:
+        """Performs the appropriate rotation if the the subtree is unbalanced."""
+        balance_factor = self._balance_factor(node)
+        if balance_factor == 2:
+            if self._balance_factor(self._left[node]) == -1:
+                self._left[node] = self._rotate_left(self._left[node])
+            return self._rotate_right(node)
+        elif balance_factor == -2:
+            if self._balance_factor(self._right[node]) == 1:
+                self._right[node] = self._rotate_right(self._right[node])
+            return self._rotate_left(node)
+        return node
+
+    def _rotate_left(self, node: int) -> int:
+        """Performs a left rotation."""
+        right_tree = self._right[node]
+        self._right[node] = self._left[right_tree]
+        self._left[right_tree] = node
+
+        self._update_height(node)
+        self._update_height(right_tree)
+
+        return right_tree
+
+    def _rotate_right(self, node: int) -> int:
+        """Performs a right rotation."""
+        left_tree = self._left[node]
+        self._left[node] = self._right[left_tree]
+        self._right[left_tree] = node
+
+        self._update_height(node)
+        self._update_height(left_tree)
+
+        return left_tree
+
+    @property
+    def height(self) -> int:
+        """Returns the height of the tree. When the tree is empty its height is zero."""
+        return self._height[self._root]
+
+    def search(self, entry: Entry) -> Entry:
+        """Returns k if T has a entry k, else raise KeyError"""
+        return self._entries[self._search(entry)]
+
+    def _search(self, entry: Entry) -> int:
+        """Returns the node holding entry, else raise KeyError"""
+        key = _key_of(self._key, entry)
+        keys, left, right = self._keys, self._left, self._right
+        root = self._root
+        candidate = 0
+
+        while root:
+            if key < keys[root]:
+                root = left[root]
+            else:
+                candidate = root
+                root = right[root]
+
+        if not candidate or keys[candidate] < key:
+            raise KeyError(f'Entry {entry} not found.')
+        return candidate
+
+    def split(self, entry: Entry) -> Tuple['AVLTree', 'AVLTree']:
+        """T.split(entry) -> (L, R), see AVLTree.split.
+
+        Nodes cannot move from a pool to another one, so L and R are rebuilt in O(n)."""
+        entries, keys = self._sorted_items()
+        index = self._bisect(entry)
+        self.clear()
+        return (self._from_items(entries[:index], keys[:index]),
+                self._from_items(entries[index:], keys[index:]))
+
+    def _join(self, other: 'AVLTree') -> 'AVLTree':
+        """Returns a new tree with the entries of T followed by the ones of other.
+
+        Nodes cannot move from a pool to another one, so the new tree is rebuilt in O(n)."""
+        entries, keys = self._sorted_items()
+        other_entries, other_keys = other._sorted_items()
+        self.clear()
+        other.clear()
+        return self._from_items(entries + other_entries, keys + other_keys)
+
+    def _combine(self, operation: str, other: 'AVLTree') -> 'AVLTree':
+        """Returns a new tree with the result of the set operation between T and other.
+
+        The entries of both pools are merged in O(n + m)."""
+        merge = getattr(self, f'_{operation}_sorted')
+        return self._from_items(*merge(*self._sorted_items(), *other._sorted_items()))
+
+    def _merges_batch(self, batch_size: int) -> bool:
+        """Tells if a batch is large enough to be merged with T instead of applied one by one.
+
+        Pools have no split and join, so merging a batch rebuilds the whole tree."""
+        return batch_size * (self.height + 1) >= len(self)
+
+    def _apply_batch(self, operation: str, entries: List[Entry], keys: List[Any]) -> None:
+        """Replaces the entries of T with the result of the set operation between T and the
+        entries sorted by unique keys, rebuilding the pool in O(n + m)."""
+        merge = getattr(self, f'_{operation}_sorted')
+        self._build(*merge(*self._sorted_items(), entries, keys))
+
+    def _sorted_items(self) -> Tuple[List[Entry], List[Any]]:
+        """Returns the entries of T and their keys, in order, see AVLTree._sorted_items."""
+        entries, keys = self._entries, self._keys
+        nodes = list(self._inorder_nodes())
+        if self._key is None:
+            entries = [entries[node] for node in nodes]
+            return entries, entries
+        return [entries[node] for node in nodes], [keys[node] for node in nodes]
+
+    def _inorder_nodes(self) -> Generator[int, None, None]:
+        """Iterates over the nodes in order."""
+        left, right = self._left, self._right
+        stack = []
+        root = self._root
+
+        while stack or root:
+            if root:
+                stack.append(root)
+                root = left[root]
+            else:
+                root = stack.pop()
+                yield root
+                root = right[root]
+
+    def __len__(self) -> int:
+        """T.__len__() <==> len(x). Retuns the number of elements in the tree."""
+        return self._size[self._root]
+
+    def __bool__(self) -> bool:
+        """Returns True if the tree is not empty"""
+        return self._root != 0
+
+    def max(self) -> Entry:
+        """T.max() -> get the maximum entry of T."""
+        return self._max(self._root)
+
+    def min(self) -> Entry:
+        """T.min() -> get the minimum entry of T."""
+        return self._min(self._root)
+
+    def _max(self, root: int) -> Entry:
+        """Returns the max element in the subtree."""
+        right = self._right
+        while right[root]:
+            root = right[root]
+        return self._entries[root]
+
+    def _min(self, root: int) -> Entry:
+        """Returns the min element in the subtree."""
+        left = self._left
+        while left[root]:
+            root = left[root]
+        return self._entries[root]
+
+    def clear(self) -> None:
+        """T.clear() -> Removes all entries of T leaving it empty."""
+        self._reset()
+
+    def traverse(self, order='inorder') -> Generator[Entry, None, None]:
+        """Traverse the tree based on a given strategy, see AVLTree.traverse."""
+        if order == 'preorder':
+            return self._preorder(self._root)
+        elif order == 'postorder':
+            return self._postorder(self._root)
+        elif order == 'bfs':
+            return self._bfs()
+        else:
+            return self._inorder(self._root)
+
+    def __repr__(self) -> str:
+        """T.__repr__(...) <==> repr(x).
+        Returns representation of the object that can be used to recreate the tree."""
+        return f"AVLTree({list(self._bfs())}, storage='pool')"
+
+    def _build(self, entries: List[Entry], keys: List[Any]) -> None:
+        """Replaces the content of the tree with the entries, sorted by their unique keys."""
+        self._reset()
+        self._root = self._build_subtree(entries, keys, 0, len(entries))
+
+    def _build_subtree(self, entries: List[Entry], keys: List[Any], start: int,
+                       stop: int) -> int:
+        """Builds a perfectly balanced subtree out of the sorted entries[start:stop]."""
+        if start >= stop:
+            return 0
+
+        middle = (start + stop - 1) // 2
+        node = self._new_node(entries[middle], keys[middle])
+        self._left[node] = self._build_subtree(entries, keys, start, middle)
+        self._right[node] = self._build_subtree(entries, keys, middle + 1, stop)
+        self._update_height(node)
+
+        return node
+
+    def _inorder(self, root) -> Generator[Entry, None, None]:
+        """Performs an in-order traversal. """
+        entries, left, right = self._entries, self._left, self._right
+        stack = []
+
+        while stack or root:
+            if root:
+                stack.append(root)
+                root = left[root]
+            else:
+                root = stack.pop()
+                yield entries[root]
+                root = right[root]
+
+    def __iter__(self) -> Generator[Entry, None, None]:
+        """T.__iter__() <==> iter(T). Iterates over the entries in increasing order."""
+        return self._inorder(self._root)
+
+    def __reversed__(self) -> Generator[Entry, None, None]:
+        """T.__reversed__() <==> reversed(T). Iterates over the entries in decreasing order."""
+        return self._reversed(self._root)
+
+    def _reversed(self, root) -> Generator[Entry, None, None]:
+        """Performs a reversed in-order traversal, from the greatest entry down."""
+        entries, left, right = self._entries, self._left, self._right
+        stack = []
+
+        while stack or root:
+            if root:
+                stack.append(root)
+                root = right[root]
+            else:
+                root = stack.pop()
+                yield entries[root]
+                root = left[root]
+
+    def _preorder(self, root) -> Generator[Entry, None, None]:
+        """Performs an pre-order traversal."""
+        entries, left, right = self._entries, self._left, self._right
+        stack = [root] if root else []
+
+        while stack:
+            root = stack.pop()
+            yield entries[root]
+            if right[root]:
+                stack.append(right[root])
+            if left[root]:
+                stack.append(left[root])
+
+    def _postorder(self, root) -> Generator[Entry, None, None]:
+        """Performs an post-order traversal."""
+        entries, left, right = self._entries, self._left, self._right
+        stack = []
+        last = 0
+
+        while stack or root:
+            if root:
+                stack.append(root)
+                root = left[root]
+                continue
+            node = stack[-1]
+            if right[node] and right[node] != last:
+                root = right[node]
+            else:
+                yield entries[node]
+                last = stack.pop()
+
+    def _bfs(self) -> Generator[Entry, None, None]:
+        """Performs an Breadth first traversal."""
+        entries, left, right = self._entries, self._left, self._right
+        q = deque([self._root] if self._root else [])
+
+        while q:
+            root = q.popleft()
+            yield entries[root]
+            if left[root]:
+                q.append(left[root])
+            if right[root]:
+                q.append(right[root])
+
+
+class _TypedAVLTree(_PooledAVLTree):
+    """
+    AVLTree of int64 or float64 numbers, which are kept in a typed array.
+
+    The node pool is the one of _PooledAVLTree, except that _entries, which is also _keys,
+    is an array.array of 8-byte numbers instead of a list of Python objects, so an entry
+    takes 8 bytes instead of a whole int or float object.
+
+    With NumPy, the bulk operations never create a Python object per entry. A tree built
+    from sorted numbers gets node i + 1 for the i-th of them, and all the node arrays are
+    computed at once for each level of the tree. traverse and irange walk the tree one
+    level at a time as well: the in-order position of a node follows from the position of
+    its subtree and the size of its left subtree, so each level is a few vectorized steps.
+
+    Created with AVLTree(..., dtype='int64') or dtype='float64'.
+    """
+
+    dtype = None
+    _type_code = None
+
+    def __init__(self, args: Iterable[Any] = None, storage: str = 'pool',
+                 key: Callable[[Entry], Any] = None, duplicates: str = 'ignore',
+                 stats: bool = False, dtype: str = None, monoid: Monoid = None):
+        """Initialize an AVL Tree of numbers. """
+        self._key = None
+        self._reset()
+        if np is not None and isinstance(args, np.ndarray):
+            self._build_array(np.unique(self._cast(args)))
+        else:
+            self._init_tree(args)
+
+    def _reset(self) -> None:
+        """Drops every node, leaving only the empty node in the pool."""
+        super()._reset()
+        self._entries = self._keys = array(self._type_code, [0])
+
+    def _free_node(self, node: int) -> None:
+        """Gives the slot of a unlinked node back to the free list."""
+        self._entries[node] = 0
+        self._left[node] = self._free
+        self._free = node
+
+    def _cast(self, values: 'np.ndarray') -> 'np.ndarray':
+        """Returns values as an array of the dtype of T, raise TypeError if that would lose
+        their kind, like floats into int64. Empty arrays, float64 by default, are always
+        cast."""
+        if not values.size:
+            return values.astype(self.dtype)
+        return values.astype(self.dtype, casting='same_kind', copy=False)
+
+    def insert_many(self, entries: Iterable[Entry]) -> None:
+        """T.insert_many(seq) -- insert every entry of seq, see AVLTree.insert_many.
+
+        seq can be a NumPy array, which a large batch merges with the entries of T without
+        going through Python objects."""
+        if np is not None and isinstance(entries, np.ndarray):
+            if self._merges_batch(len(entries)):
+                self._build_array(np.union1d(self._traverse_array('inorder'),
+                                             self._cast(entries)))
+                return
+            entries = entries.tolist()
+        super().insert_many(entries)
+
+    def _build(self, entries: List[Entry], keys: List[Any]) -> None:
+        """Replaces the content of the tree with the sorted entries, which are unique."""
+        if np is None:
+            super()._build(entries, keys)
+        elif not len(entries):
+            self._reset()
+        else:
+            self._build_array(self._cast(np.asarray(entries)))
+
+    def _build_array(self, values: 'np.ndarray') -> None:
+        """Replaces the content of the tree with the sorted and unique values, in O(n)."""
+        self._reset()
+        length = len(values)
+        if not length:
+            return
+
+        # Node i + 1 holds values[i], and the subtree over values[start:stop] is rooted at
+        # the middle, like in _build_subtree.
+        left, right, height, size = (np.zeros(length + 1, dtype=np.intc) for _ in range(4))
+        starts, stops = np.array([0]), np.array([length])
+        while starts.size:
+            middles = (starts + stops - 1) // 2
+            nodes = middles + 1
+            size[nodes] = stops - starts
+            # A balanced subtree of n entries has the height of n in bits.
+            height[nodes] = np.frexp(stops - starts)[1]
+            has_left, has_right = starts < middles, middles + 1 < stops
+            left[nodes] = np.where(has_left, (starts + middles - 1) // 2 + 1, 0)
+            right[nodes] = np.where(has_right, (middles + stops) // 2 + 1, 0)
+            starts, stops = (np.concatenate((starts[has_left], middles[has_right] + 1)),
+                             np.concatenate((middles[has_left], stops[has_right])))
+
+        self._entries.frombytes(np.ascontiguousarray(values, dtype=self.dtype).tobytes())
+        for pool, nodes in ((self._left, left), (self._right, right),
+                            (self._height, height), (self._size, size)):
+            pool.frombytes(nodes[1:].tobytes())
+        self._root = (length - 1) // 2 + 1
+
+    def _traverse_array(self, order: str, start: int = 0, stop: int = None) -> 'np.ndarray':
+        """Returns the entries in the given order, as a NumPy array. For an in-order
+        traversal, only the ones from position start to stop."""
+        stop = len(self) if stop is None else stop
+        result = np.empty(max(0, stop - start) if order == 'inorder' else len(self),
+                          dtype=self.dtype)
+        if not result.size:
+            return result
+
+        entries = np.frombuffer(self._entries, dtype=self.dtype)
+        left, right, size = (np.frombuffer(pool, dtype=np.intc)
+                             for pool in (self._left, self._right, self._size))
+        # Each level holds nodes and the first position taken by their subtrees, except in
+        # a breadth-first traversal, where the levels just come one after the other.
+        nodes, firsts = np.array([self._root]), np.array([0])
+        visited = 0
+        while nodes.size:
+            lefts, rights = left[nodes], right[nodes]
+            left_sizes = size[lefts]
+            if order == 'preorder':
+                positions, left_firsts, right_firsts = firsts, firsts + 1, firsts + 1 + left_sizes
+            elif order == 'postorder':
+                positions = firsts + size[nodes] - 1
+                left_firsts, right_firsts = firsts, firsts + left_sizes
+            elif order == 'bfs':
+                positions = np.arange(visited, visited + nodes.size)
+                left_firsts = right_firsts = firsts
+            else:
+                positions = firsts + left_sizes
+                left_firsts, right_firsts = firsts, positions + 1
+            visited += nodes.size
+
+            if order == 'inorder':
+                inside = (start <= positions) & (positions < stop)
+                result[positions[inside] - start] = entries[nodes[inside]]
+            else:
+                result[positions] = entries[nodes]
+
+            # Children interleaved, so that every level goes from left to right.
+            nodes = np.stack((lefts, rights), axis=1).ravel()
+            firsts = np.stack((left_firsts, right_firsts), axis=1).ravel()
+            keep = nodes != 0
+            if order == 'inorder':
+                keep &= (firsts < stop) & (firsts + size[nodes] > start)
+            nodes, firsts = nodes[keep], firsts[keep]
+        return result
+
+    def traverse(self, order='inorder') -> Union['np.ndarray', array]:
+        """Returns the entries in the given order, see AVLTree.traverse, as a NumPy array, or
+        an array.array without NumPy."""
+        if order not in ('preorder', 'postorder', 'bfs'):
+            order = 'inorder'
+        if np is None:
+            return array(self._type_code, super().traverse(order))
+        return self._traverse_array(order)
+
+    def irange(self, lo: Entry = None, hi: Entry = None,
+               inclusive: Tuple[bool, bool] = (True, False),
+               reverse: bool = False) -> Union['np.ndarray', array]:
+        """Returns the entries between lo and hi, see AVLTree.irange, as a NumPy array, or an
+        array.array without NumPy."""
+        lo_inclusive, hi_inclusive = inclusive
+        start = 0 if lo is None else self._bisect(lo, right=not lo_inclusive)
+        stop = max(start, len(self) if hi is None else self._bisect(hi, right=hi_inclusive))
+
+        if np is None:
+            entries = array(self._type_code, islice(self._inorder_from(start), stop - start))
+            if reverse:
+                entries.reverse()
+            return entries
+        entries = self._traverse_array('inorder', start, stop)
+        return entries[::-1] if reverse else entries
+
+    def __repr__(self) -> str:
+        """T.__repr__(...) <==> repr(x).
+        Returns representation of the object that can be used to recreate the tree."""
+        return f"AVLTree({list(self._bfs())}, dtype={self.dtype!r})"
+
+
+class _Int64AVLTree(_TypedAVLTree):
+    """AVLTree of int64 entries, created with AVLTree(..., dtype='int64')."""
+
+    dtype = 'int64'
+    _type_code = 'q'
+
+
+class _Float64AVLTree(_TypedAVLTree):
+    """AVLTree of float64 entries, created with AVLTree(..., dtype='float64')."""
+
+    dtype = 'float64'
+    _type_code = 'd'
+
+
+_TYPED_TREES = {'int64': _Int64AVLTree, 'float64': _Float64AVLTree}
+
+
+class _CountedAVLNode(_AVLNode):
+    """Internal object, a tree node holding an entry along with its multiplicity."""
+
+    __slots__ = ('count',)
+
+    def __init__(self, entry: Entry = None, key: Any = None):
+        super().__init__(entry, key)
+        self.count: int = 1
+
+    def take_entry(self, node: '_CountedAVLNode') -> None:
+        """Moves the entry of node, along with its count, into this node."""
+        super().take_entry(node)
+        self.count = node.count
+
+    def _update_height(self) -> None:
+        """Updated the height and the subtree size, which counts every occurrence."""
+        self.height = 1 + max(self.left.height, self.right.height)
+        self.size = self.count + self.left.size + self.right.size
+
+    @classmethod
+    def build(cls, entries: List[Entry], keys: List[Any], start: int, stop: int,
+              counts: List[int] = None) -> Union['_CountedAVLNode', _EmptyAVLNode]:
+        """Builds a perfectly balanced subtree out of the sorted entries[start:stop] in O(n),
+        entries[i] occurring counts[i] times."""
+        if start >= stop:
+            return EMPTY_NODE
+
+        middle = (start + stop - 1) // 2
+        node = cls(entries[middle], keys[middle])
+        if counts is not None:
+            node.count = counts[middle]
+        node.left = cls.build(entries, keys, start, middle, counts)
+        node.right = cls.build(entries, keys, middle + 1, stop, counts)
+        node._update_height()
+
+        return node
+
+
+class _MultisetAVLCursor(_AVLCursor):
+    """Internal object, a position in an AVLTree counting duplicates, see _AVLCursor."""
+
+    __slots__ = ()
+
+    _count = staticmethod(attrgetter('count'))
+
+
+class _MultisetAVLTree(AVLTree):
+    """
+    AVLTree that counts duplicated entries instead of ignoring them.
+
+    A single node stands for all the occurrences of a key, its count telling how many there
+    are, and the subtree sizes add those counts up. Created with
+    AVLTree(..., duplicates='count').
+    """
+
+    _node_class = _CountedAVLNode
+    _cursor_class = _MultisetAVLCursor
+    _duplicates = 'count'
+
+    def _insert(self, entry: Entry) -> Tuple[_CountedAVLNode, bool]:
+        """Inserts entry, or counts one more occurrence if it is already there.
+
+        Returns the node holding entry and whether it has just been created."""
+        node, created = super()._insert(entry)
+        if not created:
+            self._change_count(node, 1)
+        return node, created
+
+    def delete(self, entry: Entry) -> None:
+        """T.remove(entry) remove one occurrence of item <entry> from tree."""
+        node = self._search(entry)
+        if node.count > 1:
+            self._change_count(node, -1)
+        else:
+            super().delete(entry)
+
+    def _change_count(self, node: _CountedAVLNode, change: int) -> None:
+        """Adds change to the count of node and to the sizes of the subtrees holding it."""
+        root = self.root
+        while root is not node:
+            root.size += change
+            root = root.left if node.key < root.key else root.right
+        node.count += change
+        node.size += change
+
+    def _rebalance(self, path: List[_AVLNode], size_change: int) -> None:
+        """Rebalances the nodes in path bottom-up, see AVLTree._rebalance.
+
+        When a node takes the entry of its predecessor, it also takes its count, so the size
+        change differs along the path. Every size is then computed again from the children.
+        """
+        while path:
+            node = path.pop()
+            node._update_height()
+            balanced = node._balance_tree_if_unbalanced()
+            if balanced is not node:
+                self._replace_child(path, node, balanced)
+
+    def count(self, entry: Entry) -> int:
+        """T.count(entry) -> number of times entry is in T."""
+        try:
+            return self._search(entry).count
+        except KeyError:
+            return 0
+
+    def _merges_batch(self, batch_size: int) -> bool:
+        """Batches are always applied one entry at a time, to count every occurrence."""
+        return False
+
+    @staticmethod
+    def _unique_sorted(entries: List[Entry],
+                       keys: List[Any]) -> Tuple[List[Entry], List[Any]]:
+        """Returns the entries and keys as they are, duplicates included, as _build counts
+        them. Raise ValueError if unsorted."""
+        for index in range(1, len(keys)):
+            if keys[index] < keys[index - 1]:
+                raise ValueError(f'Entries are not sorted: {entries[index]} comes after '
+                                 f'{entries[index - 1]}.')
+        return entries, keys
+
+    def _build(self, entries: List[Entry], keys: List[Any]) -> None:
+        """Replaces the content of the tree with the entries, sorted by their keys. Runs of
+        equal keys become a single node, keeping the first entry of the run."""
+        unique_entries, unique_keys, counts = [], [], []
+        for entry, key in zip(entries, keys):
+            if unique_keys and not unique_keys[-1] < key:
+                counts[-1] += 1
+            else:
+                unique_entries.append(entry)
+                unique_keys.append(key)
+                counts.append(1)
+        self.root = self._node_class.build(unique_entries, unique_keys, 0, len(unique_entries),
+                                           counts)
+
+    def _set_operation(self, operation: str, other: Iterable[Entry], workers: int) -> 'AVLTree':
+        """Set operations are not defined on multisets, raise TypeError."""
+        raise TypeError(f"{operation} is not supported with duplicates='count'")
+
+    def __repr__(self) -> str:
+        """T.__repr__(...) <==> repr(x).
+        Returns representation of the object that can be used to recreate the tree."""
+        return f"AVLTree({list(self._bfs())}, duplicates='count')"
+
+    # Traversals repeat each entry as many times as it occurs.
+
+    def _inorder(self, root) -> Generator[Entry, None, None]:
+        """Performs an in-order traversal. """
+        stack = []
+        push, pop = stack.append, stack.pop
+
+        while True:
+            while root is not EMPTY_NODE:
+                push(root)
+                root = root.left
+            if not stack:
+                return
+            root = pop()
+            yield from repeat(root.entry, root.count)
+            root = root.right
+
+    def _reversed(self, root) -> Generator[Entry, None, None]:
+        """Performs a reversed in-order traversal, from the greatest entry down."""
+        stack = []
+        push, pop = stack.append, stack.pop
+
+        while True:
+            while root is not EMPTY_NODE:
+                push(root)
+                root = root.right
+            if not stack:
+                return
+            root = pop()
+            yield from repeat(root.entry, root.count)
+            root = root.left
+
+    def _preorder(self, root) -> Generator[Entry, None, None]:
+        """Performs an pre-order traversal."""
+        stack = [root]
+        push, pop = stack.append, stack.pop
+
+        while stack:
+            root = pop()
+            if root is not EMPTY_NODE:
+                yield from repeat(root.entry, root.count)
+                push(root.right)
+                push(root.left)
+
+    def _postorder(self, root) -> Generator[Entry, None, None]:
+        """Performs an post-order traversal."""
+        stack = []
+        push, pop = stack.append, stack.pop
+        last = EMPTY_NODE
+
+        while True:
+            while root is not EMPTY_NODE:
+                push(root)
+                root = root.left
+            if not stack:
+                return
+            node = stack[-1]
+            if node.right is not EMPTY_NODE and node.right is not last:
+                root = node.right
+            else:
+                yield from repeat(node.entry, node.count)
+                last = pop()
+
+    def _bfs(self) -> Generator[Entry, None, None]:
+        """Performs an Breadth first traversal."""
+        q = deque([self.root])
+        append, popleft = q.append, q.popleft
+
+        while q:
+            root = popleft()
+            if root is not EMPTY_NODE:
+                yield from repeat(root.entry, root.count)
+                append(root.left)
+                append(root.right)
+
+    def _inorder_from(self, index: int) -> Generator[Entry, None, None]:
+        """Performs an in-order traversal starting at the index-th smallest entry."""
+        stack = []
+        root = self.root
+
+        while root is not EMPTY_NODE:
+            left_size = root.left.size
+            if index < left_size:
+                stack.append(root)
+                root = root.left
+            elif index < left_size + root.count:
+                yield from repeat(root.entry, left_size + root.count - index)
+                root = root.right
+                break
+            else:
+                index -= left_size + root.count
+                root = root.right
+
+        while True:
+            while root is not EMPTY_NODE:
+                stack.append(root)
+                root = root.left
+            if not stack:
+                return
+            root = stack.pop()
+            yield from repeat(root.entry, root.count)
+            root = root.right
+
+    def _irange(self, lo, hi, inclusive) -> Generator[Entry, None, None]:
+        """Performs an in-order traversal from key lo to key hi."""
+        lo_inclusive, hi_inclusive = inclusive
+        stack = []
+        root = self.root
+
+        while root:
+            if lo is None or (not root.key < lo if lo_inclusive else lo < root.key):
+                stack.append(root)
+                root = root.left
+            else:
+                root = root.right
+
+        while stack:
+            root = stack.pop()
+            if hi is not None and (hi < root.key if hi_inclusive else not root.key < hi):
+                return
+            yield from repeat(root.entry, root.count)
+            root = root.right
+            while root:
+                stack.append(root)
+                root = root.left
+
+    def _irange_reversed(self, lo, hi, inclusive) -> Generator[Entry, None, None]:
+        """Performs a reversed in-order traversal from key hi to key lo."""
+        lo_inclusive, hi_inclusive = inclusive
+        stack = []
+        root = self.root
+
+        while root:
+            if hi is None or (not hi < root.key if hi_inclusive else root.key < hi):
+                stack.append(root)
+                root = root.right
+            else:
+                root = root.left
+
+        while stack:
+            root = stack.pop()
+            if lo is not None and (root.key < lo if lo_inclusive else not lo < root.key):
+                return
+            yield from repeat(root.entry, root.count)
+            root = root.left
+            while root:
+                stack.append(root)
+                root = root.right
+
+
+class _InstrumentedAVLTree(AVLTree):
+    """
+    AVLTree that counts the work done by insert, delete and search.
+
+    insert, delete and search are the ones of AVLTree, run through _counted, which derives
+    their counts from the path of their descent once the operation is over. _rebalance tells
+    which rotation each unbalanced node gets from the same balance factors
+    _balance_tree_if_unbalanced looks at. The counts of a single operation are only gathered
+    in a dict when there is a hook to pass them to. Created with AVLTree(..., stats=True),
+    or stats=hook.
+    """
+
+    _rotations = ('rotations_left', 'rotations_right', 'rotations_left_right',
+                  'rotations_right_left')
+    _operations = {'search': 'searches', 'insert': 'inserts', 'delete': 'deletes'}
+    _counters = tuple(_operations.values()) + ('comparisons', 'path_length', 'max_path_length',
+                                               'nodes_allocated', 'nodes_freed') + _rotations
+
+    def __init__(self, args: Iterable[Any] = None, storage: str = 'node',
+                 key: Callable[[Entry], Any] = None, duplicates: str = 'ignore',
+                 stats: Union[bool, Callable[[str, Dict[str, int]], Any]] = False,
+                 dtype: str = None, monoid: Monoid = None):
+        """Initialize an AVL Tree that counts its operations. """
+        self._hook = stats if callable(stats) else None
+        self._totals = dict.fromkeys(self._counters, 0)
+        self._rotated = dict.fromkeys(self._rotations, 0)
+        super().__init__(args, key=key)
+
+    def _with_root(self, root: Union[_AVLNode, _EmptyAVLNode]) -> 'AVLTree':
+        """Returns a new tree like T, holding the subtree root."""
+        tree = self.__class__(key=self._key, stats=self._hook or True)
+        tree.root = root
+        return tree
+
+    def _from_items(self, entries: List[Entry], keys: List[Any]) -> 'AVLTree':
+        """Returns a new tree like T, holding the entries sorted by unique keys."""
+        tree = self.__class__(key=self._key, stats=self._hook or True)
+        tree._build(entries, keys)
+        return tree
+
+    def stats(self, reset: bool = False) -> Dict[str, int]:
+        """T.stats(reset=False) -> dict of the operation counts of T, see the stats argument.
+
+        When reset is True, the counts start over from zero afterwards.
+        """
+        totals = dict(self._totals)
+        if reset:
+            self._totals = dict.fromkeys(self._counters, 0)
+        return totals
+
+    def _record(self, operation: str, comparisons: int, path_length: int,
+                allocated: int = 0, freed: int = 0) -> None:
+        """Adds the counts of one operation to the totals and passes them to the hook."""
+        totals = self._totals
+        totals[self._operations[operation]] += 1
+        totals['comparisons'] += comparisons
+        totals['path_length'] += path_length
+        totals['nodes_allocated'] += allocated
+        totals['nodes_freed'] += freed
+        if path_length > totals['max_path_length']:
+            totals['max_path_length'] = path_length
+
+        if self._hook is not None:
+            counts = {'comparisons': comparisons, 'path_length': path_length,
+                      'nodes_allocated': allocated, 'nodes_freed': freed}
+            counts.update(self._rotated)
+            self._rotated = dict.fromkeys(self._rotations, 0)
+            self._hook(operation, counts)
+
+    def _descend(self, root: Union[_AVLNode, _EmptyAVLNode],
+                 key: Any) -> Tuple[List[_AVLNode], int, bool]:
+        """Runs the descent of AVLTree, keeping the length of its path and the index of the
+        node holding key, -1 if there is none, for _counted."""
+        path, depth, smaller = _descend(root, key)
+        self._descent = len(path), depth
+        return path, depth, smaller
+
+    def _find(self, root: Union[_AVLNode, _EmptyAVLNode], key: Any) -> Optional[_AVLNode]:
+        """Returns the node _find would, through the counted descent."""
+        path, depth, _ = self._descend(root, key)
+        return path[depth] if depth >= 0 else None
+
+    def _counted(self, operation: str, method: Callable[[Entry], Any], entry: Entry) -> Any:
+        """Runs method, the AVLTree version of operation, on entry and records the work done.
+
+        Each level of the descent costs one comparison, and the node holding the entry one
+        more to check equality. delete also goes down to the predecessor of the entry, the
+        last nodes of the path it rebalances."""
+        try:
+            result = method(entry)
+        except KeyError:
+            path_length, depth = self._descent
+            self._record(operation, path_length + (depth >= 0), path_length)
+            raise
+
+        path_length, depth = self._descent
+        comparisons = path_length + (depth >= 0)
+        if operation == 'insert':
+            self._record(operation, comparisons, path_length, allocated=int(result[1]))
+        elif operation == 'delete':
+            self._record(operation, comparisons, path_length + self._rebalanced - depth,
+                         freed=1)
+        else:
+            self._record(operation, comparisons, path_length)
+        return result
+
+    def _insert(self, entry: Entry) -> Tuple[_AVLNode, bool]:
+        """Inserts entry unless it is already there, counting the work done.
+
+        Returns the node holding entry and whether it has just been created."""
+        return self._counted('insert', super()._insert, entry)
+
+    def delete(self, entry: Entry) -> None:
+        """T.remove(entry) remove item <entry> from tree."""
+        self._counted('delete', super().delete, entry)
+
+    def _search(self, entry: Entry) -> _AVLNode:
+        """Returns node.k if T has a entry k, else raise KeyError"""
+        return self._counted('search', super()._search, entry)
+
+    def _rebalance(self, path: List[_AVLNode], size_change: int) -> None:
+        """Rebalances the nodes in path bottom-up, counting the rotations."""
+        self._rebalanced = len(path)
+        while path:
+            node = path.pop()
+            height = node.height
+            node._update_height()
+            balance = node.balance_factor
+            if balance == 2 or balance == -2:
+                if balance == 2:
+                    rotation = ('rotations_left_right' if node.left.balance_factor == -1
+                                else 'rotations_right')
+                else:
+                    rotation = ('rotations_right_left' if node.right.balance_factor == 1
+                                else 'rotations_left')
+                self._totals[rotation] += 1
+                if self._hook is not None:
+                    self._rotated[rotation] += 1
+            balanced = node._balance_tree_if_unbalanced()
+            if balanced is not node:
+                self._replace_child(path, node, balanced)
+
+            if balanced.height == height:
+                for ancestor in path:
+                    ancestor.size += size_change
+                return
+
+    def _build(self, entries: List[Entry], keys: List[Any]) -> None:
+        """Replaces the content of the tree with the entries, counting the nodes replaced."""
+        self._totals['nodes_freed'] += len(self)
+        self._totals['nodes_allocated'] += len(entries)
+        super()._build(entries, keys)
+
+    def _join_batch(self, operation: str, entries: List[Entry], keys: List[Any]) -> None:
+        """Applies the set operation like AVLTree, counting the nodes it adds or removes."""
+        size = len(self)
+        super()._join_batch(operation, entries, keys)
+        if len(self) > size:
+            self._totals['nodes_allocated'] += len(self) - size
+        else:
+            self._totals['nodes_freed'] += size - len(self)
+
+    def clear(self) -> None:
+        """T.clear() -> Removes all entries of T leaving it empty."""
+        self._totals['nodes_freed'] += len(self)
+        super().clear()
+
+
+class _AugmentedAVLNode(_AVLNode):
+    """Internal object, a tree node holding the aggregate of the entries of its subtree."""
+
+    __slots__ = ('monoid', 'total')
+
+    def __init__(self, entry: Entry, key: Any, monoid: Monoid):
+        super().__init__(entry, key)
+        self.monoid: Monoid = monoid
+        self.total: Any = entry if monoid.value is None else monoid.value(entry)
+
+    def take_entry(self, node: '_AugmentedAVLNode') -> None:
+        """Moves the entry of node, along with its monoid, into this node."""
+        super().take_entry(node)
+        self.monoid = node.monoid
+
+    def _update_height(self) -> None:
+        """Updated the height, the subtree size and the aggregate of the subtree, combining
+        the total of the left child, the value of the entry and the total of the right child,
+        in that order."""
+        left, right = self.left, self.right
+        self.height = 1 + max(left.height, right.height)
+        self.size = 1 + left.size + right.size
+
+        combine, _, value = self.monoid
+        total = self.entry if value is None else value(self.entry)
+        if left is not EMPTY_NODE:
+            total = combine(left.total, total)
+        if right is not EMPTY_NODE:
+            total = combine(total, right.total)
+        self.total = total
+
+    @classmethod
+    def build(cls, entries: List[Entry], keys: List[Any], start: int, stop: int,
+              monoid: Monoid = None) -> Union['_AugmentedAVLNode', _EmptyAVLNode]:
+        """Builds a perfectly balanced subtree out of the sorted entries[start:stop] in O(n),
+        aggregating their values with monoid."""
+        if start >= stop:
+            return EMPTY_NODE
+
+        middle = (start + stop - 1) // 2
+        node = cls(entries[middle], keys[middle], monoid)
+        node.left = cls.build(entries, keys, start, middle, monoid)
+        node.right = cls.build(entries, keys, middle + 1, stop, monoid)
+        node._update_height()
+
+        return node
+
+
+class _AugmentedAVLTree(AVLTree):
+    """
+    AVLTree whose nodes keep the aggregate of the values of the entries in their subtree.
+
+    The aggregates are computed in _AugmentedAVLNode._update_height, along with the heights
+    and sizes, so rotations and the set operations on nodes keep them as they are.
+    aggregate combines the totals of the subtrees that lie entirely within the range and the
+    values of O(log n) nodes on its borders. Created with AVLTree(..., monoid=...).
+    """
+
+    _node_class = _AugmentedAVLNode
+
+    def __init__(self, args: Iterable[Any] = None, storage: str = 'node',
+                 key: Callable[[Entry], Any] = None, duplicates: str = 'ignore',
+                 stats: Union[bool, Callable[[str, Dict[str, int]], Any]] = False,
+                 dtype: str = None, monoid: Monoid = None):
+        """Initialize an AVL Tree aggregating its entries with monoid. """
+        self._monoid = monoid
+        super().__init__(args, key=key)
+
+    def aggregate(self, lo: Entry = None, hi: Entry = None,
+                  inclusive: Tuple[bool, bool] = (True, False)) -> Any:
+        """T.aggregate(lo, hi) -> the values of the entries between lo and hi, combined by
+        the monoid of T, in order. The identity of the monoid when there is none.
+
+        Runs in O(log n) without visiting the entries. See irange for the meaning of the arguments.
+        """
+        if self._key is not None:
+            lo = lo if lo is None else self._key(lo)
+            hi = hi if hi is None else self._key(hi)
+        lo_inclusive, hi_inclusive = inclusive
+        combine, identity, value = self._monoid
+
+        # Walks down to the first node within the range, every other one is below it.
+        root = self.root
+        while root is not EMPTY_NODE:
+            if lo is not None and (root.key < lo if lo_inclusive else not lo < root.key):
+                root = root.right
+            elif hi is not None and (hi < root.key if hi_inclusive else not root.key < hi):
+                root = root.left
+            else:
+                break
+
+        if root is EMPTY_NODE:
+            return identity
+        total = root.entry if value is None else value(root.entry)
+
+        # Within its left subtree, a node above lo comes with its whole right subtree.
+        node = root.left
+        while node is not EMPTY_NODE:
+            if lo is not None and (node.key < lo if lo_inclusive else not lo < node.key):
+                node = node.right
+                continue
+            part = node.entry if value is None else value(node.entry)
+            if node.right is not EMPTY_NODE:
+                part = combine(part, node.right.total)
+            total = combine(part, total)
+            node = node.left
+
+        # Likewise within its right subtree, a node below hi comes with its left subtree.
+        node = root.right
+        while node is not EMPTY_NODE:
+            if hi is not None and (hi < node.key if hi_inclusive else not node.key < hi):
+                node = node.left
+                continue
+            part = node.entry if value is None else value(node.entry)
+            if node.left is not EMPTY_NODE:
+                part = combine(node.left.total, part)
+            total = combine(total, part)
+            node = node.right
+
+        return total
+
+    def _new_node(self, entry: Entry, key: Any) -> _AugmentedAVLNode:
+        """Returns a new node holding entry, aggregated with the monoid of T."""
+        return self._node_class(entry, key, self._monoid)
+
+    def _build(self, entries: List[Entry], keys: List[Any]) -> None:
+        """Replaces the content of the tree with the entries, sorted by their unique keys."""
+        self.root = self._node_class.build(entries, keys, 0, len(entries), self._monoid)
+
+    def _rebalance(self, path: List[_AVLNode], size_change: int) -> None:
+        """Rebalances the nodes in path bottom-up, see AVLTree._rebalance.
+
+        The aggregate of every node on the path changes, not only its size, so once a subtree
+        keeps its height the ones above it still get their aggregates computed again, without
+        checking their balance.
+        """
+        while path:
+            node = path.pop()
+            height = node.height
+            node._update_height()
+            balanced = node._balance_tree_if_unbalanced()
+            if balanced is not node:
+                self._replace_child(path, node, balanced)
+
+            if balanced.height == height:
+                for ancestor in reversed(path):
+                    ancestor._update_height()
+                return
+
+    def _check_joinable(self, other: 'AVLTree') -> None:
+        """Raise ValueError unless every entry of T is smaller than every entry of other and
+        both trees share the same monoid."""
+        super()._check_joinable(other)
+        if self._monoid != other._monoid:
+            raise ValueError('Cannot join trees with different monoids.')
+
+    def _with_root(self, root: Union[_AVLNode, _EmptyAVLNode]) -> 'AVLTree':
+        """Returns a new tree like T, holding the subtree root."""
+        tree = self.__class__(key=self._key, monoid=self._monoid)
+        tree.root = root
+        return tree
+
+    def _set_operation(self, operation: str, other: Iterable[Entry], workers: int) -> 'AVLTree':
+        """Returns a new tree with the result of the set operation between T and other."""
+        if (type(other) is not type(self) or other._key is not self._key
+                or other._monoid != self._monoid):
+            other = self.__class__(other, key=self._key, monoid=self._monoid)
+        return super()._set_operation(operation, other, workers)
+
+    def _from_items(self, entries: List[Entry], keys: List[Any]) -> 'AVLTree':
+        """Returns a new tree like T, holding the entries sorted by unique keys."""
+        tree = self.__class__(key=self._key, monoid=self._monoid)
+        tree._build(entries, keys)
+        return tree
+
+    def __repr__(self) -> str:
+        """T.__repr__(...) <==> repr(x).
+        Returns representation of the object that can be used to recreate the tree."""
+        return f'AVLTree({list(self._bfs())}, monoid={self._monoid!r})'
+
+
+class PersistentAVLTree(AVLTree):
+    """
+    AVLTree whose nodes are never modified once they are linked into a tree.
+
+    insert and delete copy the O(log n) nodes on the path from the root to the change and
+    leave every other node shared with the previous version of the tree. Taking a snapshot
+    is then just a matter of keeping the current root, so it takes O(1) and the snapshot
+    stays the same whatever happens to the tree afterwards.
+
+    PersistentAVLTree() -> new empty tree.
+    PersistentAVLTree(seq, key=None) -> new tree initialized from seq, like AVLTree.
+
+    Only the node storage is supported.
+    """
+
+    def __new__(cls, args: Iterable[Any] = None, storage: str = 'node',
+                key: Callable[[Entry], Any] = None):
+        """Creates a persistent tree, raise ValueError for any storage but 'node'."""
+        if storage != 'node':
+            raise ValueError(f"{cls.__name__} only supports storage='node', not {storage!r}")
+        return super().__new__(cls)
+
+    def snapshot(self) -> 'PersistentAVLTree':
+        """T.snapshot() -> new tree holding the current entries of T, in O(1).
+
+        The snapshot and T share their nodes, and later changes to either one of them are
+        not seen by the other."""
+        return self._with_root(self.root)
+
+    def insert(self, entry: Entry) -> None:
+        """T.insert(entry) -- insert elem, copying the nodes on its path."""
+        key = _key_of(self._key, entry)
+        path = []
+        root = self.root
+        candidate = None
+
+        while root:
+            path.append(root)
+            if key < root.key:
+                root = root.left
+            else:
+                candidate = root
+                root = root.right
+
+        if candidate is not None and not candidate.key < key:
+            return
+
+        self.root = self._copy_path(path, key, self._new_node(entry, key))
+
+    def delete(self, entry: Entry) -> None:
+        """T.remove(entry) remove item <entry> from tree, copying the nodes on its path."""
+        key = _key_of(self._key, entry)
+        path = []
+        root = self.root
+        depth = -1
+
+        while root:
+            path.append(root)
+            if key < root.key:
+                root = root.left
+            else:
+                depth = len(path) - 1
+                root = root.right
+
+        if depth < 0 or path[depth].key < key:
+            raise KeyError(entry)
+
+        removed = path[depth]
+        del path[depth:]
+
+        if removed.left:
+            # The predecessor takes the place of the removed node.
+            rest, last = removed.left.split_last()
+            subtree = last.balanced_with_children(rest, removed.right)
+        else:
+            subtree = removed.right
+
+        self.root = self._copy_path(path, key, subtree)
+
+    @staticmethod
+    def _copy_path(path: List[_AVLNode], key: Any,
+                   subtree: Union[_AVLNode, _EmptyAVLNode]) -> Union[_AVLNode, _EmptyAVLNode]:
+        """Returns a new root where subtree replaces the child, on the side of key, of the last
+        node of path. The nodes of path are copied and rebalanced bottom up."""
+        for parent in reversed(path):
+            if key < parent.key:
+                subtree = parent.balanced_with_children(subtree, parent.right)
+            else:
+                subtree = parent.balanced_with_children(parent.left, subtree)
+        return subtree
+
+    def clear(self) -> None:
+        """T.clear() -> Removes all entries of T leaving it empty, snapshots keep theirs."""
+        self.root = EMPTY_NODE
+
+    def _combine(self, operation: str, other: 'AVLTree') -> 'AVLTree':
+        """Returns a new tree with the result of the set operation between T and other.
+
+        The result shares its nodes with T and other, which is safe as none of them is ever
+        modified."""
+        return self._with_root(getattr(self.root, operation)(other.root))
+
+
+class ConcurrentAVLTree:
+    """
+    Thread-safe sorted container for many reader threads and concurrent writers.
+
+    The entries live in a PersistentAVLTree. Every write applies the change to a snapshot of
+    the current version, under a lock that only writers take, then publishes the new version
+    by rebinding a single attribute. Readers never take the lock: each read works on the
+    version that was published when it started, which is never modified afterwards. A
+    reader can hold on to a version for as long as it likes, for example to traverse it,
+    while writers keep going.
+
+    ConcurrentAVLTree() -> new empty tree.
+    ConcurrentAVLTree(seq, key=None) -> new tree initialized from seq, like AVLTree.
+    """
+
+    def __init__(self, args: Iterable[Any] = None, key: Callable[[Entry], Any] = None):
+        """Initialize a thread-safe AVL Tree. """
+        self._lock = Lock()
+        self._version = PersistentAVLTree(args, key=key)
+
+    def snapshot(self) -> PersistentAVLTree:
+        """T.snapshot() -> tree holding the entries of T at this very moment, in O(1).
+
+        The snapshot is not affected by later writes to T, and changing it does not affect T.
+        """
+        return self._version.snapshot()
+
+    def _write(self, operation: str, *args: Any) -> None:
+        """Applies operation to a new version of the tree and publishes it.
+
+        If the operation raises, the current version is left untouched."""
+        with self._lock:
+            version = self._version.snapshot()
+            getattr(version, operation)(*args)
+            self._version = version
+
+    def insert(self, entry: Entry) -> None:
+        """T.insert(entry) -- insert elem"""
+        self._write('insert', entry)
+
+    def delete(self, entry: Entry) -> None:
+        """T.remove(entry) remove item <entry> from tree."""
+        self._write('delete', entry)
+
+    def insert_many(self, entries: Iterable[Entry]) -> None:
+        """T.insert_many(seq) -- insert every entry of seq, readers see all of them at once."""
+        self._write('insert_many', entries)
+
+    def delete_many(self, entries: Iterable[Entry]) -> None:
+        """T.delete_many(seq) -- remove every entry of seq that is in T, ignore the others.
+
+        Readers see all of them removed at once."""
+        self._write('delete_many', entries)
+
+    def clear(self) -> None:
+        """T.clear() -> Removes all entries of T leaving it empty."""
+        self._write('clear')
+
+    def search(self, entry: Entry) -> Entry:
+        """Returns k if T has a entry k, else raise KeyError"""
+        return self._version.search(entry)
+
+    def __iter__(self) -> Generator[Entry, None, None]:
+        """T.__iter__() <==> iter(T). Iterates over the version of T current when called."""
+        return iter(self._version)
+
+    def __reversed__(self) -> Generator[Entry, None, None]:
+        """T.__reversed__() <==> reversed(T). Iterates over the version of T current when called.
+        """
+        return reversed(self._version)
+
+    def __contains__(self, entry: Entry) -> bool:
+        """k in T -> True if T has a entry k, else False"""
+        return entry in self._version
+
+    def contains_many(self, entries: Iterable[Entry]) -> Union[List[bool], 'np.ndarray']:
+        """T.contains_many(seq) -> list telling, for each entry of seq, if it is in T."""
+        return self._version.contains_many(entries)
+
+    def traverse(self, order='inorder') -> Generator[Entry, None, None]:
+        """Traverse the tree based on a given strategy, see AVLTree.traverse.
+
+        The traversal sees the entries of T when it was called, even if it is consumed later.
+        """
+        return self._version.traverse(order)
+
+    def irange(self, lo: Entry = None, hi: Entry = None,
+               inclusive: Tuple[bool, bool] = (True, False),
+               reverse: bool = False) -> Generator[Entry, None, None]:
+        """T.irange(lo, hi) -> iterates lazily over the entries between lo and hi.
+
+        See AVLTree.irange. Like traverse, the iteration works on the version of T current
+        when it was called."""
+        return self._version.irange(lo, hi, inclusive, reverse)
+
+    def count_range(self, lo: Entry = None, hi: Entry = None,
+                    inclusive: Tuple[bool, bool] = (True, False)) -> int:
+        """T.count_range(lo, hi) -> number of entries between lo and hi."""
+        return self._version.count_range(lo, hi, inclusive)
+
+    def rank(self, entry: Entry) -> int:
+        """T.rank(entry) -> number of entries in T smaller than entry."""
+        return self._version.rank(entry)
+
+    def select(self, index: int) -> Entry:
+        """T.select(index) -> the entry at position index of the in-order traversal."""
+        return self._version.select(index)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Entry, List[Entry]]:
+        """T[i] -> the i-th smallest entry, T[i:j] -> list of entries from position i to j."""
+        return self._version[index]
+
+    def pred(self, entry: Entry) -> Entry:
+        """T.pred(entry) -> the entry right before entry, raise KeyError if there is none."""
+        return self._version.pred(entry)
+
+    def succ(self, entry: Entry) -> Entry:
+        """T.succ(entry) -> the entry right after entry, raise KeyError if there is none."""
+        return self._version.succ(entry)
+
+    def floor(self, entry: Entry, default: Any = None) -> Entry:
+        """T.floor(entry) -> the greatest entry not greater than entry, or default if none."""
+        return self._version.floor(entry, default)
+
+    def ceiling(self, entry: Entry, default: Any = None) -> Entry:
+        """T.ceiling(entry) -> the smallest entry not smaller than entry, or default if none."""
+        return self._version.ceiling(entry, default)
+
+    def lower(self, entry: Entry, default: Any = None) -> Entry:
+        """T.lower(entry) -> the greatest entry smaller than entry, or default if none."""
+        return self._version.lower(entry, default)
+
+    def higher(self, entry: Entry, default: Any = None) -> Entry:
+        """T.higher(entry) -> the smallest entry greater than entry, or default if none."""
+        return self._version.higher(entry, default)
+
+    def nearest(self, entry: Entry, default: Any = None) -> Entry:
+        """T.nearest(entry) -> the entry closest to entry, or default if T is empty."""
+        return self._version.nearest(entry, default)
+
+    def max(self) -> Entry:
+        """T.max() -> get the maximum entry of T."""
+        return self._version.max()
+
+    def min(self) -> Entry:
+        """T.min() -> get the minimum entry of T."""
+        return self._version.min()
+
+    @property
+    def height(self) -> int:
+        """Returns the height of the tree. When the tree is empty its height is zero."""
+        return self._version.height
+
+    def __len__(self) -> int:
+        """T.__len__() <==> len(x). Retuns the number of elements in the tree."""
+        return len(self._version)
+
+    def __bool__(self) -> bool:
+        """Returns True if the tree is not empty"""
+        return bool(self._version)
+
+    def __repr__(self) -> str:
+        """T.__repr__(...) <==> repr(x)."""
+        return f'{self.__class__.__name__}({list(self._version._bfs())})'
+
+
+class FrozenAVLTree:
+    """
+    Read-only sorted container served straight from a file written by AVLTree.dump.
+
+    The file is memory-mapped and the entries are looked up by binary search in place, so
+    opening it takes O(1) whatever its size: nothing is deserialized and no node is built.
+    Processes opening the same file share its pages through the page cache. int and float
+    entries, and the offsets of bytes and str entries, are read off the mapping without any
+    copy; bytes and str entries are copied and decoded each time they are accessed.
+
+    FrozenAVLTree.open(path) -> tree over the first tree dumped to the file at path.
+    FrozenAVLTree.open(path, offset) -> tree over the tree dumped at offset in the file.
+
+    key : a function of one argument, default None
+        Must be the key function of the dumped tree, see AVLTree. Opening a tree dumped with
+        a key function without one, or the other way around, raises ValueError.
+
+    The tree keeps the file open until close() is called, or until the end of a with block.
+    """
+
+    def __init__(self, path: str, offset: int = 0, key: Callable[[Entry], Any] = None):
+        """Opens the tree dumped at offset in the file at path, use FrozenAVLTree.open."""
+        self._path = path
+        self._key = key
+        with open(path, 'rb') as fp:
+            self._mmap = mmap(fp.fileno(), 0, access=ACCESS_READ)
+        self._views = [memoryview(self._mmap)]
+
+        try:
+            self._entries = self._map_entries(self._views[0], offset)
+        except Exception:
+            self.close()
+            raise
+        self._keys = self._entries if key is None else _LazyList(
+            lambda index: key(self._entries[index]), len(self._entries))
+
+    @classmethod
+    def open(cls, path: str, offset: int = 0,
+             key: Callable[[Entry], Any] = None) -> 'FrozenAVLTree':
+        """FrozenAVLTree.open(path, offset=0) -> tree over the entries dumped at offset in the
+        file at path. Raise ValueError if there is no dumped tree there."""
+        return cls(path, offset, key)
+
+    def _map_entries(self, view: memoryview, offset: int) -> Sequence:
+        """Returns a sequence over the entries dumped at offset in view."""
+        type_code, flags, count, offset = _read_header(view, offset)
+        if bool(flags & _DUMP_KEYED) != (self._key is not None):
+            raise ValueError(f'Cannot open a tree dumped {_describe_dump_flags(flags)} '
+                             f"{'without' if self._key is None else 'with'} a key function.")
+
+        if type_code in 'qd':
+            data = view[offset:offset + 8 * count]
+            if byteorder == 'big':  # pragma: no cover
+                return _read_numbers(data, type_code)
+            self._views.append(data)
+            self._views.append(data.cast(type_code))
+            return self._views[-1]
+
+        offsets = view[offset:offset + 8 * (count + 1)]
+        if byteorder == 'big':  # pragma: no cover
+            offsets = _read_numbers(offsets, 'Q')
+        else:
+            self._views.append(offsets)
+            self._views.append(offsets.cast('Q'))
+            offsets = self._views[-1]
+        offset += 8 * (count + 1)
+        blob = view[offset:offset + offsets[-1]]
+        self._views.append(blob)
+        if type_code == 'b':
+            return _LazyList(lambda index: blob[offsets[index]:offsets[index + 1]].tobytes(),
+                             count)
+        return _LazyList(lambda index: str(blob[offsets[index]:offsets[index + 1]], 'utf-8'),
+                         count)
+
+    def close(self) -> None:
+        """T.close() -- releases the memory mapping, T cannot be used afterwards."""
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self) -> 'FrozenAVLTree':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _bisect(self, entry: Entry, right: bool = False) -> int:
+        """Returns the number of entries smaller than entry, or not greater than it if right."""
+        key = _key_of(self._key, entry)
+        return (bisect_right if right else bisect_left)(self._keys, key)
+
+    def _index(self, entry: Entry) -> int:
+        """Returns the position of entry, raise KeyError if it is not in T."""
+        index = self._bisect(entry)
+        key = _key_of(self._key, entry)
+        if index == len(self._keys) or key < self._keys[index]:
+            raise KeyError(f'Entry {entry} not found.')
+        return index
+
+    def search(self, entry: Entry) -> Entry:
+        """Returns k if T has a entry k, else raise KeyError"""
+        return self._entries[self._index(entry)]
+
+    def __contains__(self, entry: Entry) -> bool:
+        """k in T -> True if T has a entry k, else False"""
+        try:
+            self._index(entry)
+        except KeyError:
+            return False
+        return True
+
+    def pred(self, entry: Entry) -> Entry:
+        """T.pred(entry) -> the entry right before entry, raise KeyError if there is none."""
+        try:
+            index = self._index(entry)
+        except KeyError:
+            index = 0
+        if not index:
+            raise KeyError(f'Predecessor of {entry} not found.')
+        return self._entries[index - 1]
+
+    def succ(self, entry: Entry) -> Entry:
+        """T.succ(entry) -> the entry right after entry, raise KeyError if there is none."""
+        try:
+            index = self._index(entry) + 1
+        except KeyError:
+            index = len(self)
+        if index == len(self):
+            raise KeyError(f'Successor of {entry} not found.')
+        return self._entries[index]
+
+    def floor(self, entry: Entry, default: Any = None) -> Entry:
+        """T.floor(entry) -> the greatest entry not greater than entry, or default if none."""
+        index = self._bisect(entry, right=True)
+        return self._entries[index - 1] if index else default
+
+    def ceiling(self, entry: Entry, default: Any = None) -> Entry:
+        """T.ceiling(entry) -> the smallest entry not smaller than entry, or default if none."""
+        index = self._bisect(entry)
+        return self._entries[index] if index < len(self) else default
+
+    def lower(self, entry: Entry, default: Any = None) -> Entry:
+        """T.lower(entry) -> the greatest entry smaller than entry, or default if none."""
+        index = self._bisect(entry)
+        return self._entries[index - 1] if index else default
+
+    def higher(self, entry: Entry, default: Any = None) -> Entry:
+        """T.higher(entry) -> the smallest entry greater than entry, or default if none."""
+        index = self._bisect(entry, right=True)
+        return self._entries[index] if index < len(self) else default
+
+    def rank(self, entry: Entry) -> int:
+        """T.rank(entry) -> number of entries in T smaller than entry."""
+        return self._bisect(entry)
+
+    def count_range(self, lo: Entry = None, hi: Entry = None,
+                    inclusive: Tuple[bool, bool] = (True, False)) -> int:
+        """T.count_range(lo, hi) -> number of entries between lo and hi, see AVLTree.irange."""
+        start, stop = self._range(lo, hi, inclusive)
+        return max(0, stop - start)
+
+    def irange(self, lo: Entry = None, hi: Entry = None,
+               inclusive: Tuple[bool, bool] = (True, False),
+               reverse: bool = False) -> Generator[Entry, None, None]:
+        """T.irange(lo, hi) -> iterates lazily over the entries between lo and hi.
+
+        See AVLTree.irange for the meaning of the arguments."""
+        start, stop = self._range(lo, hi, inclusive)
+        indexes = range(start, stop)
+        return map(self._entries.__getitem__, reversed(indexes) if reverse else indexes)
+
+    def _range(self, lo: Entry, hi: Entry, inclusive: Tuple[bool, bool]) -> Tuple[int, int]:
+        """Returns the positions of the first entry in the range and of the first one after."""
+        lo_inclusive, hi_inclusive = inclusive
+        start = 0 if lo is None else self._bisect(lo, right=not lo_inclusive)
+        stop = len(self) if hi is None else self._bisect(hi, right=hi_inclusive)
+        return start, stop
+
+    def select(self, index: int) -> Entry:
+        """T.select(index) -> the entry at position index of the in-order traversal.
+
+        Negative indexes count from the end. Raises IndexError if index is out of range."""
+        return self._entries[index]
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Entry, List[Entry]]:
+        """T[i] -> the i-th smallest entry, T[i:j] -> list of entries from position i to j."""
+        if isinstance(index, slice):
+            return [self._entries[i] for i in range(*index.indices(len(self)))]
+        return self._entries[index]
+
+    def traverse(self) -> Generator[Entry, None, None]:
+        """Iterates over the entries in order."""
+        return iter(self)
+
+    def __iter__(self) -> Generator[Entry, None, None]:
+        """T.__iter__() <==> iter(T). Iterates over the entries in increasing order."""
+        return map(self._entries.__getitem__, range(len(self)))
+
+    def __reversed__(self) -> Generator[Entry, None, None]:
+        """T.__reversed__() <==> reversed(T). Iterates over the entries in decreasing order."""
+        return map(self._entries.__getitem__, reversed(range(len(self))))
+
+    def max(self) -> Entry:
+        """T.max() -> get the maximum entry of T."""
+        return self._entries[-1]
+
+    def min(self) -> Entry:
+        """T.min() -> get the minimum entry of T."""
+        return self._entries[0]
+
+    def __len__(self) -> int:
+        """T.__len__() <==> len(x). Retuns the number of elements in the tree."""
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        """Returns True if the tree is not empty"""
+        return len(self._entries) > 0
+
+    def __repr__(self) -> str:
+        """T.__repr__(...) <==> repr(x)."""
+        return f'{self.__class__.__name__}.open({self._path!r})'
+
+
+class _LazyList(Sequence):
+    """Internal object, a read-only sequence whose items are computed when accessed."""
+
+    def __init__(self, item: Callable[[int], Any], length: int):
+        self._item = item
+        self._length = length
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('index out of range')
+        return self._item(index)
+
+    def __len__(self) -> int:
+        return self._length
+
+
+class FrozenAVLIndex:
+    """
+    Immutable search index over the sorted entries of a tree, created by AVLTree.freeze.
+
+    The keys are kept in a flat array instead of linked nodes: an array.array when the keys
+    are all int or all float, a list for any other keys. When NumPy is installed, batches of
+    numbers are searched through NumPy views of those arrays.
+
+    layout : 'eytzinger' | 'sorted'
+        'sorted' keeps the keys in increasing order and looks them up by binary search.
+        'eytzinger' stores them in the breadth-first order of a complete binary search tree:
+        the children of slot k are slots 2k and 2k + 1. A search walks down from slot 1 by
+        computing the next slot from the last comparison, without any branch on it, and the
+        first levels, which every search goes through, share the first cache lines. The
+        position of the result is read from a second array.
+
+    search_sorted takes a whole batch of entries at once, which NumPy runs level by level
+    over the batch for the Eytzinger layout.
+    """
+
+    def __init__(self, entries: List[Entry], keys: List[Any],
+                 key: Callable[[Entry], Any] = None, layout: str = 'eytzinger'):
+        """Builds the index over the entries sorted by keys, use AVLTree.freeze."""
+        if layout not in ('eytzinger', 'sorted'):
+            raise ValueError(f"layout must be 'eytzinger' or 'sorted', not {layout!r}")
+        self.layout = layout
+        self._key = key
+        self._entries = list(entries)
+        self._type_code = self._array_type(keys)
+
+        if layout == 'sorted':
+            self._keys = self._array(keys)
+            return
+
+        # Slot 0 is unused, and tells a search that every key is smaller than the one sought.
+        order = self._eytzinger_order(len(keys))
+        self._keys = self._array([keys[0] if keys else 0] + [keys[index] for index in order])
+        self._positions = self._array([len(keys)] + order, 'q')
+
+    @staticmethod
+    def _array_type(keys: List[Any]) -> Optional[str]:
+        """Returns the array type code matching the keys, None if they are not numbers."""
+        types = set(map(type, keys))
+        if types <= {int}:
+            return 'q'
+        if types == {float}:
+            return 'd'
+        return None
+
+    def _array(self, values: List[Any], type_code: str = None) -> Union[List[Any], array]:
+        """Returns the values in a flat array of the given or the key type, if any."""
+        type_code = type_code or self._type_code
+        if type_code is None:
+            return values
+        try:
+            return array(type_code, values)
+        except OverflowError:
+            # Integers beyond 64 bits stay Python integers.
+            self._type_code = None
+            return values
+
+    @staticmethod
+    def _eytzinger_order(length: int) -> List[int]:
+        """Returns, for each slot from 1 to length, the sorted position of the key it holds.
+
+        The slots are visited in order, that is in an in-order traversal of the implicit
+        tree."""
+        order = [0] * length
+        stack = []
+        slot = 1
+        position = 0
+
+        while True:
+            while slot <= length:
+                stack.append(slot)
+                slot *= 2
+            if not stack:
+                return order
+            slot = stack.pop()
+            order[slot - 1] = position
+            position += 1
+            slot = 2 * slot + 1
+
+    def _position(self, key: Any, right: bool = False) -> int:
+        """Returns the number of keys smaller than key, or not greater than it if right."""
+        keys = self._keys
+        if self.layout == 'sorted':
+            return (bisect_right if right else bisect_left)(keys, key)
+
+        length = len(self._entries)
+        slot = 1
+        if right:
+            while slot <= length:
+                slot = 2 * slot + (not key < keys[slot])
+        else:
+            while slot <= length:
+                slot = 2 * slot + (keys[slot] < key)
+        # Going back up past the right turns, then one left turn, leads to the answer.
+        slot >>= (~slot & (slot + 1)).bit_length()
+        return self._positions[slot]
+
+    def search(self, entry: Entry) -> Entry:
+        """Returns k if T has a entry k, else raise KeyError"""
+        key = _key_of(self._key, entry)
+        position = self._position(key)
+        if position == len(self._entries) or key < self._key_at(position):
+            raise KeyError(f'Entry {entry} not found.')
+        return self._entries[position]
+
+    def _key_at(self, position: int) -> Any:
+        """Returns the key of the entry at position."""
+        entry = self._entries[position]
+        return _key_of(self._key, entry)
+
+    def __contains__(self, entry: Entry) -> bool:
+        """k in T -> True if T has a entry k, else False"""
+        try:
+            self.search(entry)
+        except KeyError:
+            return False
+        return True
+
+    def rank(self, entry: Entry) -> int:
+        """T.rank(entry) -> number of entries in T smaller than entry."""
+        return self._position(_key_of(self._key, entry))
+
+    def search_sorted(self, entries: Iterable[Entry],
+                      side: str = 'left') -> Union[List[int], 'np.ndarray']:
+        """T.search_sorted(seq, side='left') -> positions where the entries of seq would be
+        inserted to keep T sorted, like numpy.searchsorted.
+
+        side : 'left' | 'right', default 'left'
+            With 'left', the position of an entry equal to one in T is the position of that
+            entry. With 'right', it is the position after it.
+
+        When NumPy is installed and the keys are numbers, the whole batch is searched at
+        once and the result is a NumPy array. It is a list otherwise.
+        """
+        if side not in ('left', 'right'):
+            raise ValueError(f"side must be 'left' or 'right', not {side!r}")
+        batch = list(entries) if self._key is None else list(map(self._key, entries))
+
+        if np is None or self._type_code is None:
+            return [self._position(key, side == 'right') for key in batch]
+
+        tree_keys = np.frombuffer(self._keys,
+                                  dtype=np.int64 if self._type_code == 'q' else np.float64)
+        keys = np.asarray(batch)
+        # Both sides in a common type, not to truncate float entries against int keys.
+        dtype = np.result_type(tree_keys, keys)
+        tree_keys, keys = tree_keys.astype(dtype, copy=False), keys.astype(dtype, copy=False)
+        if self.layout == 'sorted':
+            return np.searchsorted(tree_keys, keys, side)
+
+        # Every search goes down one level per round. The ones that already reached the
+        # bottom, in a shallower branch, keep their slot.
+        length = len(self._entries)
+        slots = np.ones(len(keys), dtype=np.int64)
+        for _ in range(length.bit_length()):
+            candidates = tree_keys[np.minimum(slots, length)]
+            turns = candidates <= keys if side == 'right' else candidates < keys
+            slots = np.where(slots <= length, 2 * slots + turns, slots)
+        lowest_zeros = ~slots & (slots + 1)
+        slots >>= np.frexp(lowest_zeros.astype(np.float64))[1].astype(np.int64)
+        return np.frombuffer(self._positions, dtype=np.int64)[slots]
+
+    def __len__(self) -> int:
+        """T.__len__() <==> len(x). Retuns the number of elements in the index."""
+        return len(self._entries)
+
+    def __iter__(self) -> Generator[Entry, None, None]:
+        """T.__iter__() <==> iter(T). Iterates over the entries in increasing order."""
+        return iter(self._entries)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Entry, List[Entry]]:
+        """T[i] -> the i-th smallest entry, T[i:j] -> list of entries from position i to j."""
+        return self._entries[index]
+
+    def __repr__(self) -> str:
+        """T.__repr__(...) <==> repr(x)."""
+        return f'{self.__class__.__name__}({self._entries}, layout={self.layout!r})'
+
+
+def _parallel_set_operation(operation: str, items: Tuple[List[Entry], List[Any]],
+                            other_items: Tuple[List[Entry], List[Any]],
+                            workers: int) -> Tuple[List[Entry], List[Any]]:
+    """Runs a set operation between two lists of entries sorted by unique keys on a process pool.
+
+    Both lists are cut at the same pivot keys, taken evenly from the longest one. The entries
+    of a range can only meet the entries of the same range of the other list, so each range is
+    an independent subproblem, which a worker solves with a linear merge of its two lists.
+    Sending subtrees to the workers and joining them back would pickle them anyway, so this
+    path does not use split and join."""
+    entries, keys = items
+    other_entries, other_keys = other_items
+    longest = keys if len(keys) >= len(other_keys) else other_keys
+    pivots = [longest[len(longest) * i // workers] for i in range(1, workers)]
+    bounds = [0] + [bisect_left(keys, pivot) for pivot in pivots] + [len(keys)]
+    other_bounds = [0] + [bisect_left(other_keys, pivot) for pivot in pivots] + [len(other_keys)]
+
+    def chunk(entries, keys, start, stop):
+        keys_chunk = keys[start:stop]
+        return keys_chunk if entries is keys else entries[start:stop], keys_chunk
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_sorted_set_operation, operation,
+                                   *chunk(entries, keys, start, stop),
+                                   *chunk(other_entries, other_keys, other_start, other_stop))
+                   for start, stop, other_start, other_stop
+                   in zip(bounds, bounds[1:], other_bounds, other_bounds[1:])]
+
+        result_entries, result_keys = [], []
+        for future in futures:
+            chunk_entries, chunk_keys = future.result()
+            result_entries.extend(chunk_entries)
+            if chunk_keys is not None:
+                result_keys.extend(chunk_keys)
+
+    if entries is keys:
+        return result_entries, result_entries
+    return result_entries, result_keys
+
+
+def _sorted_set_operation(operation: str, entries: List[Entry], keys: List[Any],
+                          other_entries: List[Entry],
+                          other_keys: List[Any]) -> Tuple[List[Entry], Optional[List[Any]]]:
+    """Runs a set operation between two lists of entries sorted by unique keys, in a worker.
+
+    When the entries are their own keys, None is sent back instead of a second copy of them."""
+    result_entries, result_keys = getattr(AVLTree, f'_{operation}_sorted')(
+        entries, keys, other_entries, other_keys)
+    return result_entries, None if entries is keys else result_keys
+
+
+def _dump_entries(fp, entries: List[Entry], flags: int) -> None:
+    """Writes the sorted entries and flags to fp in the format described at _DUMP_HEADER."""
+    types = set(map(type, entries))
+    if types <= {int}:
+        try:
+            type_code, data = b'q', [_native_array('q', entries)]
+        except OverflowError:
+            raise TypeError('Cannot dump int entries that do not fit in 64 bits.') from None
+    elif types == {float}:
+        type_code, data = b'd', [_native_array('d', entries)]
+    elif types == {bytes} or types == {str}:
+        type_code = b'b' if bytes in types else b's'
+        if type_code == b's':
+            entries = [entry.encode('utf-8') for entry in entries]
+        offsets = [0]
+        for entry in entries:
+            offsets.append(offsets[-1] + len(entry))
+        data = [_native_array('Q', offsets), b''.join(entries)]
+    else:
+        raise TypeError(f'Cannot dump entries of type {", ".join(t.__name__ for t in types)}, '
+                        'only int, float, bytes or str.')
+
+    fp.write(_DUMP_HEADER.pack(_DUMP_MAGIC, _DUMP_VERSION, type_code, flags, len(entries)))
+    for chunk in data:
+        fp.write(chunk)
+
+
+def _native_array(type_code: str, numbers: List[Any]) -> bytes:
+    """Returns the numbers as little-endian binary data."""
+    numbers = array(type_code, numbers)
+    if byteorder == 'big':  # pragma: no cover
+        numbers.byteswap()
+    return numbers.tobytes()
+
+
+def _load_entries(fp) -> Tuple[List[Entry], int]:
+    """Reads entries and flags written by _dump_entries, from the current position of fp
+    onwards."""
+    position = fp.tell()
+    try:
+        buffer, offset = mmap(fp.fileno(), 0, access=ACCESS_READ), position
+    except (AttributeError, UnsupportedOperation, ValueError, OSError):
+        # Not a real file, or an empty one.
+        buffer, offset = fp.read(), 0
+
+    try:
+        with memoryview(buffer) as view:
+            entries, flags, end = _read_entries(view, offset)
+    finally:
+        if isinstance(buffer, mmap):
+            buffer.close()
+
+    fp.seek(position + end - offset)
+    return entries, flags
+
+
+def _describe_dump_flags(flags: int) -> str:
+    """Returns how a tree with the dump flags was built, for error messages."""
+    return (f"with duplicates={'count' if flags & _DUMP_COUNTED else 'ignore'!r} and "
+            f"{'a' if flags & _DUMP_KEYED else 'no'} key function")
+
+
+def _read_entries(view: memoryview, offset: int) -> Tuple[List[Entry], int, int]:
+    """Returns the entries dumped at offset in view, their flags and the offset right after
+    them."""
+    type_code, flags, count, offset = _read_header(view, offset)
+
+    if type_code in 'qd':
+        end = offset + 8 * count
+        return _read_numbers(view[offset:end], type_code), flags, end
+
+    offsets = _read_numbers(view[offset:offset + 8 * (count + 1)], 'Q')
+    offset += 8 * (count + 1)
+    end = offset + offsets[-1]
+    blob = view[offset:end].tobytes()
+    entries = [blob[offsets[i]:offsets[i + 1]] for i in range(count)]
+    if type_code == 's':
+        entries = [entry.decode('utf-8') for entry in entries]
+    return entries, flags, end
+
+
+def _read_header(view: memoryview, offset: int) -> Tuple[str, int, int, int]:
+    """Returns the type code, the flags and the number of the entries dumped at offset in
+    view, and the offset of the entries themselves. Raise ValueError if there is no dumped
+    tree there."""
+    if len(view) - offset < _DUMP_HEADER.size:
+        raise ValueError('Not a dumped AVLTree: the data is too short.')
+    magic, version, type_code, flags, count = _DUMP_HEADER.unpack_from(view, offset)
+    if magic != _DUMP_MAGIC:
+        raise ValueError('Not a dumped AVLTree: wrong magic string.')
+    if version != _DUMP_VERSION or type_code not in b'qdbs':
+        raise ValueError(f'Unsupported dumped AVLTree version {version} or type {type_code}.')
+    return type_code.decode(), flags, count, offset + _DUMP_HEADER.size
+
+
+def _read_numbers(view: memoryview, type_code: str) -> List[Any]:
+    """Returns the little-endian numbers of view as a list."""
+    numbers = array(type_code)
+    numbers.frombytes(view)
+    if byteorder == 'big':  # pragma: no cover
+        numbers.byteswap()
+    return numbers.tolist()
+
+
+class _AVLMapNode(_AVLNode):
+    """Internal object, represents a tree node holding a key and its value."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, entry: Entry = None, key: Any = None):
+        """Creates a new node without a value."""
+        super().__init__(entry, key)
+        self.value: Any = None
+
+    def take_entry(self, node: '_AVLMapNode') -> None:
+        """Moves the key and the value of node into this node."""
+        super().take_entry(node)
+        self.value = node.value
+
+
+class _AVLMapTree(AVLTree):
+    """Internal object, the tree of keys backing an AVLMap."""
+
+    _node_class = _AVLMapNode
+
+
+class AVLMap(MutableMapping):
+    """
+    AVLMap implements a sorted mapping on top of AVLTree.
+
+    Keys are kept in order, so iterating over the map, or over its keys(), values() and
+    items() views, goes from the smallest key to the greatest. Lookup, insertion and
+    deletion take O(log n) time, and setting a value reaches its key in a single descent
+    whether the key is new or not.
+
+    AVLMap expected comparable objects as keys.
+
+    AVLMap() -> new empty map.
+    AVLMap(mapping) -> new map initialized from a mapping's (key, value) pairs
+    AVLMap(seq) -> new map initialized from seq [(key1, value1), ... (keyN, valueN)]
+    AVLMap(**kwargs) -> new map initialized with the name=value pairs in kwargs
+
+    """
+
+    def __init__(self, items: Any = None, **kwargs):
+        """Initialize an AVL Map. """
+        self._tree = _AVLMapTree()
+
+        if isinstance(items, AVLMap):
+            self._build(list(items.items()))
+        elif items is not None:
+            self.update(items)
+        if kwargs:
+            self.update(kwargs)
+
+    def __getitem__(self, key: Entry) -> Any:
+        """M[k] -> the value of k, raise KeyError if k is not in M."""
+        try:
+            return self._tree._search(key).value
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: Entry, value: Any) -> None:
+        """M[k] = v -> sets the value of k, adding k to M if needed."""
+        node, _ = self._tree._insert(key)
+        node.value = value
+
+    def put(self, key: Entry, value: Any) -> None:
+        """M.put(k, v) -> sets the value of k, adding k to M if needed. Same as M[k] = v."""
+        self[key] = value
+
+    def setdefault(self, key: Entry, default: Any = None) -> Any:
+        """M.setdefault(k, d) -> M[k], setting M[k] = d first if k is not in M."""
+        node, created = self._tree._insert(key)
+        if created:
+            node.value = default
+        return node.value
+
+    def __delitem__(self, key: Entry) -> None:
+        """del M[k] -> removes k and its value, raise KeyError if k is not in M."""
+        self._tree.delete(key)
+
+    def __iter__(self) -> Generator[Entry, None, None]:
+        """Iterates over the keys in ascending order."""
+        return self._tree.traverse()
+
+    def __reversed__(self) -> Generator[Entry, None, None]:
+        """Iterates over the keys in descending order."""
+        return (node.entry for node in self._nodes(reverse=True))
+
+    def __len__(self) -> int:
+        """M.__len__() <==> len(x). Retuns the number of keys in the map."""
+        return len(self._tree)
+
+    def __contains__(self, key: Entry) -> bool:
+        """k in M -> True if M has a key k, else False"""
+        return key in self._tree
+
+    def keys(self) -> KeysView:
+        """M.keys() -> a sorted view on the keys of M."""
+        return _AVLMapKeysView(self)
+
+    def values(self) -> ValuesView:
+        """M.values() -> a view on the values of M, sorted by their keys."""
+        return _AVLMapValuesView(self)
+
+    def items(self) -> ItemsView:
+        """M.items() -> a sorted view on the (key, value) pairs of M."""
+        return _AVLMapItemsView(self)
+
+    def clear(self) -> None:
+        """M.clear() -> Removes all keys of M leaving it empty."""
+        self._tree.clear()
+
+    def copy(self) -> 'AVLMap':
+        """M.copy() -> a shallow copy of M."""
+        return self.__class__(self)
+
+    def __repr__(self) -> str:
+        """M.__repr__(...) <==> repr(x)."""
+        items = ', '.join(f'{key!r}: {value!r}' for key, value in self.items())
+        return f'{self.__class__.__name__}({{{items}}})'
+
+    def _build(self, items: List[Tuple[Entry, Any]]) -> None:
+        """Replaces the content of the map with the (key, value) pairs sorted by unique keys."""
+        keys = [key for key, _ in items]
+        self._tree._build(keys, keys)
+        for node, (_, value) in zip(self._nodes(), items):
+            node.value = value
+
+    def _nodes(self, reverse: bool = False) -> Generator[_AVLMapNode, None, None]:
+        """Iterates over the nodes in key order."""
+        stack = []
+        push, pop = stack.append, stack.pop
+        root = self._tree.root
+
+        while True:
+            while root is not EMPTY_NODE:
+                push(root)
+                root = root.right if reverse else root.left
+            if not stack:
+                return
+            root = pop()
+            yield root
+            root = root.left if reverse else root.right
+
+
+class _AVLMapKeysView(KeysView):
+    """Sorted view on the keys of an AVLMap."""
+
+    def __reversed__(self) -> Generator[Entry, None, None]:
+        return reversed(self._mapping)
+
+
+class _AVLMapValuesView(ValuesView):
+    """View on the values of an AVLMap, sorted by their keys."""
+
+    def __iter__(self) -> Generator[Any, None, None]:
+        return (node.value for node in self._mapping._nodes())
+
+    def __reversed__(self) -> Generator[Any, None, None]:
+        return (node.value for node in self._mapping._nodes(reverse=True))
+
+
+class _AVLMapItemsView(ItemsView):
+    """Sorted view on the (key, value) pairs of an AVLMap."""
+
+    def __iter__(self) -> Generator[Tuple[Entry, Any], None, None]:
+        return ((node.entry, node.value) for node in self._mapping._nodes())
 
-                q.append(left)
-                q.append(right)
+    def __reversed__(self) -> Generator[Tuple[Entry, Any], None, None]:
+        return ((node.entry, node.value) for node in self._mapping._nodes(reverse=True))
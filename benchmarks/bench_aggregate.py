@@ -0,0 +1,57 @@
+"""
+Compares range sums taken with AVLTree.aggregate against summing AVLTree.irange, and the
+cost of keeping the aggregates up to date in insert and delete.
+
+Usage: python benchmarks/bench_aggregate.py [size ...]
+
+Each range covers about a tenth of the entries, so irange visits that many of them, while
+aggregate combines O(log n) subtree totals.
+"""
+import operator
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from avl_tree import AVLTree, Monoid  # noqa: E402
+
+RANGES = 1000
+
+
+def bench(size: int) -> None:
+    random.seed(7477)
+    entries = random.sample(range(size * 4), size)
+    ranges = [(lo, lo + size * 4 // 10) for lo in
+              (random.randrange(size * 4) for _ in range(RANGES))]
+
+    for name, options in (('plain', {}), ('monoid', {'monoid': Monoid(operator.add, 0)})):
+        tree = AVLTree(**options)
+        start = time.perf_counter()
+        for entry in entries:
+            tree.insert(entry)
+        insert_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if name == 'plain':
+            for lo, hi in ranges:
+                sum(tree.irange(lo, hi))
+        else:
+            for lo, hi in ranges:
+                tree.aggregate(lo, hi)
+        sum_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for entry in entries:
+            tree.delete(entry)
+        delete_time = time.perf_counter() - start
+
+        method = 'sum(irange)' if name == 'plain' else 'aggregate'
+        print(f'{size:>10} | {name:<6} | insert {insert_time:7.3f} s '
+              f'| delete {delete_time:7.3f} s | {RANGES} {method:<11} {sum_time:8.4f} s')
+
+
+if __name__ == '__main__':
+    for size in map(int, sys.argv[1:] or ['10000', '100000']):
+        bench(size)
@@ -0,0 +1,95 @@
+"""
+Stress test for ConcurrentAVLTree: reader threads search and scan ranges while a writer
+thread inserts and deletes, all on a concurrent.futures thread pool.
+
+Usage: python benchmarks/bench_concurrent.py [readers ...]
+
+For comparison, the same workload runs on a plain AVLTree behind a single global lock,
+which readers and the writer all take. Every range scan also checks that it saw a
+consistent version of the tree.
+"""
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from avl_tree import AVLTree, ConcurrentAVLTree  # noqa: E402
+
+SIZE = 100000
+WRITES = 20000
+SCAN = 100
+
+
+class LockedAVLTree:
+    """AVLTree serialized behind one lock, the baseline."""
+
+    def __init__(self, entries):
+        self._lock = Lock()
+        self._tree = AVLTree(entries)
+
+    def insert(self, entry):
+        with self._lock:
+            self._tree.insert(entry)
+
+    def delete(self, entry):
+        with self._lock:
+            self._tree.delete(entry)
+
+    def __contains__(self, entry):
+        with self._lock:
+            return entry in self._tree
+
+    def irange(self, lo, hi):
+        with self._lock:
+            return list(self._tree.irange(lo, hi))
+
+
+def write(tree, done: Event) -> None:
+    # Only even entries are ever written, so readers can tell garbage from a valid version.
+    rng = random.Random(1)
+    for _ in range(WRITES):
+        entry = rng.randrange(SIZE) * 2
+        if entry in tree:
+            tree.delete(entry)
+        else:
+            tree.insert(entry)
+    done.set()
+
+
+def read(tree, done: Event, seed: int) -> int:
+    rng = random.Random(seed)
+    operations = 0
+    while not done.is_set():
+        lo = rng.randrange(SIZE) * 2
+        entries = list(tree.irange(lo, lo + SCAN))
+        assert entries == sorted(entries) and all(entry % 2 == 0 for entry in entries)
+        for _ in range(10):
+            rng.randrange(SIZE * 2) in tree
+        operations += 11
+    return operations
+
+
+def bench(name: str, tree, readers: int) -> None:
+    done = Event()
+    with ThreadPoolExecutor(readers + 1) as executor:
+        start = time.perf_counter()
+        futures = [executor.submit(read, tree, done, seed) for seed in range(readers)]
+        writer = executor.submit(write, tree, done)
+        writer.result()
+        write_time = time.perf_counter() - start
+        reads = sum(future.result() for future in futures)
+        elapsed = time.perf_counter() - start
+
+    print(f'{name:<18} {readers:>3} readers | writes {WRITES / write_time:>10,.0f} ops/s '
+          f'| reads {reads / elapsed:>10,.0f} ops/s')
+
+
+if __name__ == '__main__':
+    entries = range(0, SIZE * 2, 4)
+    for readers in map(int, sys.argv[1:] or ['1', '4', '16']):
+        bench('ConcurrentAVLTree', ConcurrentAVLTree(entries), readers)
+        bench('AVLTree + Lock', LockedAVLTree(entries), readers)
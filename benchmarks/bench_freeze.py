@@ -0,0 +1,55 @@
+"""
+Compares lookups in an AVLTree with lookups in the indexes returned by AVLTree.freeze.
+
+Usage: python benchmarks/bench_freeze.py [size ...]
+
+Single lookups go through AVLTree._search and FrozenAVLIndex.rank, one Python call per
+entry. Batched lookups go through FrozenAVLIndex.search_sorted, which uses NumPy when it
+is installed.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from avl_tree import AVLTree, np  # noqa: E402
+
+QUERIES = 200000
+
+
+def report(size: int, name: str, elapsed: float) -> None:
+    print(f'{size:>10} entries | {name:<34} {QUERIES / elapsed:>14,.0f} lookups/s')
+
+
+def bench(size: int) -> None:
+    random.seed(7477)
+    tree = AVLTree(random.sample(range(size * 4), size))
+    queries = [random.randrange(size * 4) for _ in range(QUERIES)]
+
+    start = time.perf_counter()
+    for query in queries:
+        try:
+            tree._search(query)
+        except KeyError:
+            pass
+    report(size, 'AVLTree._search', time.perf_counter() - start)
+
+    for layout in ('eytzinger', 'sorted'):
+        index = tree.freeze(layout)
+        start = time.perf_counter()
+        for query in queries:
+            index.rank(query)
+        report(size, f'freeze({layout!r}).rank', time.perf_counter() - start)
+
+        batch = np.array(queries) if np is not None else queries
+        start = time.perf_counter()
+        index.search_sorted(batch)
+        report(size, f'freeze({layout!r}).search_sorted', time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    print(f"NumPy {'available' if np is not None else 'not installed'}")
+    for size in map(int, sys.argv[1:] or ['100000', '1000000']):
+        bench(size)
@@ -0,0 +1,42 @@
+"""
+Measures the throughput of AVLTree.insert and AVLTree.delete.
+
+Usage: python benchmarks/bench_insert_delete.py [size ...]
+
+Run it on two revisions to compare them, e.g. before and after a change to the
+balancing code.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from avl_tree import AVLTree  # noqa: E402
+
+
+def bench(size: int) -> None:
+    random.seed(7477)
+    entries = list(range(size))
+    random.shuffle(entries)
+
+    tree = AVLTree()
+    start = time.perf_counter()
+    for entry in entries:
+        tree.insert(entry)
+    insert_time = time.perf_counter() - start
+
+    random.shuffle(entries)
+    start = time.perf_counter()
+    for entry in entries:
+        tree.delete(entry)
+    delete_time = time.perf_counter() - start
+
+    print(f'{size:>10} entries | insert {size / insert_time:>12,.0f} ops/s '
+          f'| delete {size / delete_time:>12,.0f} ops/s')
+
+
+if __name__ == '__main__':
+    for size in map(int, sys.argv[1:] or ['10000', '100000', '1000000']):
+        bench(size)
@@ -0,0 +1,37 @@
+"""
+Measures the memory taken by the tree structure, per entry, for each storage.
+
+Usage: python benchmarks/bench_memory.py [size ...]
+
+The entries are allocated before the measurement starts, so only the memory
+used by the tree itself is reported.
+"""
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from avl_tree import AVLTree  # noqa: E402
+
+
+def bench(size: int, storage: str) -> None:
+    random.seed(7477)
+    entries = list(range(size))
+    random.shuffle(entries)
+
+    tracemalloc.start()
+    tree = AVLTree(storage=storage)
+    for entry in entries:
+        tree.insert(entry)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{size:>10} entries | {storage:>4} storage | {used / size:>8.1f} bytes/entry')
+
+
+if __name__ == '__main__':
+    for size in map(int, sys.argv[1:] or ['10000', '100000', '1000000']):
+        for storage in ('node', 'pool'):
+            bench(size, storage)
@@ -0,0 +1,268 @@
+"""
+Benchmark suite covering the operations of AVLTree, meant to catch regressions between
+releases.
+
+Usage: python benchmarks/bench_suite.py [--sizes N ...] [--distributions NAME ...]
+                                        [--storages NAME ...] [--operations NAME ...]
+                                        [--repeat R] [--json FILE]
+                                        [--compare FILE [--threshold RATIO]]
+
+Every operation runs on trees of each size, built from entries in each distribution:
+
+    random       the entries in random order
+    sorted       in increasing order
+    reversed     in decreasing order
+    adversarial  alternately the smallest and the largest entry left, so that inserts
+                 keep landing between the two halves already built, which gives the
+                 longest paths and by far the most double rotations of the four
+
+Each measurement is the best of R runs. Most operations report how many entries per
+second they handle; len and copy, which take O(1), are called CALLS times per run and
+report calls per second.
+--json writes the results to FILE, along with the Python version and the platform, and
+--compare reads such a file from an earlier run, prints how each measurement changed and
+exits with status 1 if any became slower than the threshold, 1.25 times by default.
+
+Set AVL_TREE_PURE_PYTHON=1 to benchmark the pure-Python primitives when the compiled
+extension is built; the results record which backend ran.
+
+The default sizes stop at 10^5 so that the suite finishes in a few minutes; pass larger
+ones, up to 10^7, explicitly.
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import avl_tree  # noqa: E402
+from avl_tree import AVLTree  # noqa: E402
+
+# Lookups are timed on at most that many entries of the tree, whatever its size.
+QUERIES = 100000
+# Number of calls timed for the operations taking O(1).
+CALLS = 10000
+
+
+def random_entries(size: int):
+    entries = list(range(size))
+    random.Random(7477).shuffle(entries)
+    return entries
+
+
+def adversarial_entries(size: int):
+    entries = []
+    lo, hi = 0, size - 1
+    while lo <= hi:
+        entries.append(lo)
+        if lo != hi:
+            entries.append(hi)
+        lo, hi = lo + 1, hi - 1
+    return entries
+
+
+DISTRIBUTIONS = {
+    'random': random_entries,
+    'sorted': lambda size: list(range(size)),
+    'reversed': lambda size: list(range(size - 1, -1, -1)),
+    'adversarial': adversarial_entries,
+}
+
+
+def queries_of(entries):
+    return random.Random(1217).sample(entries, min(len(entries), QUERIES))
+
+
+def consume(entries) -> None:
+    for _ in entries:
+        pass
+
+
+def run_insert(tree, entries, storage):
+    targets = []
+
+    def setup():
+        targets.append(AVLTree(storage=storage))
+
+    def insert():
+        target = targets.pop()
+        for entry in entries:
+            target.insert(entry)
+
+    return insert, len(entries), setup
+
+
+def run_delete(tree, entries, storage):
+    targets = []
+
+    def setup():
+        targets.append(AVLTree(tree, storage=storage))
+
+    def delete():
+        target = targets.pop()
+        for entry in entries:
+            target.delete(entry)
+
+    return delete, len(entries), setup
+
+
+def run_lookup(method):
+    def run(tree, entries, storage):
+        queries = queries_of(entries)
+        lookup = getattr(tree, method)
+
+        def call():
+            for entry in queries:
+                try:
+                    lookup(entry)
+                except KeyError:
+                    pass
+        return call, len(queries), None
+    return run
+
+
+def run_traverse(order):
+    def run(tree, entries, storage):
+        return lambda: consume(tree.traverse(order)), len(entries), None
+    return run
+
+
+def run_once(function):
+    def run(tree, entries, storage):
+        return lambda: function(tree, entries, storage), len(entries), None
+    return run
+
+
+def run_calls(function):
+    def run(tree, entries, storage):
+        def call():
+            for _ in range(CALLS):
+                function(tree)
+        return call, CALLS, None
+    return run
+
+
+def run_eq(tree, entries, storage):
+    other = AVLTree(tree, storage=storage)
+    return lambda: tree == other, len(entries), None
+
+
+def run_clear(tree, entries, storage):
+    targets = []
+
+    def setup():
+        targets.append(AVLTree(tree, storage=storage))
+
+    return lambda: targets.pop().clear(), len(entries), setup
+
+
+# Each operation returns the function to time, the number of entries or calls it handles
+# and a function to call, untimed, before each run, or None.
+OPERATIONS = {
+    'construct_from_sequence': run_once(
+        lambda tree, entries, storage: AVLTree(entries, storage=storage)),
+    'construct_from_tree': run_once(
+        lambda tree, entries, storage: AVLTree(tree, storage=storage)),
+    'insert': run_insert,
+    'delete': run_delete,
+    'search': run_lookup('search'),
+    'contains': run_lookup('__contains__'),
+    'pred': run_lookup('pred'),
+    'succ': run_lookup('succ'),
+    'traverse_inorder': run_traverse('inorder'),
+    'traverse_preorder': run_traverse('preorder'),
+    'traverse_postorder': run_traverse('postorder'),
+    'traverse_bfs': run_traverse('bfs'),
+    'eq': run_eq,
+    'len': run_calls(len),
+    'copy': run_calls(copy.copy),
+    'deepcopy': run_once(lambda tree, entries, storage: copy.deepcopy(tree)),
+    'clear': run_clear,
+}
+
+
+def measure(run, repeat: int) -> float:
+    function, _, setup = run
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(args) -> list:
+    results = []
+    for size in args.sizes:
+        for distribution in args.distributions:
+            entries = DISTRIBUTIONS[distribution](size)
+            for storage in args.storages:
+                tree = AVLTree(entries, storage=storage)
+                for operation in args.operations:
+                    run = OPERATIONS[operation](tree, entries, storage)
+                    seconds = measure(run, args.repeat)
+                    unit = 'calls' if operation in ('len', 'copy') else 'entries'
+                    result = {'operation': operation, 'storage': storage,
+                              'distribution': distribution, 'size': size, 'seconds': seconds,
+                              'rate': run[1] / seconds, 'unit': unit}
+                    results.append(result)
+                    print(f'{size:>10} | {distribution:<11} | {storage:<4} | {operation:<23} '
+                          f'{seconds:>10.4f} s {result["rate"]:>14,.0f} {unit}/s')
+    return results
+
+
+def compare(results: list, baseline_path: str, threshold: float) -> bool:
+    """Prints how each result changed since the baseline, returns True if none regressed."""
+    with open(baseline_path) as fp:
+        baseline = json.load(fp)['results']
+    identity = ('operation', 'storage', 'distribution', 'size')
+    previous = {tuple(result[name] for name in identity): result for result in baseline}
+
+    passed = True
+    print(f'\nCompared with {baseline_path}, slower than {threshold}x is a regression:')
+    for result in results:
+        old = previous.get(tuple(result[name] for name in identity))
+        if old is None:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        regressed = ratio > threshold
+        passed = passed and not regressed
+        print(f'{result["size"]:>10} | {result["distribution"]:<11} | {result["storage"]:<4} '
+              f'| {result["operation"]:<23} {ratio:>6.2f}x{"  REGRESSION" if regressed else ""}')
+    return passed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks the operations of AVLTree.')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--distributions', nargs='+', choices=DISTRIBUTIONS,
+                        default=list(DISTRIBUTIONS))
+    parser.add_argument('--storages', nargs='+', choices=['node', 'pool'],
+                        default=['node', 'pool'])
+    parser.add_argument('--operations', nargs='+', choices=OPERATIONS, default=list(OPERATIONS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = bench(args)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'backend': 'python' if avl_tree._speedups is None else 'compiled',
+                       'repeat': args.repeat, 'results': results}, fp, indent=2)
+    if args.compare and not compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
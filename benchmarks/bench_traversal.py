@@ -0,0 +1,48 @@
+"""
+Measures how many entries per second the traversals of AVLTree yield.
+
+Usage: python benchmarks/bench_traversal.py [size ...]
+
+Trees are built once per size, then each traversal is consumed by a deque of length zero,
+which adds almost nothing on top of the generator itself. iter and reversed are skipped on
+revisions without __iter__ and __reversed__, so the script can run on both sides of a change.
+"""
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from avl_tree import AVLTree  # noqa: E402
+
+TRAVERSALS = {
+    'inorder': lambda tree: tree.traverse(),
+    'preorder': lambda tree: tree.traverse('preorder'),
+    'postorder': lambda tree: tree.traverse('postorder'),
+    'bfs': lambda tree: tree.traverse('bfs'),
+    'iter': lambda tree: iter(tree),
+    'reversed': lambda tree: reversed(tree),
+}
+
+
+def bench(size: int, storage: str) -> None:
+    random.seed(7477)
+    entries = list(range(size))
+    random.shuffle(entries)
+    tree = AVLTree(entries, storage=storage)
+
+    for name, traversal in TRAVERSALS.items():
+        if name in ('iter', 'reversed') and not hasattr(tree, f'__{name}__'):
+            continue
+        start = time.perf_counter()
+        deque(traversal(tree), maxlen=0)
+        elapsed = time.perf_counter() - start
+        print(f'{size:>10} entries | {storage:<4} | {name:<9} {size / elapsed:>14,.0f} entries/s')
+
+
+if __name__ == '__main__':
+    for size in map(int, sys.argv[1:] or ['1000000']):
+        for storage in ('node', 'pool'):
+            bench(size, storage)
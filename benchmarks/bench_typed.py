@@ -0,0 +1,70 @@
+"""
+Compares trees of numbers created with dtype='int64' against the node and pool storages.
+
+Usage: python benchmarks/bench_typed.py [size ...]
+
+The entries start out in a NumPy array, as they would when they come from a file or a
+computation. Memory is measured once the input is gone, so it includes the int objects a
+tree keeps for its entries, which dtype='int64' does without. The typed tree is built from
+the array itself, the others from a list of its entries, and traverse and irange are
+consumed into arrays by the typed tree and into lists by the others.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import numpy as np  # noqa: E402
+
+from avl_tree import AVLTree  # noqa: E402
+
+RANGES = 100
+
+
+def build(values, variant: str):
+    if variant == 'int64':
+        return AVLTree(values, dtype='int64')
+    return AVLTree(values.tolist(), storage=variant)
+
+
+def bench(size: int, variant: str) -> None:
+    values = np.random.default_rng(7477).permutation(size * 2)[:size]
+    batch = np.random.default_rng(1217).integers(0, size * 2, size)
+
+    tracemalloc.start()
+    tree = build(values, variant)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    build(values, variant)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    entries = tree.traverse()
+    if variant != 'int64':
+        entries = list(entries)
+    traverse_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for lo in range(0, size * 2, size * 2 // RANGES):
+        entries = tree.irange(lo, lo + size // 50)
+        if variant != 'int64':
+            entries = list(entries)
+    irange_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tree.insert_many(batch if variant == 'int64' else batch.tolist())
+    insert_time = time.perf_counter() - start
+
+    print(f'{size:>10} | {variant:<5} | {used / size:>6.1f} bytes/entry '
+          f'| build {build_time:7.3f} s | traverse {traverse_time:7.3f} s '
+          f'| {RANGES} irange {irange_time:7.3f} s | insert_many {insert_time:7.3f} s')
+
+
+if __name__ == '__main__':
+    for size in map(int, sys.argv[1:] or ['100000', '1000000']):
+        for variant in ('node', 'pool', 'int64'):
+            bench(size, variant)
@@ -0,0 +1,17 @@
+"""
+Installs avl_tree along with its optional compiled extension, _avl_tree_speedups.
+
+The extension only speeds up the node primitives: when it cannot be built, for lack of a
+C compiler for instance, the installation goes on and avl_tree runs in pure Python.
+To build it next to avl_tree.py while working on the repository, run
+
+    python setup.py build_ext --inplace
+"""
+from setuptools import setup, Extension
+
+setup(
+    name='py-avl-tree',
+    py_modules=['avl_tree'],
+    ext_modules=[Extension('_avl_tree_speedups', ['_avl_tree_speedups.c'], optional=True)],
+    python_requires='>=3.6',
+)
@@ -21,9 +21,17 @@ OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
 WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 import functools
+import math
 import unittest
 
-from avl_tree import AVLTree
+import avl_tree
+from avl_tree import (AVLTree, AVLMap, PersistentAVLTree, ConcurrentAVLTree, FrozenAVLTree,
+                      Monoid)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 @functools.total_ordering
@@ -395,6 +403,175 @@ class AvlTreeTest(unittest.TestCase):
             with self.subTest(f"test {order}"):
                 self.assertTupleEqual(tuple(tree.traverse(order)), expected_value)
 
+    def test_floor_ceiling_lower_higher(self):
+        import bisect
+        entries = sorted(set(get_random_entries()))
+        tree = AVLTree(entries)
+
+        for entry in range(entries[0] - 2, entries[-1] + 3):
+            with self.subTest(f"test neighbours of {entry}"):
+                i, j = bisect.bisect_left(entries, entry), bisect.bisect_right(entries, entry)
+                self.assertEqual(tree.floor(entry), entries[j - 1] if j else None)
+                self.assertEqual(tree.lower(entry), entries[i - 1] if i else None)
+                self.assertEqual(tree.ceiling(entry), entries[i] if i < len(entries) else None)
+                self.assertEqual(tree.higher(entry), entries[j] if j < len(entries) else None)
+
+    def test_floor_ceiling_lower_higher_default(self):
+        tree = AVLTree([10, 20], key=lambda entry: -entry)
+
+        self.assertEqual(tree.floor(15), 20)
+        self.assertEqual(tree.ceiling(15), 10)
+        self.assertEqual(tree.floor(25, 'none'), 'none')
+        self.assertEqual(tree.higher(10, default=0), 0)
+        self.assertEqual(tree.lower(20, default=0), 0)
+        self.assertIsNone(AVLTree().ceiling(1))
+
+    def test_nearest(self):
+        tree = AVLTree([10, 20, 40])
+
+        for entry, expected in ((0, 10), (10, 10), (14, 10), (15, 10), (16, 20), (31, 40),
+                                (99, 40), (20.5, 20)):
+            with self.subTest(f"test nearest {entry}"):
+                self.assertEqual(tree.nearest(entry), expected)
+        self.assertEqual(AVLTree().nearest(3, default=-1), -1)
+
+    def test_seek(self):
+        tree = AVLTree(range(0, 20, 2))
+
+        for side, entry, expected in (('ge', 4, 4), ('ge', 5, 6), ('gt', 4, 6), ('le', 4, 4),
+                                      ('le', 5, 4), ('lt', 4, 2), ('ge', -1, 0), ('le', 99, 18)):
+            with self.subTest(f"test seek {side} {entry}"):
+                cursor = tree.seek(entry, side)
+                self.assertTrue(cursor)
+                self.assertEqual(cursor.entry, expected)
+        for side, entry in (('ge', 19), ('gt', 18), ('le', -1), ('lt', 0)):
+            with self.subTest(f"test seek {side} {entry} out of range"):
+                cursor = tree.seek(entry, side)
+                self.assertFalse(cursor)
+                with self.assertRaises(KeyError):
+                    cursor.entry
+        with self.assertRaises(ValueError):
+            tree.seek(4, 'eq')
+
+    def test_cursor_steps(self):
+        entries = sorted(set(get_random_entries()))
+        tree = AVLTree(entries)
+
+        cursor = tree.seek(entries[0])
+        for entry in entries[1:]:
+            self.assertTrue(cursor.next())
+            self.assertEqual(cursor.entry, entry)
+        self.assertFalse(cursor.next())
+        self.assertFalse(cursor.next())
+        for entry in reversed(entries):
+            self.assertTrue(cursor.prev())
+            self.assertEqual(cursor.entry, entry)
+        self.assertFalse(cursor.prev())
+        self.assertTrue(cursor.next())
+        self.assertEqual(cursor.entry, entries[0])
+        self.assertListEqual(list(tree.seek(entries[-3])), entries[-3:])
+
+    def test_cursor_remove(self):
+        tree = AVLTree(range(10), key=lambda entry: -entry)
+        cursor = tree.seek(6)
+
+        self.assertEqual(cursor.remove(), 6)
+        self.assertEqual(cursor.entry, 5)
+        self.assertEqual(cursor.remove(), 5)
+        cursor.prev()
+        self.assertEqual(cursor.entry, 7)
+        self.assertListEqual(list(tree), [9, 8, 7, 4, 3, 2, 1, 0])
+        assert_avl_invariants(self, tree.root)
+
+        cursor = tree.seek(0)
+        self.assertEqual(cursor.remove(), 0)
+        self.assertFalse(cursor)
+        with self.assertRaises(KeyError):
+            cursor.remove()
+
+    def test_dump_and_load(self):
+        import io
+        for entries in ([3, -1, 2 ** 63 - 1, -2 ** 63], [1.5, -2.25, float('inf')],
+                        [b'ab', b'', b'a\x00'], ['b', '', 'été'], []):
+            with self.subTest(f"test dump {entries}"):
+                fp = io.BytesIO()
+                AVLTree(entries).dump(fp)
+                fp.seek(0)
+                tree = AVLTree.load(fp)
+                self.assertListEqual(list(tree), sorted(entries))
+                assert_avl_invariants(self, tree.root)
+
+    def test_dump_and_load_memory_mapped_file(self):
+        import os
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trees.avl')
+            with open(path, 'wb') as fp:
+                fp.write(b'prefix')
+                AVLTree(get_random_entries()).dump(fp)
+                AVLTree(['c', 'a'], key=lambda entry: -ord(entry)).dump(fp)
+            with open(path, 'rb') as fp:
+                fp.seek(len(b'prefix'))
+                first = AVLTree.load(fp, storage='pool')
+                second = AVLTree.load(fp, key=lambda entry: -ord(entry))
+                self.assertEqual(fp.read(), b'')
+
+        self.assertListEqual(list(first), sorted(get_random_entries()))
+        self.assertTrue(repr(first).endswith("storage='pool')"))
+        self.assertListEqual(list(second), ['c', 'a'])
+        self.assertEqual(second.search('a'), 'a')
+
+    def test_dump_and_load_errors(self):
+        import io
+        with self.assertRaises(TypeError):
+            AVLTree([1, 2.5]).dump(io.BytesIO())
+        with self.assertRaises(TypeError):
+            AVLTree([(1, 2)]).dump(io.BytesIO())
+        for entry in (2 ** 70, -2 ** 63 - 1):
+            with self.assertRaises(TypeError):
+                AVLTree([1, entry]).dump(io.BytesIO())
+        with self.assertRaises(ValueError):
+            AVLTree.load(io.BytesIO(b'AVL'))
+        with self.assertRaises(ValueError):
+            AVLTree.load(io.BytesIO(b'JSON' + bytes(12)))
+
+        fp = io.BytesIO()
+        AVLTree(['c', 'a'], key=lambda entry: -ord(entry)).dump(fp)
+        fp.seek(0)
+        with self.assertRaises(ValueError):
+            AVLTree.load(fp)
+        fp.seek(0)
+        with self.assertRaises(ValueError):
+            AVLTree.load(fp, storage='pool')
+
+        fp = io.BytesIO()
+        AVLTree([1, 2]).dump(fp)
+        with self.assertRaises(ValueError):
+            AVLTree.load(io.BytesIO(fp.getvalue()), key=lambda entry: -entry)
+        unsorted = bytearray(fp.getvalue())
+        unsorted[-16:] = unsorted[-8:] + unsorted[-16:-8]
+        with self.assertRaises(ValueError):
+            AVLTree.load(io.BytesIO(bytes(unsorted)))
+
+    def test_iter_and_reversed(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries)
+
+        self.assertListEqual(list(tree), sorted(set(entries)))
+        self.assertListEqual(list(reversed(tree)), sorted(set(entries), reverse=True))
+        self.assertListEqual(list(AVLTree()), [])
+        self.assertListEqual(list(reversed(AVLTree())), [])
+
+    def test_traversals_after_pickling(self):
+        import pickle
+        tree = AVLTree([20, 10, 25, 23, 29, 30])
+        copied = pickle.loads(pickle.dumps(tree))
+
+        for order in ('preorder', 'inorder', 'postorder', 'bfs'):
+            with self.subTest(f"test {order}"):
+                self.assertListEqual(list(copied.traverse(order)), list(tree.traverse(order)))
+        self.assertListEqual(list(reversed(copied)), [30, 29, 25, 23, 20, 10])
+
     def test_length(self):
         tree = AVLTree()
 
@@ -407,6 +584,48 @@ class AvlTreeTest(unittest.TestCase):
         with self.subTest("test empty tree"):
             self.assertEqual(len(AVLTree()), 0)
 
+    def test_length_after_deletions(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries)
+
+        for deleted, entry in enumerate(entries[::2], start=1):
+            tree.delete(entry)
+            self.assertEqual(len(tree), len(entries) - deleted)
+
+    def test_subtree_sizes(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries)
+        for entry in entries[::3]:
+            tree.delete(entry)
+
+        def check(node):
+            if not node:
+                return 0
+            size = 1 + check(node.left) + check(node.right)
+            self.assertEqual(node.size, size)
+            return size
+
+        self.assertEqual(check(tree.root), len(tree))
+
+    def test_random_insertions_and_deletions_keep_tree_balanced(self):
+        import random
+        random.seed(7477)
+        tree = AVLTree()
+        entries = set()
+
+        for _ in range(3000):
+            entry = random.randint(0, 500)
+            if entry in entries and random.random() < 0.5:
+                tree.delete(entry)
+                entries.remove(entry)
+            else:
+                tree.insert(entry)
+                entries.add(entry)
+
+        self.assertListEqual(list(tree.traverse()), sorted(entries))
+        self.assertEqual(len(tree), len(entries))
+        assert_avl_invariants(self, tree.root)
+
     def test_contains(self):
         with self.subTest("test empty tree should not contain any entry"):
             self.assertNotIn(10, AVLTree())
@@ -566,10 +785,13 @@ class AvlTreeTest(unittest.TestCase):
         self.assertFalse(tree)
 
     def test_str_repr(self):
-        tree = AVLTree([1, 2, 3, 4, 5])
+        tree = AVLTree([2, 1, 4, 3, 5])
         self.assertEqual(repr(tree), 'AVLTree([2, 1, 4, 3, 5])')
         self.assertEqual(str(tree), 'AVLTree([2, 1, 4, 3, 5])')
 
+        tree = AVLTree([1, 2, 3, 4, 5])
+        self.assertEqual(repr(tree), 'AVLTree([3, 1, 4, 2, 5])')
+
     def test_equals(self):
         tree1 = AVLTree([1, 2, 3, 4, 5])
         tree2 = AVLTree([2, 1, 4, 3, 5])
@@ -588,6 +810,13 @@ class AvlTreeTest(unittest.TestCase):
         with self.subTest(f"test tree is different from empty tree"):
             self.assertNotEqual(tree1, AVLTree())
 
+    def test_equals_same_entries_different_shapes(self):
+        tree1 = AVLTree([1, 2, 3, 4, 5])
+        tree2 = AVLTree([2, 1, 4, 3, 5])
+
+        self.assertNotEqual(tuple(tree1.traverse('bfs')), tuple(tree2.traverse('bfs')))
+        self.assertEqual(tree1, tree2)
+
     def test_clear(self):
         tree = AVLTree([1, 2, 3, 4, 5])
         tree.clear()
@@ -600,6 +829,50 @@ class AvlTreeTest(unittest.TestCase):
 
         self.assertEqual(copy, AVLTree([2, 1, 4, 3, 5]))
 
+    def test_build_tree_from_other_is_balanced(self):
+        original = AVLTree(get_random_entries())
+        copy = AVLTree(original)
+
+        self.assertEqual(copy, original)
+        self.assertEqual(copy.height, math.ceil(math.log2(len(original) + 1)))
+        self.assertFalse(copy.root is original.root)
+
+    def test_from_sorted(self):
+        entries = list(range(100))
+        tree = AVLTree.from_sorted(entries)
+
+        self.assertListEqual(list(tree.traverse()), entries)
+        self.assertEqual(len(tree), len(entries))
+        self.assertEqual(tree.height, math.ceil(math.log2(len(entries) + 1)))
+
+        with self.subTest("test duplicates are dropped"):
+            tree = AVLTree.from_sorted([1, 1, 2, 3, 3, 3, 4])
+            self.assertListEqual(list(tree.traverse()), [1, 2, 3, 4])
+
+        with self.subTest("test assume unique"):
+            tree = AVLTree.from_sorted(iter(entries), assume_unique=True)
+            self.assertListEqual(list(tree.traverse()), entries)
+
+        with self.subTest("test empty input"):
+            self.assertFalse(AVLTree.from_sorted([]))
+
+        with self.subTest("test unsorted input"):
+            with self.assertRaises(ValueError):
+                AVLTree.from_sorted([1, 3, 2])
+
+    def test_constructor_sorted_fast_path(self):
+        for size in (1, 2, 3, 100, 1000, 1023, 1024):
+            entries = list(range(size))
+            tree = AVLTree(entries)
+            with self.subTest(f"test {size} sorted entries"):
+                self.assertListEqual(list(tree.traverse()), entries)
+                self.assertEqual(len(tree), size)
+                self.assertEqual(tree.height, math.ceil(math.log2(size + 1)))
+
+        tree = AVLTree([1, 2, 2, 3, 3])
+        self.assertListEqual(list(tree.traverse()), [1, 2, 3])
+        self.assertEqual(len(tree), 3)
+
     def test_search(self):
         tree = AVLTree([1, 2, 3, 4, 5])
         entry = tree.search(4)
@@ -685,6 +958,1424 @@ class AvlTreeTest(unittest.TestCase):
             tree.succ(1000000)
         self.assertIn("Successor of 1000000 not found.", str(context.exception))
 
+    def test_rank(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries)
+        ordered = sorted(entries)
+
+        with self.subTest("test rank of present entries"):
+            for position, entry in enumerate(ordered):
+                self.assertEqual(tree.rank(entry), position)
+
+        with self.subTest("test rank of absent entries"):
+            self.assertEqual(tree.rank(ordered[0] - 1), 0)
+            self.assertEqual(tree.rank(ordered[-1] + 1), len(ordered))
+            self.assertEqual(AVLTree().rank(10), 0)
+
+    def test_select(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries)
+        ordered = sorted(entries)
+
+        for position, entry in enumerate(ordered):
+            self.assertEqual(tree.select(position), entry)
+            self.assertEqual(tree[position], entry)
+            self.assertEqual(tree[position - len(ordered)], entry)
+
+        for index in (len(ordered), -len(ordered) - 1):
+            with self.subTest(f"test index {index} out of range"):
+                with self.assertRaises(IndexError):
+                    tree.select(index)
+                with self.assertRaises(IndexError):
+                    tree[index]
+
+        with self.assertRaises(IndexError):
+            AVLTree()[0]
+
+    def test_slicing(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries)
+        ordered = sorted(entries)
+
+        slices = [slice(None), slice(3, 17), slice(-10, None), slice(None, -5),
+                  slice(5, 2), slice(1, 40, 3), slice(None, None, -1), slice(30, 4, -4),
+                  slice(1000, 2000), slice(None, None, 40), slice(-2, 3, -33)]
+        for s in slices:
+            with self.subTest(f"test {s}"):
+                self.assertListEqual(tree[s], ordered[s])
+
+        self.assertListEqual(AVLTree()[:], [])
+
+    def test_irange(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries)
+        ordered = sorted(entries)
+        lower, upper = ordered[0], ordered[-1]
+        middle = ordered[len(ordered) // 2]
+
+        bounds = [(None, None), (lower, upper), (middle, upper), (lower - 10, middle),
+                  (middle, middle), (upper + 1, upper + 10), (middle, lower)]
+        inclusives = [(True, False), (True, True), (False, True), (False, False)]
+
+        for lo, hi in bounds:
+            for inclusive in inclusives:
+                expected = [entry for entry in ordered
+                            if (lo is None or entry > lo or (inclusive[0] and entry == lo)) and
+                            (hi is None or entry < hi or (inclusive[1] and entry == hi))]
+                with self.subTest(f"test irange({lo}, {hi}, {inclusive})"):
+                    self.assertListEqual(list(tree.irange(lo, hi, inclusive)), expected)
+                    self.assertListEqual(list(tree.irange(lo, hi, inclusive, reverse=True)),
+                                         expected[::-1])
+                    self.assertEqual(tree.count_range(lo, hi, inclusive), len(expected))
+
+    def test_irange_empty_tree(self):
+        tree = AVLTree()
+
+        self.assertListEqual(list(tree.irange(1, 10)), [])
+        self.assertListEqual(list(tree.irange(1, 10, reverse=True)), [])
+        self.assertEqual(tree.count_range(1, 10), 0)
+
+    def test_irange_complex_data_type(self):
+        tree = AVLTree([Entry(1, 'a'), Entry(2, 'b'), Entry(3, 'c'), Entry(3, 'd')])
+
+        self.assertListEqual(list(tree.irange(Entry(2, 'a'), Entry(3, 'd'))),
+                             [Entry(2, 'b'), Entry(3, 'c')])
+        self.assertEqual(tree.count_range(Entry(2, 'a'), Entry(3, 'd'), (True, True)), 3)
+
+    def test_key_function(self):
+        entries = [(entry, str(entry)) for entry in get_random_entries()]
+        tree = AVLTree(entries, key=lambda entry: -entry[0])
+        ordered = sorted(entries, reverse=True)
+
+        self.assertListEqual(list(tree.traverse()), ordered)
+        self.assertEqual(tree.search((ordered[3][0], None)), ordered[3])
+        self.assertEqual(tree.pred(ordered[3]), ordered[2])
+        self.assertEqual(tree.succ(ordered[3]), ordered[4])
+        self.assertEqual(tree.rank(ordered[3]), 3)
+        self.assertListEqual(list(tree.irange(ordered[2], ordered[6])), ordered[2:6])
+        self.assertEqual(tree.count_range(ordered[2], ordered[6]), 4)
+        self.assertIn(ordered[0], tree)
+
+        tree.delete(ordered[0])
+        self.assertNotIn(ordered[0], tree)
+        self.assertEqual(tree.min(), ordered[1])
+        assert_avl_invariants(self, tree.root)
+
+    def test_key_function_builds_sorted_input_in_linear_time(self):
+        tree = AVLTree(range(10, 0, -1), key=lambda entry: -entry)
+
+        self.assertListEqual(list(tree.traverse()), list(range(10, 0, -1)))
+        self.assertEqual(tree.height, 4)
+        self.assertEqual(AVLTree(tree, key=lambda entry: entry), AVLTree(range(1, 11)))
+
+    def test_key_is_computed_once_per_entry(self):
+        calls = []
+
+        def key(entry):
+            calls.append(entry)
+            return entry
+
+        tree = AVLTree(key=key)
+        for entry in get_random_entries():
+            tree.insert(entry)
+        self.assertEqual(len(calls), len(tree))
+
+        del calls[:]
+        tree.search(tree.min())
+        self.assertEqual(calls, [tree.min()])
+
+    def test_single_comparison_per_level(self):
+        comparisons = []
+
+        @functools.total_ordering
+        class Key:
+            def __init__(self, value):
+                self.value = value
+
+            def __lt__(self, other):
+                comparisons.append(self)
+                return self.value < other.value
+
+            def __eq__(self, other):
+                comparisons.append(self)
+                return self.value == other.value
+
+        tree = AVLTree(range(1023), key=Key)
+        self.assertEqual(tree.height, 10)
+
+        for entry in (0, 500, 511, 1022):
+            del comparisons[:]
+            tree.search(entry)
+            self.assertEqual(len(comparisons), tree.height + 1)
+
+            del comparisons[:]
+            tree.insert(entry)
+            self.assertEqual(len(comparisons), tree.height + 1)
+
+    def test_insert_many(self):
+        entries = get_random_entries()
+
+        for batch_size in (1, 5, len(entries)):
+            tree = AVLTree(entries[::2])
+            batch = entries[1::2][:batch_size] + entries[:batch_size]
+            tree.insert_many(batch)
+            expected = sorted(set(entries[::2]) | set(batch))
+            with self.subTest(f"test batch of {len(batch)} entries"):
+                self.assertListEqual(list(tree.traverse()), expected)
+                self.assertEqual(len(tree), len(expected))
+                assert_avl_invariants(self, tree.root)
+
+        tree = AVLTree()
+        tree.insert_many(iter(entries))
+        self.assertListEqual(list(tree.traverse()), sorted(entries))
+
+    def test_small_batches_keep_untouched_subtrees(self):
+        import operator
+        tree = AVLTree(range(1000))
+        left = tree.root.left
+        tree.insert_many([1001, 1000, 1002])
+        tree.delete_many([999, 998, 5000])
+        self.assertIs(tree.root.left, left)
+        self.assertListEqual(list(tree), list(range(998)) + [1000, 1001, 1002])
+        assert_avl_invariants(self, tree.root)
+
+        for options in ({'stats': True}, {'monoid': Monoid(operator.add, 0)}):
+            with self.subTest(f"test {options}"):
+                tree = AVLTree(range(100), **options)
+                tree.insert_many([150, 120])
+                tree.delete_many([10, 11])
+                self.assertListEqual(list(tree), [e for e in range(100) if e not in (10, 11)]
+                                     + [120, 150])
+                assert_avl_invariants(self, tree.root)
+        self.assertEqual(tree.aggregate(), sum(range(100)) - 21 + 270)
+
+        tree = AVLTree(range(100), stats=True)
+        tree.insert_many([150, 120])
+        tree.delete_many([10, 11, 12])
+        stats = tree.stats()
+        self.assertEqual(stats['nodes_allocated'] - stats['nodes_freed'], len(tree))
+
+        persistent = PersistentAVLTree(range(100))
+        snapshot = persistent.snapshot()
+        persistent.insert_many([150, 120])
+        persistent.delete_many([10, 11])
+        self.assertListEqual(list(snapshot), list(range(100)))
+        self.assertEqual(len(persistent), 100)
+
+    def test_insert_many_keeps_existing_entries(self):
+        tree = AVLTree([Entry(1, 'a'), Entry(2, 'b')], key=lambda entry: entry.a)
+        tree.insert_many([Entry(3, 'c'), Entry(2, 'x'), Entry(3, 'y')])
+
+        self.assertListEqual(list(tree.traverse()), [Entry(1, 'a'), Entry(2, 'b'), Entry(3, 'c')])
+
+    def test_delete_many(self):
+        entries = get_random_entries()
+
+        for batch_size in (1, 5, len(entries)):
+            tree = AVLTree(entries)
+            batch = entries[:batch_size] + [-1, -2]
+            tree.delete_many(batch)
+            expected = sorted(set(entries) - set(batch))
+            with self.subTest(f"test batch of {len(batch)} entries"):
+                self.assertListEqual(list(tree.traverse()), expected)
+                self.assertEqual(len(tree), len(expected))
+                assert_avl_invariants(self, tree.root)
+
+    def test_contains_many(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries[::2])
+        present = set(entries[::2])
+
+        batches = {
+            'sorted': sorted(entries + [-1, 10000]),
+            'unsorted': entries + [10000, -1],
+            'repeated': entries[:10] * 3,
+            'empty': [],
+        }
+        for name, batch in batches.items():
+            with self.subTest(f"test {name} batch"):
+                self.assertListEqual(tree.contains_many(batch),
+                                     [entry in present for entry in batch])
+
+        self.assertListEqual(AVLTree().contains_many([1, 2]), [False, False])
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_contains_many_numpy(self):
+        tree = AVLTree([1, 3, 5])
+        found = tree.contains_many(np.array([5, 2, 1]))
+
+        self.assertEqual(found.dtype, bool)
+        self.assertListEqual(found.tolist(), [True, False, True])
+
+    def test_freeze(self):
+        import bisect
+        random_entries = get_random_entries()
+        for entries, misses in (
+                (random_entries, range(min(random_entries) - 2, max(random_entries) + 3)),
+                ([float(entry) for entry in range(0, 90, 3)], [-1.5, 4, 44.0, 100.0]),
+                (['pear', 'apple', 'fig', 'kiwi'], ['', 'grape', 'zz']),
+                ([2 ** 70, -2 ** 70, 0], [1, -2 ** 80]),
+                ([1], [0, 2]),
+                ([], [5])):
+            ordered = sorted(set(entries))
+            queries = sorted(set(ordered) | set(misses))
+            tree = AVLTree(entries)
+            for layout in ('eytzinger', 'sorted'):
+                with self.subTest(f"test {layout} {entries[:3]}"):
+                    index = tree.freeze(layout)
+                    self.assertListEqual(list(index), ordered)
+                    self.assertEqual(len(index), len(ordered))
+                    for query in queries:
+                        self.assertEqual(index.rank(query), bisect.bisect_left(ordered, query))
+                        self.assertEqual(query in index, query in tree)
+                    self.assertListEqual(list(index.search_sorted(queries, 'right')),
+                                         [bisect.bisect_right(ordered, query)
+                                          for query in queries])
+
+        tree = AVLTree([3, 1, 2])
+        index = tree.freeze()
+        tree.insert(4)
+        self.assertEqual(repr(index), "FrozenAVLIndex([1, 2, 3], layout='eytzinger')")
+        self.assertEqual((index.search(2), index[-1]), (2, 3))
+        with self.assertRaises(KeyError):
+            index.search(4)
+        with self.assertRaises(ValueError):
+            tree.freeze('veb')
+        with self.assertRaises(ValueError):
+            index.search_sorted([1], 'middle')
+
+    def test_freeze_key_function(self):
+        index = AVLTree(['ccc', 'a', 'bb'], key=len).freeze()
+
+        self.assertEqual(index.search('xx'), 'bb')
+        self.assertEqual(index.rank('xxxx'), 3)
+        self.assertListEqual(list(index.search_sorted(['', 'xx'])), [0, 1])
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_freeze_search_sorted_numpy(self):
+        entries = list(range(0, 200, 2))
+        queries = np.arange(-1, 202)
+        for layout in ('eytzinger', 'sorted'):
+            for side in ('left', 'right'):
+                with self.subTest(f"test {layout} {side}"):
+                    positions = AVLTree(entries).freeze(layout).search_sorted(queries, side)
+                    self.assertIsInstance(positions, np.ndarray)
+                    self.assertListEqual(positions.tolist(),
+                                         np.searchsorted(entries, queries, side).tolist())
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_freeze_search_sorted_mixed_types(self):
+        import bisect
+        for entries, queries in (([1, 2, 3], [2.5, -0.5, 3.0, 3.5]),
+                                 ([0.5, 1.5, 2.5], [1, 2, 3, -1])):
+            for layout in ('eytzinger', 'sorted'):
+                with self.subTest(f"test {layout} {entries}"):
+                    index = AVLTree(entries).freeze(layout)
+                    self.assertListEqual(index.search_sorted(queries).tolist(),
+                                         [index.rank(query) for query in queries])
+                    self.assertListEqual(index.search_sorted(queries, 'right').tolist(),
+                                         [bisect.bisect_right(entries, query)
+                                          for query in queries])
+
+    def test_split(self):
+        entries = get_random_entries()
+        ordered = sorted(entries)
+
+        for pivot in (ordered[0] - 1, ordered[0], ordered[len(ordered) // 3], ordered[-1],
+                      ordered[-1] + 1):
+            tree = AVLTree(entries)
+            left, right = tree.split(pivot)
+            with self.subTest(f"test split at {pivot}"):
+                self.assertListEqual(list(left.traverse()), [e for e in ordered if e < pivot])
+                self.assertListEqual(list(right.traverse()), [e for e in ordered if e >= pivot])
+                self.assertFalse(tree)
+                assert_avl_invariants(self, left.root)
+                assert_avl_invariants(self, right.root)
+
+    def test_split_keeps_key_function(self):
+        tree = AVLTree(range(10), key=lambda entry: -entry)
+        left, right = tree.split(4)
+
+        self.assertListEqual(list(left.traverse()), [9, 8, 7, 6, 5])
+        self.assertListEqual(list(right.traverse()), [4, 3, 2, 1, 0])
+        right.insert(-1)
+        self.assertEqual(right.max(), -1)
+
+    def test_join(self):
+        for left_size, right_size in ((0, 0), (0, 10), (10, 0), (1, 1), (100, 3), (3, 100),
+                                      (200, 250)):
+            left = AVLTree(range(left_size))
+            right = AVLTree(range(1000, 1000 + right_size))
+            joined = AVLTree.join(left, right)
+            with self.subTest(f"test join {left_size} and {right_size} entries"):
+                self.assertListEqual(list(joined.traverse()),
+                                     list(range(left_size)) + list(range(1000, 1000 + right_size)))
+                self.assertFalse(left)
+                self.assertFalse(right)
+                assert_avl_invariants(self, joined.root)
+
+    def test_join_overlapping_trees(self):
+        with self.assertRaises(ValueError):
+            AVLTree.join(AVLTree([1, 5]), AVLTree([3, 7]))
+        with self.assertRaises(ValueError):
+            AVLTree.join(AVLTree([1, 5]), AVLTree([5, 7]))
+        with self.assertRaises(ValueError):
+            AVLTree.join(AVLTree([1]), AVLTree([5], key=lambda entry: entry))
+        with self.assertRaises(ValueError):
+            AVLTree.join(AVLTree([1]), AVLTree([5], storage='pool'))
+
+    def test_split_then_join(self):
+        import random
+        random.seed(7477)
+
+        for _ in range(50):
+            entries = random.sample(range(1000), random.randint(0, 300))
+            tree = AVLTree(entries)
+            left, right = tree.split(random.randint(0, 1000))
+            joined = AVLTree.join(left, right)
+
+            self.assertListEqual(list(joined.traverse()), sorted(entries))
+            assert_avl_invariants(self, joined.root)
+
+    def test_set_operations(self):
+        import random
+        random.seed(1191)
+
+        for _ in range(30):
+            first = set(random.sample(range(500), random.randint(0, 200)))
+            second = set(random.sample(range(500), random.randint(0, 200)))
+            tree, other = AVLTree(first), AVLTree(second)
+            for result, expected in ((tree | other, first | second),
+                                     (tree & other, first & second),
+                                     (tree - other, first - second),
+                                     (tree ^ other, first ^ second)):
+                self.assertListEqual(list(result.traverse()), sorted(expected))
+                assert_avl_invariants(self, result.root)
+            self.assertListEqual(list(tree.traverse()), sorted(first))
+            self.assertListEqual(list(other.traverse()), sorted(second))
+
+    def test_set_operations_accept_iterables(self):
+        tree = AVLTree([1, 2, 3, 4])
+
+        self.assertListEqual(list(tree.union([4, 6, 5]).traverse()), [1, 2, 3, 4, 5, 6])
+        self.assertListEqual(list(tree.intersection({2, 4, 8}).traverse()), [2, 4])
+        self.assertListEqual(list(tree.difference(range(3)).traverse()), [3, 4])
+        self.assertListEqual(list(tree.symmetric_difference([0, 4]).traverse()), [0, 1, 2, 3])
+        with self.assertRaises(TypeError):
+            tree | [5]
+
+    def test_set_operations_results_are_independent(self):
+        tree, other = AVLTree(range(0, 20, 2)), AVLTree(range(0, 20, 3))
+        union = tree | other
+        union.insert(7)
+        union.delete(0)
+        union.delete(6)
+
+        self.assertListEqual(list(tree.traverse()), list(range(0, 20, 2)))
+        self.assertListEqual(list(other.traverse()), list(range(0, 20, 3)))
+
+        union = tree | other
+        tree.delete(4)
+        tree.insert(5)
+        left, right = other.split(9)
+        left.insert(1)
+        right.clear()
+        self.assertListEqual(list(union), sorted(set(range(0, 20, 2)) | set(range(0, 20, 3))))
+        assert_avl_invariants(self, union.root)
+        assert_avl_invariants(self, tree.root)
+
+    def test_set_operations_share_untouched_subtrees(self):
+        tree = AVLTree(range(1000))
+        union = tree | AVLTree([2000])
+
+        # Only the nodes on the right spine of tree are copied.
+        self.assertIs(union.root.left, tree.root.left)
+        self.assertListEqual(list(union), list(range(1000)) + [2000])
+
+    def test_set_operations_with_key_function(self):
+        tree = AVLTree(['a', 'bb', 'ccc'], key=len)
+        union = tree | AVLTree(['dd', 'eeee'], key=len)
+
+        self.assertListEqual(list(union.traverse()), ['a', 'bb', 'ccc', 'eeee'])
+        self.assertListEqual(list(tree.intersection(['xx', 'yyy']).traverse()), ['bb', 'ccc'])
+        self.assertListEqual(list((tree - AVLTree(['x'], key=len)).traverse()), ['bb', 'ccc'])
+
+    def test_set_operations_with_workers(self):
+        import avl_tree
+        first, second = set(range(0, 3000, 2)), set(range(0, 3000, 3))
+        threshold, avl_tree._PARALLEL_THRESHOLD = avl_tree._PARALLEL_THRESHOLD, 0
+        try:
+            for operation, expected in (('union', first | second),
+                                        ('intersection', first & second),
+                                        ('difference', first - second),
+                                        ('symmetric_difference', first ^ second)):
+                result = getattr(AVLTree(first), operation)(AVLTree(second), workers=3)
+                self.assertListEqual(list(result.traverse()), sorted(expected))
+                assert_avl_invariants(self, result.root)
+
+            result = AVLTree(['a', 'bb'], key=len).union(['xx', 'yyy'], workers=2)
+            self.assertListEqual(list(result.traverse()), ['a', 'bb', 'yyy'])
+        finally:
+            avl_tree._PARALLEL_THRESHOLD = threshold
+
+
+class PooledAvlTreeTest(unittest.TestCase):
+    def test_empty_tree(self):
+        tree = AVLTree(storage='pool')
+
+        self.assertFalse(tree)
+        self.assertEqual(len(tree), 0)
+        self.assertEqual(tree.height, 0)
+        self.assertNotIn(10, tree)
+        self.assertListEqual(list(tree.traverse()), [])
+
+    def test_invalid_storage(self):
+        with self.assertRaises(ValueError):
+            AVLTree(storage='disk')
+
+    def test_same_shape_as_node_storage(self):
+        import random
+        random.seed(7477)
+        tree = AVLTree()
+        pooled = AVLTree(storage='pool')
+
+        for _ in range(3000):
+            entry = random.randint(0, 500)
+            if entry in tree and random.random() < 0.5:
+                tree.delete(entry)
+                pooled.delete(entry)
+            else:
+                tree.insert(entry)
+                pooled.insert(entry)
+
+        for order in ('inorder', 'preorder', 'postorder', 'bfs'):
+            with self.subTest(f"test {order}"):
+                self.assertListEqual(list(pooled.traverse(order)), list(tree.traverse(order)))
+        self.assertEqual(len(pooled), len(tree))
+        self.assertEqual(pooled.height, tree.height)
+        self.assertEqual(pooled, tree)
+
+    def test_deleted_slots_are_reused(self):
+        tree = AVLTree(range(100), storage='pool')
+        pool_size = len(tree._entries)
+
+        for entry in range(0, 100, 2):
+            tree.delete(entry)
+        for entry in range(100, 150):
+            tree.insert(entry)
+
+        self.assertEqual(len(tree._entries), pool_size)
+        self.assertListEqual(list(tree.traverse()), list(range(1, 100, 2)) + list(range(100, 150)))
+
+    def test_delete_not_existent_entry(self):
+        with self.assertRaises(KeyError):
+            AVLTree([1, 2, 3], storage='pool').delete(10)
+        with self.assertRaises(KeyError):
+            AVLTree(storage='pool').delete(10)
+
+    def test_queries(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries, storage='pool')
+        ordered = sorted(entries)
+
+        self.assertEqual(tree.min(), ordered[0])
+        self.assertEqual(tree.max(), ordered[-1])
+        self.assertEqual(tree.search(ordered[3]), ordered[3])
+        self.assertEqual(tree.pred(ordered[3]), ordered[2])
+        self.assertEqual(tree.succ(ordered[3]), ordered[4])
+        self.assertEqual(tree.rank(ordered[3]), 3)
+        self.assertEqual(tree[-2], ordered[-2])
+        self.assertListEqual(tree[4:20:3], ordered[4:20:3])
+        self.assertListEqual(list(tree.irange(ordered[5], ordered[9])), ordered[5:9])
+        self.assertListEqual(list(tree.irange(ordered[5], ordered[9], reverse=True)),
+                             ordered[8:4:-1])
+        self.assertEqual(tree.count_range(ordered[5], ordered[9], (True, True)), 5)
+
+        with self.assertRaises(KeyError):
+            tree.search(ordered[-1] + 1)
+        with self.assertRaises(KeyError):
+            tree.pred(ordered[0])
+        with self.assertRaises(KeyError):
+            tree.succ(ordered[-1])
+
+    def test_build_and_copy(self):
+        import copy
+        original = AVLTree(get_random_entries())
+        pooled = AVLTree(original, storage='pool')
+
+        self.assertEqual(pooled, original)
+        self.assertEqual(AVLTree(pooled), original)
+        self.assertEqual(AVLTree.from_sorted(range(10), storage='pool'), AVLTree(range(10)))
+        self.assertEqual(repr(AVLTree([2, 1, 3], storage='pool')),
+                         "AVLTree([2, 1, 3], storage='pool')")
+
+        deep = copy.deepcopy(pooled)
+        deep.insert(10000)
+        self.assertNotIn(10000, pooled)
+
+    def test_key_function(self):
+        entries = [(entry, str(entry)) for entry in get_random_entries()]
+        tree = AVLTree(storage='pool', key=lambda entry: -entry[0])
+        for entry in entries:
+            tree.insert(entry)
+        ordered = sorted(entries, reverse=True)
+
+        self.assertListEqual(list(tree.traverse()), ordered)
+        self.assertEqual(tree.search((ordered[3][0], None)), ordered[3])
+        self.assertEqual(tree.pred(ordered[3]), ordered[2])
+        self.assertEqual(tree.succ(ordered[3]), ordered[4])
+        self.assertListEqual(list(tree.irange(ordered[2], ordered[6], reverse=True)),
+                             ordered[5:1:-1])
+
+        for entry in ordered[::2]:
+            tree.delete(entry)
+        self.assertListEqual(list(tree.traverse()), ordered[1::2])
+        self.assertListEqual(
+            list(AVLTree.from_sorted(ordered, storage='pool', key=lambda e: -e[0]).traverse()),
+            ordered)
+
+    def test_batch_operations(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries[::2], storage='pool')
+
+        tree.insert_many(entries[1::4])
+        expected = set(entries[::2]) | set(entries[1::4])
+        self.assertListEqual(list(tree.traverse()), sorted(expected))
+        self.assertListEqual(tree.contains_many(entries), [entry in expected for entry in entries])
+
+        tree.delete_many(entries[::3])
+        expected -= set(entries[::3])
+        self.assertListEqual(list(tree.traverse()), sorted(expected))
+        tree.insert(3)
+        tree.insert_many([1])
+        self.assertEqual(len(tree), len(expected | {1, 3}))
+
+    def test_split_and_join(self):
+        tree = AVLTree(range(100), storage='pool')
+        left, right = tree.split(40)
+
+        self.assertListEqual(list(left.traverse()), list(range(40)))
+        self.assertListEqual(list(right.traverse()), list(range(40, 100)))
+        self.assertFalse(tree)
+
+        joined = AVLTree.join(left, right)
+        self.assertListEqual(list(joined.traverse()), list(range(100)))
+        self.assertEqual(repr(AVLTree.join(AVLTree([1], storage='pool'),
+                                           AVLTree([2], storage='pool'))),
+                         "AVLTree([1, 2], storage='pool')")
+
+    def test_set_operations(self):
+        first, second = set(range(0, 60, 2)), set(range(0, 60, 3))
+        tree, other = AVLTree(first, storage='pool'), AVLTree(second, storage='pool')
+
+        self.assertListEqual(list((tree | other).traverse()), sorted(first | second))
+        self.assertListEqual(list((tree & other).traverse()), sorted(first & second))
+        self.assertListEqual(list((tree - other).traverse()), sorted(first - second))
+        self.assertListEqual(list((tree ^ other).traverse()), sorted(first ^ second))
+        self.assertListEqual(list(tree.union([1, 2]).traverse()), sorted(first | {1}))
+        self.assertEqual(repr(AVLTree([1], storage='pool') | AVLTree([2], storage='pool')),
+                         "AVLTree([1, 2], storage='pool')")
+
+    def test_floor_ceiling_lower_higher_nearest(self):
+        tree = AVLTree(range(0, 100, 10), storage='pool')
+
+        self.assertTupleEqual((tree.floor(35), tree.ceiling(35), tree.lower(30), tree.higher(30)),
+                              (30, 40, 20, 40))
+        self.assertTupleEqual((tree.floor(-1), tree.higher(90, 'x')), (None, 'x'))
+        self.assertTupleEqual((tree.nearest(34), tree.nearest(36), tree.nearest(-9)), (30, 40, 0))
+
+    def test_cursor(self):
+        tree = AVLTree(range(0, 100, 2), storage='pool')
+        cursor = tree.seek(31, 'le')
+
+        self.assertEqual(cursor.entry, 30)
+        self.assertTrue(cursor.prev())
+        self.assertEqual(cursor.entry, 28)
+        self.assertEqual(cursor.remove(), 28)
+        self.assertListEqual(list(cursor), list(range(30, 100, 2)))
+        self.assertFalse(cursor)
+        self.assertTrue(cursor.prev())
+        self.assertEqual(cursor.entry, 98)
+        self.assertNotIn(28, tree)
+
+    def test_iter_and_reversed(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries, storage='pool')
+
+        self.assertListEqual(list(tree), sorted(set(entries)))
+        self.assertListEqual(list(reversed(tree)), sorted(set(entries), reverse=True))
+        self.assertListEqual(list(reversed(AVLTree(storage='pool'))), [])
+
+    def test_clear(self):
+        tree = AVLTree([1, 2, 3, 4, 5], storage='pool')
+        tree.clear()
+
+        self.assertFalse(tree)
+        self.assertListEqual(list(tree.traverse()), [])
+
+
+class PersistentAvlTreeTest(unittest.TestCase):
+    def test_insert_and_delete(self):
+        entries = get_random_entries()
+        tree = PersistentAVLTree()
+        for entry in entries:
+            tree.insert(entry)
+            assert_avl_invariants(self, tree.root)
+        self.assertListEqual(list(tree.traverse()), sorted(set(entries)))
+
+        for entry in entries[::2]:
+            tree.delete(entry)
+            assert_avl_invariants(self, tree.root)
+        self.assertListEqual(list(tree.traverse()), sorted(set(entries) - set(entries[::2])))
+        with self.assertRaises(KeyError):
+            tree.delete(entries[0])
+
+    def test_snapshots_are_not_affected_by_later_changes(self):
+        import random
+        random.seed(1213)
+        tree = PersistentAVLTree()
+        expected, snapshots = set(), []
+
+        for _ in range(300):
+            entry = random.randrange(200)
+            if entry in expected:
+                tree.delete(entry)
+                expected.remove(entry)
+            else:
+                tree.insert(entry)
+                expected.add(entry)
+            snapshots.append((tree.snapshot(), sorted(expected)))
+
+        tree.clear()
+        for snapshot, entries in snapshots:
+            self.assertListEqual(list(snapshot.traverse()), entries)
+            assert_avl_invariants(self, snapshot.root)
+
+    def test_changes_copy_only_the_path(self):
+        def nodes(node):
+            return {id(node)} | nodes(node.left) | nodes(node.right) if node else set()
+
+        tree = PersistentAVLTree(range(0, 2000, 2))
+        snapshot = tree.snapshot()
+        for change in (lambda: tree.insert(1001), lambda: tree.delete(1000)):
+            before = nodes(tree.root)
+            change()
+            self.assertLessEqual(len(nodes(tree.root) - before), 2 * tree.height)
+        self.assertListEqual(list(snapshot.traverse()), list(range(0, 2000, 2)))
+
+    def test_snapshot_can_be_changed_independently(self):
+        tree = PersistentAVLTree([1, 2, 3], key=lambda entry: -entry)
+        snapshot = tree.snapshot()
+        snapshot.insert(4)
+        tree.delete(2)
+
+        self.assertListEqual(list(tree.traverse()), [3, 1])
+        self.assertListEqual(list(snapshot.traverse()), [4, 3, 2, 1])
+
+    def test_set_operations_share_nodes(self):
+        tree, other = PersistentAVLTree(range(0, 50, 2)), PersistentAVLTree(range(0, 50, 3))
+        union = tree | other
+        union.insert(1)
+        union.delete(0)
+
+        self.assertIsInstance(union, PersistentAVLTree)
+        self.assertListEqual(list(tree.traverse()), list(range(0, 50, 2)))
+        self.assertListEqual(list(other.traverse()), list(range(0, 50, 3)))
+
+    def test_cursor_remove_keeps_snapshots(self):
+        tree = PersistentAVLTree(range(10))
+        snapshot = tree.snapshot()
+        cursor = tree.seek(3)
+        cursor.remove()
+        cursor.remove()
+
+        self.assertEqual(cursor.entry, 5)
+        self.assertListEqual(list(tree), [0, 1, 2, 5, 6, 7, 8, 9])
+        self.assertListEqual(list(snapshot), list(range(10)))
+
+    def test_only_node_storage(self):
+        with self.assertRaises(ValueError):
+            PersistentAVLTree([1, 2], storage='pool')
+
+
+class ConcurrentAvlTreeTest(unittest.TestCase):
+    def test_reads_and_writes(self):
+        tree = ConcurrentAVLTree([5, 1, 3])
+        tree.insert(4)
+        tree.insert_many([7, 6])
+        tree.delete(1)
+        tree.delete_many([6, 8])
+
+        self.assertListEqual(list(tree.traverse()), [3, 4, 5, 7])
+        self.assertEqual(len(tree), 4)
+        self.assertIn(4, tree)
+        self.assertNotIn(1, tree)
+        self.assertEqual(tree.search(5), 5)
+        self.assertListEqual(list(tree.irange(4, 7, reverse=True)), [5, 4])
+        self.assertEqual(tree.count_range(4), 3)
+        self.assertEqual((tree.rank(5), tree.select(1), tree[-1], tree[1:3]), (2, 4, 7, [4, 5]))
+        self.assertEqual((tree.pred(5), tree.succ(5), tree.min(), tree.max()), (4, 7, 3, 7))
+        self.assertEqual((tree.floor(6), tree.ceiling(6), tree.lower(3), tree.higher(7, 0)),
+                         (5, 7, None, 0))
+        self.assertEqual(tree.nearest(6.5), 7)
+        self.assertListEqual(tree.contains_many([3, 2]), [True, False])
+        self.assertEqual(repr(tree), 'ConcurrentAVLTree([4, 3, 5, 7])')
+
+        tree.clear()
+        self.assertFalse(tree)
+        self.assertEqual(tree.height, 0)
+
+    def test_failed_write_keeps_current_version(self):
+        tree = ConcurrentAVLTree([1, 2], key=lambda entry: -entry)
+        with self.assertRaises(KeyError):
+            tree.delete(3)
+        self.assertListEqual(list(tree.traverse()), [2, 1])
+
+    def test_traversal_sees_a_single_version(self):
+        tree = ConcurrentAVLTree(range(10))
+        entries = tree.traverse()
+        snapshot = tree.snapshot()
+        tree.insert_many(range(10, 20))
+        snapshot.insert(-1)
+
+        self.assertListEqual(list(entries), list(range(10)))
+        self.assertNotIn(-1, tree)
+        self.assertEqual(len(tree), 20)
+
+    def test_readers_run_alongside_writers(self):
+        from concurrent.futures import ThreadPoolExecutor
+        tree = ConcurrentAVLTree()
+        size = 2000
+
+        def write(entries):
+            for entry in entries:
+                tree.insert(entry)
+
+        def read():
+            while len(tree) < size:
+                # Entries are inserted in increasing order, so every version is a prefix.
+                entries = list(tree.traverse())
+                self.assertListEqual(entries, list(range(len(entries))))
+
+        with ThreadPoolExecutor(4) as executor:
+            readers = [executor.submit(read) for _ in range(2)]
+            writer = executor.submit(write, range(size))
+            for future in readers + [writer]:
+                future.result()
+
+        self.assertListEqual(list(tree.traverse()), list(range(size)))
+        assert_avl_invariants(self, tree.snapshot().root)
+
+
+class MultisetAvlTreeTest(unittest.TestCase):
+    def test_insert_and_delete_count_duplicates(self):
+        import random
+        from collections import Counter
+        random.seed(1217)
+        tree, counter = AVLTree(duplicates='count'), Counter()
+
+        for _ in range(2000):
+            entry = random.randrange(100)
+            if random.random() < 0.4 and counter[entry]:
+                tree.delete(entry)
+                counter[entry] -= 1
+            else:
+                tree.insert(entry)
+                counter[entry] += 1
+        expected = sorted(counter.elements())
+
+        self.assertListEqual(list(tree.traverse()), expected)
+        self.assertListEqual(list(reversed(tree)), expected[::-1])
+        self.assertEqual(len(tree), len(expected))
+        self.assertEqual(len(list(tree.traverse('bfs'))), len(expected))
+        assert_avl_invariants(self, tree.root)
+        for entry in range(100):
+            self.assertEqual(tree.count(entry), counter[entry])
+            if counter[entry]:
+                self.assertEqual(tree.rank(entry), expected.index(entry))
+        with self.assertRaises(KeyError):
+            tree.delete(100)
+
+    def test_positions_and_ranges(self):
+        entries = [5, 1, 3, 3, 5, 3, 7, 5]
+        tree = AVLTree(entries, duplicates='count')
+        expected = sorted(entries)
+
+        for index in range(-len(expected), len(expected)):
+            self.assertEqual(tree[index], expected[index])
+            self.assertListEqual(tree[index:], expected[index:])
+        self.assertListEqual(list(tree.irange(3, 5)), [3, 3, 3])
+        self.assertListEqual(list(tree.irange(3, 5, inclusive=(False, True), reverse=True)),
+                             [5, 5, 5])
+        self.assertEqual(tree.count_range(3, 7), 6)
+        self.assertEqual(repr(tree), "AVLTree([3, 3, 3, 1, 5, 5, 5, 7], duplicates='count')")
+        self.assertEqual(AVLTree([3, 3, 3, 1, 5, 5, 5, 7], duplicates='count'), tree)
+
+    def test_first_entry_of_a_key_is_kept(self):
+        tree = AVLTree(['b', 'a'], key=str.lower, duplicates='count')
+        tree.insert('B')
+        tree.insert_many(['A', 'c'])
+
+        self.assertListEqual(list(tree), ['a', 'a', 'b', 'b', 'c'])
+        self.assertEqual(tree.count('A'), 2)
+
+    def test_sorted_input_and_copies(self):
+        tree = AVLTree.from_sorted([1, 1, 2, 3, 3, 3], duplicates='count')
+        with self.assertRaises(ValueError):
+            AVLTree.from_sorted([2, 1], duplicates='count')
+
+        self.assertListEqual([tree.count(entry) for entry in (1, 2, 3)], [2, 1, 3])
+        assert_avl_invariants(self, tree.root)
+        self.assertListEqual(list(AVLTree(tree, duplicates='count')), [1, 1, 2, 3, 3, 3])
+        self.assertListEqual(list(AVLTree(tree)), [1, 2, 3])
+
+    def test_dump_and_load(self):
+        import io
+        fp = io.BytesIO()
+        AVLTree([1, 2, 2, 3, 3, 3], duplicates='count').dump(fp)
+        fp.seek(0)
+        tree = AVLTree.load(fp, duplicates='count')
+
+        self.assertListEqual([tree.count(entry) for entry in (1, 2, 3)], [1, 2, 3])
+
+    def test_load_rejects_another_duplicates_mode(self):
+        import io
+        fp = io.BytesIO()
+        AVLTree([1, 2, 2, 3], duplicates='count').dump(fp)
+        fp.seek(0)
+        with self.assertRaises(ValueError):
+            AVLTree.load(fp)
+
+        fp = io.BytesIO()
+        AVLTree([1, 2, 3]).dump(fp)
+        fp.seek(0)
+        with self.assertRaises(ValueError):
+            AVLTree.load(fp, duplicates='count')
+
+    def test_cursor_remove_one_occurrence(self):
+        tree = AVLTree([1, 2, 2, 3], duplicates='count')
+        cursor = tree.seek(2)
+        cursor.remove()
+
+        self.assertEqual(cursor.entry, 2)
+        cursor.remove()
+        self.assertEqual(cursor.entry, 3)
+        self.assertListEqual(list(tree), [1, 3])
+
+    def test_cursor_repeats_entries(self):
+        tree = AVLTree([1, 2, 2, 2, 3, 3], duplicates='count')
+        self.assertListEqual(list(tree.seek(2)), [2, 2, 2, 3, 3])
+        self.assertListEqual(list(tree.seek(2, 'le')), [2, 3, 3])
+
+        cursor = tree.seek(3, 'le')
+        seen = [cursor.entry]
+        while cursor.prev():
+            seen.append(cursor.entry)
+        self.assertListEqual(seen, [3, 3, 2, 2, 2, 1])
+
+        cursor = tree.seek(2)
+        cursor.next()
+        self.assertEqual(cursor.remove(), 2)
+        self.assertEqual(cursor.entry, 2)
+        cursor.next()
+        self.assertEqual(cursor.entry, 3)
+        self.assertListEqual(list(tree), [1, 2, 2, 3, 3])
+
+    def test_split_and_join_keep_counts(self):
+        tree = AVLTree([1, 2, 2, 3, 3, 3, 4], duplicates='count')
+        left, right = tree.split(3)
+
+        self.assertListEqual(list(left), [1, 2, 2])
+        self.assertListEqual(list(right), [3, 3, 3, 4])
+        joined = AVLTree.join(left, right)
+        self.assertEqual(len(joined), 7)
+        assert_avl_invariants(self, joined.root)
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            AVLTree(duplicates='keep')
+        with self.assertRaises(ValueError):
+            AVLTree(storage='pool', duplicates='count')
+        with self.assertRaises(TypeError):
+            AVLTree([1], duplicates='count') | AVLTree([2], duplicates='count')
+        self.assertEqual(AVLTree([1, 2]).count(2), 1)
+        self.assertEqual(AVLTree([1, 2], storage='pool').count(3), 0)
+
+
+class TypedAvlTreeTest(unittest.TestCase):
+    def test_matches_the_node_storage(self):
+        import random
+        random.seed(6007)
+        for dtype, scale in (('int64', 1), ('float64', 0.5)):
+            tree, plain = AVLTree(dtype=dtype), AVLTree()
+            for _ in range(3000):
+                entry = random.randrange(-500, 500) * scale
+                if entry in tree:
+                    tree.delete(entry)
+                    plain.delete(entry)
+                else:
+                    tree.insert(entry)
+                    plain.insert(entry)
+
+            with self.subTest(f"test {dtype}"):
+                self.assertEqual(tree, plain)
+                self.assertListEqual(list(tree), list(plain))
+                for order in ('inorder', 'preorder', 'postorder', 'bfs'):
+                    self.assertListEqual(list(tree.traverse(order)), list(plain.traverse(order)))
+                for lo, hi, inclusive, reverse in ((-50, 70, (True, False), False),
+                                                   (None, 5, (True, True), True),
+                                                   (3, None, (False, True), False),
+                                                   (10, -10, (True, False), False)):
+                    self.assertListEqual(list(tree.irange(lo, hi, inclusive, reverse)),
+                                         list(plain.irange(lo, hi, inclusive, reverse)))
+
+    def test_options(self):
+        self.assertEqual(repr(AVLTree([3, 1, 2], dtype='float64')),
+                         "AVLTree([2.0, 1.0, 3.0], dtype='float64')")
+        self.assertListEqual(list(AVLTree.from_sorted([1, 2, 2, 3], dtype='int64')), [1, 2, 3])
+        with self.assertRaises(ValueError):
+            AVLTree(dtype='int32')
+        with self.assertRaises(ValueError):
+            AVLTree(dtype='int64', key=abs)
+        with self.assertRaises(TypeError):
+            AVLTree([1.5], dtype='int64')
+
+        tree = AVLTree([1, 2], dtype='int64')
+        tree.delete(1)
+        with self.assertRaises(TypeError):
+            tree.insert(2.5)
+        tree.insert(7)
+        self.assertListEqual(list(tree), [2, 7])
+        self.assertListEqual(list(tree.split(5)[1]), [7])
+
+    def test_without_numpy(self):
+        from array import array
+        from unittest import mock
+        with mock.patch('avl_tree.np', None):
+            tree = AVLTree([5, 1, 3, 9], dtype='int64')
+            traversed, ranged = tree.traverse('preorder'), tree.irange(2, 9, reverse=True)
+
+        self.assertEqual((traversed, ranged), (array('q', [3, 1, 5, 9]), array('q', [5, 3])))
+
+    @unittest.skipIf(np is None, "NumPy is not installed")
+    def test_numpy_arrays(self):
+        tree = AVLTree(np.array([9, 3, 3, 7, 1]), dtype='int64')
+
+        self.assertListEqual(list(tree), [1, 3, 7, 9])
+        traversed = tree.traverse()
+        self.assertIsInstance(traversed, np.ndarray)
+        self.assertEqual(traversed.dtype, np.int64)
+        self.assertListEqual(traversed.tolist(), [1, 3, 7, 9])
+        self.assertListEqual(tree.irange(2, 8).tolist(), [3, 7])
+        self.assertListEqual(tree.irange(8, 2).tolist(), [])
+
+        tree.insert_many(np.array([4, 3]))
+        tree.insert_many(np.arange(0, 30, 2))
+        expected = sorted({1, 3, 4, 7, 9} | set(range(0, 30, 2)))
+        self.assertListEqual(tree.traverse().tolist(), expected)
+        # Merged then rebuilt in O(n), with the very shape of a tree built from sorted entries.
+        built = AVLTree.from_sorted(expected)
+        self.assertListEqual(tree.traverse('bfs').tolist(), list(built.traverse('bfs')))
+        self.assertEqual((tree.height, tree.rank(10), tree[5]), (built.height, 9, 6))
+        with self.assertRaises(TypeError):
+            tree.insert_many(np.linspace(0, 1, 100))
+
+        empty = AVLTree(np.array([]), dtype='int64')
+        self.assertListEqual(list(empty), [])
+        empty.insert_many(np.array([]))
+        tree.insert_many(np.array([]))
+        self.assertListEqual(list(empty), [])
+        self.assertListEqual(tree.traverse().tolist(), expected)
+
+        floats = AVLTree(np.arange(5), dtype='float64')
+        self.assertEqual(floats.traverse('bfs').dtype, np.float64)
+        self.assertListEqual(floats.traverse('bfs').tolist(), [2.0, 0.0, 3.0, 1.0, 4.0])
+
+
+class StatsAvlTreeTest(unittest.TestCase):
+    def test_same_tree_as_without_stats(self):
+        import random
+        random.seed(4099)
+        tree, plain = AVLTree(stats=True), AVLTree()
+
+        for _ in range(2000):
+            entry = random.randrange(300)
+            if entry in tree:
+                tree.delete(entry)
+                plain.delete(entry)
+            else:
+                tree.insert(entry)
+                plain.insert(entry)
+
+        self.assertListEqual(list(tree.traverse('bfs')), list(plain.traverse('bfs')))
+        assert_avl_invariants(self, tree.root)
+        stats = tree.stats()
+        self.assertEqual(stats['searches'], 2000)
+        self.assertEqual(stats['inserts'] + stats['deletes'], 2000)
+        self.assertEqual(stats['nodes_allocated'] - stats['nodes_freed'], len(tree))
+        self.assertLessEqual(stats['max_path_length'], 2 * tree.height)
+
+    def test_rotations(self):
+        # One comparison per node on the way down, plus one for equality unless every key
+        # on the way was greater.
+        for entries, rotation, comparisons in (([1, 2, 3], 'rotations_left', 5),
+                                               ([3, 2, 1], 'rotations_right', 3),
+                                               ([3, 1, 2], 'rotations_left_right', 4),
+                                               ([1, 3, 2], 'rotations_right_left', 5)):
+            with self.subTest(f"test {rotation}"):
+                tree = AVLTree(stats=True)
+                for entry in entries:
+                    tree.insert(entry)
+                stats = tree.stats()
+                self.assertEqual(stats[rotation], 1)
+                self.assertEqual(sum(stats[name] for name in stats
+                                     if name.startswith('rotations')), 1)
+                self.assertEqual((stats['comparisons'], stats['path_length']), (comparisons, 3))
+
+    def test_hook_and_reset(self):
+        calls = []
+        tree = AVLTree([1, 2, 3], stats=lambda operation, counts: calls.append(
+            (operation, counts['comparisons'], counts['path_length'], counts['nodes_freed'])))
+        tree.stats(reset=True)
+
+        self.assertIn(3, tree)
+        tree.delete(2)
+        with self.assertRaises(KeyError):
+            tree.delete(5)
+        self.assertListEqual(calls, [('search', 3, 2, 0), ('delete', 3, 3, 1),
+                                     ('delete', 3, 2, 0)])
+        self.assertEqual(tree.stats(reset=True)['deletes'], 2)
+        self.assertEqual(tree.stats()['deletes'], 0)
+        tree.clear()
+        self.assertEqual(tree.stats()['nodes_freed'], 2)
+
+    def test_derived_trees_keep_the_hook(self):
+        calls = []
+        tree = AVLTree(range(10), stats=lambda operation, counts: calls.append(operation))
+        left, right = tree.split(5)
+        # Small inputs are joined into the union, comparable ones merged into a new tree.
+        joined, merged = left | AVLTree([20], stats=True), left | AVLTree([7, 8], stats=True)
+        for derived in (left, right, joined, merged,
+                        joined.difference(AVLTree(range(100), stats=True))):
+            with self.subTest(f"test {derived!r}"):
+                del calls[:]
+                derived.insert(30)
+                self.assertIn(30, derived)
+                self.assertListEqual(calls, ['insert', 'search'])
+                self.assertEqual(derived.stats()['inserts'], 1)
+
+    def test_not_enabled(self):
+        with self.assertRaises(TypeError):
+            AVLTree([1]).stats()
+        with self.assertRaises(ValueError):
+            AVLTree(storage='pool', stats=True)
+        with self.assertRaises(ValueError):
+            AVLTree(duplicates='count', stats=True)
+
+
+class AugmentedAvlTreeTest(unittest.TestCase):
+    def test_aggregate_sum_and_max(self):
+        import operator
+        import random
+        random.seed(6113)
+        for monoid, reduce in ((Monoid(operator.add, 0), sum),
+                               (Monoid(max, -1), lambda values: max(values, default=-1))):
+            with self.subTest(f"test {monoid.combine.__name__}"):
+                tree, entries = AVLTree(monoid=monoid), set()
+                for _ in range(2000):
+                    entry = random.randrange(300)
+                    if entry in entries:
+                        tree.delete(entry)
+                        entries.remove(entry)
+                    else:
+                        tree.insert(entry)
+                        entries.add(entry)
+
+                assert_avl_invariants(self, tree.root)
+                self.assertEqual(tree.aggregate(), reduce(entries))
+                for _ in range(200):
+                    lo, hi = sorted(random.sample(range(-10, 310), 2))
+                    self.assertEqual(tree.aggregate(lo, hi),
+                                     reduce([entry for entry in entries if lo <= entry < hi]))
+                    self.assertEqual(tree.aggregate(lo, hi, inclusive=(False, True)),
+                                     reduce([entry for entry in entries if lo < entry <= hi]))
+                self.assertEqual(tree.aggregate(200, 100), monoid.identity)
+
+    def test_aggregate_keeps_the_order(self):
+        import operator
+        import random
+        random.seed(1559)
+        # Concatenation is not commutative, so every value must be combined in order.
+        tree = AVLTree(key=lambda entry: entry[0],
+                       monoid=Monoid(operator.add, '', value=lambda entry: entry[1]))
+        for number in random.sample(range(500), 500):
+            tree.insert((number, f'{number},'))
+        for number in range(0, 500, 3):
+            tree.delete((number, None))
+
+        expected = ''.join(f'{number},' for number in range(500) if number % 3)
+        self.assertEqual(tree.aggregate(), expected)
+        self.assertEqual(tree.aggregate((100,), (200,), inclusive=(True, True)),
+                         ''.join(f'{number},' for number in range(100, 201) if number % 3))
+
+    def test_aggregate_after_other_operations(self):
+        import copy
+        import operator
+        import pickle
+        monoid = Monoid(operator.add, 0)
+        tree = AVLTree.from_sorted(range(100), monoid=monoid)
+        tree.insert_many(range(50, 250))
+        self.assertEqual(tree.aggregate(), sum(range(250)))
+        self.assertEqual(pickle.loads(pickle.dumps(tree)).aggregate(10, 20), sum(range(10, 20)))
+        self.assertEqual(copy.deepcopy(tree).aggregate(hi=30), sum(range(30)))
+
+        union = tree.union([1000, 2000])
+        self.assertEqual(union.aggregate(200), sum(range(200, 250)) + 3000)
+        difference = tree.difference(range(0, 250, 2))
+        self.assertEqual(difference.aggregate(), sum(range(1, 250, 2)))
+
+        left, right = tree.split(120)
+        self.assertEqual((left.aggregate(), right.aggregate()),
+                         (sum(range(120)), sum(range(120, 250))))
+        joined = AVLTree.join(right, AVLTree([300, 400], monoid=monoid))
+        self.assertEqual(joined.aggregate(), sum(range(120, 250)) + 700)
+        assert_avl_invariants(self, joined.root)
+        with self.assertRaises(ValueError):
+            AVLTree.join(left, AVLTree([300], monoid=Monoid(max, 0)))
+
+    def test_not_enabled(self):
+        import operator
+        monoid = Monoid(operator.add, 0)
+        with self.assertRaises(TypeError):
+            AVLTree([1]).aggregate()
+        for options in ({'storage': 'pool'}, {'duplicates': 'count'}, {'stats': True},
+                        {'dtype': 'int64'}):
+            with self.subTest(f"test {options}"):
+                with self.assertRaises(ValueError):
+                    AVLTree(monoid=monoid, **options)
+
+
+class FrozenAvlTreeTest(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def dump(self, *trees):
+        import os
+        path = os.path.join(self.directory.name, 'trees.avl')
+        with open(path, 'wb') as fp:
+            offsets = []
+            for tree in trees:
+                offsets.append(fp.tell())
+                tree.dump(fp)
+        return path, offsets
+
+    def test_lookups_match_the_dumped_tree(self):
+        entries = get_random_entries()
+        tree = AVLTree(entries)
+        path, _ = self.dump(tree)
+
+        with FrozenAVLTree.open(path) as frozen:
+            self.assertEqual(len(frozen), len(tree))
+            self.assertListEqual(list(frozen), list(tree))
+            self.assertListEqual(list(reversed(frozen)), list(reversed(tree)))
+            for entry in range(min(entries) - 2, max(entries) + 3):
+                self.assertEqual(entry in frozen, entry in tree)
+                self.assertEqual(frozen.rank(entry), tree.rank(entry))
+                self.assertEqual(frozen.floor(entry), tree.floor(entry))
+                self.assertEqual(frozen.higher(entry), tree.higher(entry))
+                for method in ('search', 'pred', 'succ'):
+                    try:
+                        expected = getattr(tree, method)(entry)
+                    except KeyError:
+                        with self.assertRaises(KeyError):
+                            getattr(frozen, method)(entry)
+                    else:
+                        self.assertEqual(getattr(frozen, method)(entry), expected)
+            lo, hi = sorted(entries)[10], sorted(entries)[40]
+            self.assertListEqual(list(frozen.irange(lo, hi, reverse=True)),
+                                 list(tree.irange(lo, hi, reverse=True)))
+            self.assertEqual(frozen.count_range(lo, hi, (False, True)),
+                             tree.count_range(lo, hi, (False, True)))
+            self.assertEqual((frozen[3], frozen[-1], frozen[2:9:3]),
+                             (tree[3], tree[-1], tree[2:9:3]))
+
+    def test_strings_bytes_and_offsets(self):
+        path, offsets = self.dump(AVLTree(['pear', 'apple', 'fig']), AVLTree([b'\x00', b'z']),
+                                  AVLTree([2.5, 1.0]))
+
+        with FrozenAVLTree.open(path, offsets[0]) as frozen:
+            self.assertListEqual(list(frozen), ['apple', 'fig', 'pear'])
+            self.assertEqual(frozen.ceiling('b'), 'fig')
+            self.assertNotIn('grape', frozen)
+        with FrozenAVLTree.open(path, offsets[1]) as frozen:
+            self.assertEqual(frozen.search(b'z'), b'z')
+        with FrozenAVLTree.open(path, offsets[2]) as frozen:
+            self.assertEqual((frozen.min(), frozen.max()), (1.0, 2.5))
+
+    def test_key_function(self):
+        path, _ = self.dump(AVLTree(['bb', 'a', 'ccc'], key=len))
+        frozen = FrozenAVLTree.open(path, key=len)
+
+        self.assertEqual(frozen.search('xx'), 'bb')
+        self.assertListEqual(list(frozen.irange('x', 'xxx', inclusive=(True, True))),
+                             ['a', 'bb', 'ccc'])
+        frozen.close()
+        with self.assertRaises(ValueError):
+            FrozenAVLTree.open(path)
+
+    def test_invalid_file(self):
+        import os
+        path = os.path.join(self.directory.name, 'invalid')
+        with open(path, 'wb') as fp:
+            fp.write(b'not a tree at all')
+
+        with self.assertRaises(ValueError):
+            FrozenAVLTree.open(path)
+
+
+@unittest.skipIf(avl_tree._speedups is None, "The compiled extension is not built")
+class SpeedupsTest(unittest.TestCase):
+    def test_pure_python_backend(self):
+        import os
+        import subprocess
+        import sys
+        environment = dict(os.environ, AVL_TREE_PURE_PYTHON='1')
+        result = subprocess.run([sys.executable, '-m', 'unittest', '-q', 'test_avl_tree'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=environment, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True)
+
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+    def test_rejects_other_objects(self):
+        with self.assertRaises(TypeError):
+            avl_tree._speedups.find(object(), 1)
+        with self.assertRaises(TypeError):
+            list(avl_tree._speedups.inorder([1, 2]))
+
+    def test_comparison_errors(self):
+        tree = AVLTree([1, 2, 3])
+
+        with self.assertRaises(TypeError):
+            tree.insert('a')
+        with self.assertRaises(TypeError):
+            'a' in tree
+        self.assertListEqual(list(tree), [1, 2, 3])
+
+
+class AVLMapTest(unittest.TestCase):
+    def test_empty_map(self):
+        mapping = AVLMap()
+
+        self.assertFalse(mapping)
+        self.assertEqual(len(mapping), 0)
+        self.assertNotIn(1, mapping)
+        self.assertListEqual(list(mapping), [])
+
+    def test_set_and_get(self):
+        mapping = AVLMap()
+        mapping[3] = 'c'
+        mapping[1] = 'a'
+        mapping.put(2, 'b')
+
+        self.assertEqual(mapping[1], 'a')
+        self.assertEqual(mapping[2], 'b')
+        self.assertEqual(mapping.get(3), 'c')
+        self.assertIsNone(mapping.get(4))
+        self.assertEqual(len(mapping), 3)
+
+        with self.assertRaises(KeyError) as context:
+            mapping[4]
+        self.assertEqual(context.exception.args, (4,))
+
+    def test_update_value_in_place(self):
+        mapping = AVLMap({1: 'a', 2: 'b'})
+        mapping[1] = 'z'
+
+        self.assertEqual(mapping[1], 'z')
+        self.assertEqual(len(mapping), 2)
+
+    def test_setdefault(self):
+        mapping = AVLMap({1: 'a'})
+
+        self.assertEqual(mapping.setdefault(1, 'z'), 'a')
+        self.assertEqual(mapping.setdefault(2, 'b'), 'b')
+        self.assertEqual(mapping.setdefault(3), None)
+        self.assertDictEqual(dict(mapping), {1: 'a', 2: 'b', 3: None})
+
+    def test_delete_keeps_values_with_their_keys(self):
+        entries = get_random_entries()
+        mapping = AVLMap((entry, str(entry)) for entry in entries)
+
+        for entry in entries[::2]:
+            del mapping[entry]
+
+        remaining = sorted(entries[1::2])
+        self.assertListEqual(list(mapping.items()), [(key, str(key)) for key in remaining])
+        with self.assertRaises(KeyError):
+            del mapping[entries[0]]
+
+    def test_views_are_sorted(self):
+        entries = get_random_entries()
+        mapping = AVLMap((entry, -entry) for entry in entries)
+        ordered = sorted(entries)
+
+        self.assertListEqual(list(mapping), ordered)
+        self.assertListEqual(list(mapping.keys()), ordered)
+        self.assertListEqual(list(mapping.values()), [-key for key in ordered])
+        self.assertListEqual(list(mapping.items()), [(key, -key) for key in ordered])
+        self.assertListEqual(list(reversed(mapping)), ordered[::-1])
+        self.assertListEqual(list(reversed(mapping.keys())), ordered[::-1])
+        self.assertListEqual(list(reversed(mapping.values())), [-key for key in ordered[::-1]])
+        self.assertListEqual(list(reversed(mapping.items())),
+                             [(key, -key) for key in ordered[::-1]])
+        self.assertIn((ordered[0], -ordered[0]), mapping.items())
+        self.assertIn(-ordered[0], mapping.values())
+
+    def test_mapping_protocol(self):
+        mapping = AVLMap([(2, 'b'), (1, 'a')])
+
+        self.assertEqual(mapping, {1: 'a', 2: 'b'})
+        self.assertEqual(AVLMap({'y': 2}, x=1), {'x': 1, 'y': 2})
+        self.assertEqual(mapping.pop(1), 'a')
+        self.assertEqual(mapping.pop(1, None), None)
+        mapping.update({5: 'e'})
+        self.assertEqual(mapping.popitem(), (2, 'b'))
+
+    def test_copy(self):
+        mapping = AVLMap({2: 'b', 1: 'a', 3: 'c'})
+        copy = mapping.copy()
+        copy[4] = 'd'
+
+        self.assertEqual(repr(mapping), "AVLMap({1: 'a', 2: 'b', 3: 'c'})")
+        self.assertEqual(repr(copy), "AVLMap({1: 'a', 2: 'b', 3: 'c', 4: 'd'})")
+        self.assertEqual(AVLMap(mapping), mapping)
+
+    def test_clear(self):
+        mapping = AVLMap({1: 'a', 2: 'b'})
+        mapping.clear()
+
+        self.assertFalse(mapping)
+        self.assertDictEqual(dict(mapping), {})
+
+
+def assert_avl_invariants(test_case, node):
+    """Checks heights, sizes, balance factors and ordering of every node in the subtree."""
+    if not node:
+        return
+    assert_avl_invariants(test_case, node.left)
+    assert_avl_invariants(test_case, node.right)
+    test_case.assertEqual(node.height, 1 + max(node.left.height, node.right.height))
+    test_case.assertEqual(node.size,
+                          getattr(node, 'count', 1) + node.left.size + node.right.size)
+    test_case.assertIn(node.balance_factor, (-1, 0, 1))
+    if node.left:
+        test_case.assertLess(node.left.key, node.key)
+    if node.right:
+        test_case.assertGreater(node.right.key, node.key)
+
 
 def get_random_entries():
     from random import randint, shuffle, seed